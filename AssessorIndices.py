@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Assessor de índices para as tabelas do GECOBI que o ReguaTotal consulta.
+
+  1. Coleta o EXPLAIN de todas as SQL_* do app (mesma formatação da carga)
+     e aponta varreduras completas, filesort e tabelas temporárias.
+  2. Para cada tabela com problema, propõe os índices compostos/cobrindo do
+     catálogo INDICES (revisados à mão: colunas na ordem dos filtros de
+     igualdade, depois faixa, depois as colunas lidas).
+  3. Gera o pacote de DDL para o DBA (criação online + rollback).
+  4. Na base local (BaseLocal.py), mede as consultas sem e com os índices e
+     reporta o ganho de tempo e de linhas examinadas.
+
+    REGUA_CRED_FILE=local.txt python AssessorIndices.py [--ddl indices_gecobi.sql] [--sem-benchmark]
+"""
+import argparse, json
+from datetime import date
+
+import ReguaTotal as rt
+from BaseLocal import checar_local, conectar
+from ComparadorSQL import ORIGINAIS, VARIANTES, amostra_cod_cad, lotes_params, medir, montar
+
+# (nome, tabela, colunas, consultas atendidas, motivo)
+INDICES = [
+    ("ix_cad_cli_st_usu", "cadastros_tb", "cod_cli, stcli, cod_usu, nmcont",
+     ("main", "cpc", "nao", "perfil", "operadores"),
+     "todas filtram cod_cli IN (...) AND stcli <> 'INA' e juntam usu_tb por cod_usu; "
+     "com nmcont (e a PK cod_cad implícita) NAO e operadores não leem a linha"),
+    ("ix_hist_cli_data", "hist_tb", "cod_cli, data_at, ocorr, cod_usu",
+     ("main", "cpc", "nao", "tempo"),
+     "hist_tb é juntada por cod_cli com faixa em data_at; ocorr e cod_usu completam o "
+     "índice cobrindo (acion, MAX(data_at) do CPC e o anti-join do NAO); com a PK "
+     "cod_hist implícita atende o keyset (data_at, cod_hist) da linha do tempo"),
+    ("ix_aco_cli_cad", "acordos_tb", "cod_cli, data_cad, nmcont, cod_aco, staco",
+     ("qr",),
+     "filtro cod_cli IN (...) + data_cad >= ...; nmcont/cod_aco alimentam o "
+     "ROW_NUMBER() e staco o filtro final"),
+    ("ix_aco_nmcont_cad", "acordos_tb", "nmcont, data_cad, cod_aco",
+     ("tempo",),
+     "linha do tempo: acordos de um contrato por nmcont, do mais novo para o mais antigo "
+     "com keyset em (data_cad, cod_aco), sem filesort"),
+    ("ix_end_cpf_tipo", "enderecos_tb", "cpfcnpj, tipo_domicilio",
+     ("emails",),
+     "e-mails do cliente: busca por cpfcnpj + tipo_domicilio = 'M'"),
+]
+
+# tabelas pequenas onde varredura completa é aceitável
+TABELAS_PEQUENAS = {"stcob_tb", "usu_tb"}
+
+OBSERVACOES = [
+    "usu_tb: o filtro do operador é TRIM(usu.nomeusu) = '...'; a função impede o uso de índice. "
+    "Sem TRIM (nomes já gravados sem espaços) um índice em usu_tb(nomeusu) passaria a servir.",
+    "SQL_NMCONT_CPC usa usu.nomeusu no operador_where sem juntar usu_tb: com operador "
+    "escolhido a consulta falha e o app cai no conjunto CPC vazio.",
+]
+
+
+# ---------------- EXPLAIN ----------------
+def explicar(conn, sql, params=None):
+    """EXPLAIN tabular como lista de dicts (id, table, type, key, rows, Extra, ...)."""
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN " + sql.strip().rstrip(";"), params)
+        cols = [d[0] for d in cur.description]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def problemas(plano):
+    """Linhas do plano que merecem índice: (tabela, descrição)."""
+    out = []
+    for p in plano:
+        tabela = p.get("table") or ""
+        extra = p.get("Extra") or ""
+        if tabela.startswith("<") or tabela in TABELAS_PEQUENAS:
+            # tabelas derivadas/CTE materializadas e tabelas de domínio
+            continue
+        if p.get("type") in ("ALL", "index"):
+            out.append((tabela, f"varredura {p.get('type')} (~{p.get('rows')} linhas)"))
+        if "Using filesort" in extra:
+            out.append((tabela, "filesort"))
+        if "Using temporary" in extra:
+            out.append((tabela, "tabela temporária"))
+    return out
+
+
+def coletar_planos(conn, carteiras, operador, cod_exemplo):
+    planos = {}
+    for consulta, template in ORIGINAIS.items():
+        sql, params = montar(template, carteiras, operador)
+        lotes = lotes_params(sql, params, [cod_exemplo])
+        try:
+            planos[consulta] = explicar(conn, sql, lotes[0] if lotes else None)
+        except Exception as e:
+            planos[consulta] = {"erro": str(e)[:200]}
+    return planos
+
+
+def propor(planos):
+    """Índices do catálogo que atacam os problemas encontrados nos planos."""
+    tabelas = {}
+    for consulta, plano in planos.items():
+        if isinstance(plano, dict):
+            continue
+        for tabela, desc in problemas(plano):
+            tabelas.setdefault(tabela, []).append(f"{consulta}: {desc}")
+    return [(ix, tabelas[ix[1]]) for ix in INDICES if ix[1] in tabelas]
+
+
+# ---------------- DDL ----------------
+def gerar_ddl(propostas, schema=None):
+    alvo = f"{schema}." if schema else ""
+    linhas = [f"-- Índices propostos para o ReguaTotal ({date.today():%d/%m/%Y})",
+              "-- Criação online (InnoDB): não bloqueia leituras nem escritas.", ""]
+    for (nome, tabela, colunas, consultas, motivo), achados in propostas:
+        linhas.append(f"-- {tabela}: {motivo}")
+        linhas.append(f"--   consultas: {', '.join(consultas)}")
+        for a in achados:
+            linhas.append(f"--   plano atual: {a}")
+        linhas.append(f"CREATE INDEX {nome} ON {alvo}{tabela} ({colunas}) ALGORITHM=INPLACE LOCK=NONE;")
+        linhas.append("")
+    for obs in OBSERVACOES:
+        linhas.append(f"-- Obs.: {obs}")
+    linhas += ["", "-- Rollback:"]
+    for (nome, tabela, *_), _a in propostas:
+        linhas.append(f"-- DROP INDEX {nome} ON {alvo}{tabela};")
+    return "\n".join(linhas) + "\n"
+
+
+# ---------------- Benchmark na base local ----------------
+def indices_existentes(conn):
+    with conn.cursor() as cur:
+        cur.execute("""SELECT DISTINCT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS
+                       WHERE TABLE_SCHEMA = DATABASE()""")
+        return {(t, i) for t, i in cur.fetchall()}
+
+
+def aplicar_indices(conn, indices, criar):
+    existentes = indices_existentes(conn)
+    with conn.cursor() as cur:
+        for nome, tabela, colunas, *_ in indices:
+            if criar and (tabela, nome) not in existentes:
+                cur.execute(f"CREATE INDEX {nome} ON {tabela} ({colunas})")
+            elif not criar and (tabela, nome) in existentes:
+                cur.execute(f"DROP INDEX {nome} ON {tabela}")
+        for tabela in {ix[1] for ix in indices}:
+            cur.execute(f"ANALYZE TABLE {tabela}")
+            cur.fetchall()
+
+
+def rodada(conn, carteiras, operador, cods, repeticoes, com_variantes):
+    res = {}
+    for consulta, template in ORIGINAIS.items():
+        alvos = [("original", template)]
+        if com_variantes:
+            alvos += list(VARIANTES[consulta].items())
+        for nome, tpl in alvos:
+            sql, params = montar(tpl, carteiras, operador)
+            try:
+                _df, ms, examinadas = medir(conn, sql, lotes_params(sql, params, cods), repeticoes)
+                res[(consulta, nome)] = {"ms": round(ms, 1), "linhas_examinadas": examinadas}
+            except Exception as e:
+                res[(consulta, nome)] = {"erro": str(e)[:200]}
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Assessor de índices do ReguaTotal")
+    ap.add_argument("--carteiras", default="517,518,519")
+    ap.add_argument("--operador", default=None, help="operador do operador_where (padrão: Todos)")
+    ap.add_argument("--ddl", default="indices_gecobi.sql", help="arquivo do pacote de DDL")
+    ap.add_argument("--schema", default=None, help="schema a prefixar no DDL (padrão: nenhum)")
+    ap.add_argument("--todos", action="store_true",
+                    help="propõe o catálogo inteiro, mesmo sem problema no plano")
+    ap.add_argument("--sem-benchmark", action="store_true", help="só EXPLAIN + DDL")
+    ap.add_argument("--variantes", action="store_true", help="inclui as variantes do ComparadorSQL")
+    ap.add_argument("--repeticoes", type=int, default=3)
+    ap.add_argument("--amostra", type=int, default=200)
+    ap.add_argument("--json", help="grava o relatório neste arquivo")
+    ap.add_argument("--forcar", action="store_true", help="permite host não-local")
+    args = ap.parse_args()
+
+    carteiras = [int(c) for c in args.carteiras.split(",") if c.strip()]
+    conn = conectar()
+    try:
+        cods = amostra_cod_cad(conn, carteiras, args.amostra)
+        if not args.sem_benchmark:
+            # o benchmark cria/derruba índices: só na base local
+            checar_local(rt.DB, args.forcar)
+            aplicar_indices(conn, INDICES, criar=False)
+
+        planos = coletar_planos(conn, carteiras, args.operador, cods[0] if cods else 0)
+        propostas = [(ix, []) for ix in INDICES] if args.todos else propor(planos)
+
+        print("Planos atuais:")
+        for consulta, plano in planos.items():
+            if isinstance(plano, dict):
+                print(f"  {consulta:<11} ERRO: {plano['erro']}")
+                continue
+            achados = problemas(plano) or [("", "ok")]
+            print(f"  {consulta:<11} " + "; ".join(f"{t} {d}".strip() for t, d in achados))
+
+        with open(args.ddl, "w", encoding="utf-8") as f:
+            f.write(gerar_ddl(propostas, args.schema))
+        print(f"\n{len(propostas)} índice(s) proposto(s); DDL em {args.ddl}")
+
+        relatorio = {"planos": planos, "propostas": [ix[0] for ix, _a in propostas]}
+        if not args.sem_benchmark and propostas:
+            indices = [ix for ix, _a in propostas]
+            sem = rodada(conn, carteiras, args.operador, cods, args.repeticoes, args.variantes)
+            aplicar_indices(conn, indices, criar=True)
+            try:
+                com = rodada(conn, carteiras, args.operador, cods, args.repeticoes, args.variantes)
+                relatorio["planos_com_indices"] = coletar_planos(
+                    conn, carteiras, args.operador, cods[0] if cods else 0)
+            finally:
+                aplicar_indices(conn, indices, criar=False)
+
+            print(f"\n{'consulta':<11}{'variante':<16}{'ms sem':>10}{'ms com':>10}{'ganho':>7}"
+                  f"{'exam. sem':>12}{'exam. com':>12}")
+            relatorio["benchmark"] = []
+            for chave, a in sem.items():
+                b = com.get(chave, {})
+                ganho = round(a["ms"] / b["ms"], 2) if a.get("ms") and b.get("ms") else None
+                relatorio["benchmark"].append({"consulta": chave[0], "variante": chave[1],
+                                               "sem": a, "com": b, "ganho": ganho})
+                print(f"{chave[0]:<11}{chave[1]:<16}{a.get('ms', 'erro'):>10}{b.get('ms', 'erro'):>10}"
+                      f"{ganho or '':>7}{a.get('linhas_examinadas') or '':>12}{b.get('linhas_examinadas') or '':>12}")
+    finally:
+        conn.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
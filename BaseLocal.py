@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Base local que imita as tabelas do GECOBI usadas pelo ReguaTotal, com dados
+sintéticos de formato parecido com o real: poucos operadores com carteiras
+enormes, contratos com dezenas de acordos, CPFs repetidos em vários
+contratos, e-mails digitados errado e infoad longos.
+
+Serve de "GECOBI de mentira" para o SimuladorCarga.py, o ComparadorSQL.py e o
+AssessorIndices.py. O banco é MySQL (as consultas usam o dialeto dele).
+
+    REGUA_CRED_FILE=local.txt python BaseLocal.py --clientes 50000
+
+local.txt tem as mesmas chaves do SA_Credencials.txt. As tabelas são
+recriadas do zero, então o script só roda contra localhost (--forcar para
+outro host).
+"""
+import argparse, random
+from datetime import date, datetime, timedelta
+
+import pymysql
+
+import ReguaTotal as rt
+
+HOSTS_LOCAIS = ("localhost", "127.0.0.1", "::1")
+LOTE = 5000
+
+DDL = [
+    """CREATE TABLE stcob_tb (
+        st   VARCHAR(10) NOT NULL PRIMARY KEY,
+        dsc  VARCHAR(60),
+        bsc  VARCHAR(30)
+    )""",
+    """CREATE TABLE usu_tb (
+        cod_usu INT NOT NULL PRIMARY KEY,
+        nomeusu VARCHAR(60)
+    )""",
+    """CREATE TABLE cadastros_tb (
+        cod_cad  INT NOT NULL PRIMARY KEY,
+        cod_cli  INT NOT NULL,
+        nmcont   VARCHAR(30) NOT NULL,
+        cpfcnpj  VARCHAR(20),
+        nomecli  VARCHAR(100),
+        cod_usu  INT,
+        stcli    VARCHAR(5),
+        email    VARCHAR(120),
+        infoad   TEXT,
+        infoad10 DECIMAL(10,4)
+    )""",
+    """CREATE TABLE hist_tb (
+        cod_hist BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        cod_cli  INT NOT NULL,
+        data_at  DATETIME NOT NULL,
+        ocorr    VARCHAR(10),
+        cod_usu  INT
+    )""",
+    """CREATE TABLE acordos_tb (
+        cod_aco   BIGINT NOT NULL PRIMARY KEY,
+        cod_cli   INT NOT NULL,
+        nmcont    VARCHAR(30) NOT NULL,
+        data_aco  DATE,
+        data_cad  DATE,
+        vlr_aco   DECIMAL(12,2),
+        qtd_p_aco INT,
+        staco     CHAR(1)
+    )""",
+    """CREATE TABLE neg_comp_tb (
+        nmcont VARCHAR(30) NOT NULL PRIMARY KEY,
+        int_3 INT, int_4 INT, int_7 INT, int_8 INT, int_9 INT
+    )""",
+    """CREATE TABLE enderecos_tb (
+        cod_end        BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        cpfcnpj        VARCHAR(20),
+        tipo_domicilio CHAR(1),
+        endereco       VARCHAR(120)
+    )""",
+]
+TABELAS = ("stcob_tb", "usu_tb", "cadastros_tb", "hist_tb", "acordos_tb", "neg_comp_tb", "enderecos_tb")
+
+# ocorrências: (st, descrição, bsc) — bsc alimenta os filtros CPC/ALÔ/não acionado
+OCORRENCIAS = [
+    ("CPC",  "CONTATO COM O CLIENTE", "CPC"),
+    ("ALO",  "ALÔ - TERCEIRO",        "AL"),
+    ("ACI",  "ACIONAMENTO",           "ACIONAMENTO"),
+    ("SMS",  "SMS ENVIADO",           "SMS"),
+    ("SEM",  "SEM CONTATO",           ""),
+    ("ACD",  "ACORDO FORMALIZADO",    "CPC ACORDO"),
+]
+CARTEIRA_PESOS = [(517, 0.55), (518, 0.30), (519, 0.15)]
+
+NOMES = ["ANA", "BRUNO", "CARLA", "DIEGO", "EDUARDA", "FABIO", "GABRIELA", "HENRIQUE", "ISABELA",
+         "JOAO", "KARINA", "LUCAS", "MARIANA", "NATALIA", "OTAVIO", "PAULA", "RAFAEL", "SABRINA",
+         "TIAGO", "VANESSA", "WAGNER", "YASMIN", "JOSE", "MARIA", "ANTONIO", "FRANCISCA"]
+SOBRENOMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "RODRIGUES", "FERREIRA", "ALVES", "PEREIRA",
+              "LIMA", "GOMES", "COSTA", "RIBEIRO", "MARTINS", "CARVALHO", "ALMEIDA", "LOPES"]
+DOMINIOS = ["gmail.com", "hotmail.com", "yahoo.com.br", "outlook.com", "uol.com.br", "bol.com.br"]
+PALAVRAS = ("cliente informou desemprego renegociar parcela veiculo apreendido contato "
+            "retorno agendado proposta recusada filho atendeu novo telefone endereco").split()
+
+
+def checar_local(db, forcar=False):
+    if db["host"] not in HOSTS_LOCAIS and not forcar:
+        raise SystemExit(f"Recusado: {db['host']} não é local. Use --forcar se tiver certeza.")
+
+
+def conectar(db=None):
+    return pymysql.connect(autocommit=True, **(db or rt.DB))
+
+
+def _nome(rng):
+    return f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}"
+
+
+def _cpf(rng):
+    n = 11 if rng.random() < 0.9 else 14
+    return "".join(str(rng.randint(0, 9)) for _ in range(n))
+
+
+def _email(rng, nome):
+    base = nome.lower().replace(" ", ".") + str(rng.randint(1, 99))
+    e = f"{base}@{rng.choice(DOMINIOS)}"
+    r = rng.random()
+    if r < 0.03:
+        e = e[:-2]                      # ".c" / ".com."
+    elif r < 0.05:
+        e = e[:-1]                      # ".co" / ".com.b"
+    elif r < 0.10:
+        e = "  " + e.upper() + " "
+    return e
+
+
+def _texto(rng, palavras):
+    return " ".join(rng.choice(PALAVRAS) for _ in range(palavras))
+
+
+def _executar_lotes(conn, sql, linhas):
+    with conn.cursor() as cur:
+        for i in range(0, len(linhas), LOTE):
+            cur.executemany(sql, linhas[i:i + LOTE])
+
+
+def criar_tabelas(conn):
+    with conn.cursor() as cur:
+        for t in TABELAS:
+            cur.execute(f"DROP TABLE IF EXISTS {t}")
+        for ddl in DDL:
+            cur.execute(ddl)
+
+
+def popular(conn, clientes=20000, operadores=40, seed=42, progresso=print):
+    """Gera e insere os dados sintéticos; datas relativas a hoje."""
+    rng = random.Random(seed)
+    hoje = datetime.now().replace(microsecond=0)
+
+    _executar_lotes(conn, "INSERT INTO stcob_tb (st, dsc, bsc) VALUES (%s,%s,%s)", OCORRENCIAS)
+
+    usuarios = [(i, f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)}") for i in range(1, operadores + 1)]
+    usuarios.append((999, "SISTEMA"))
+    _executar_lotes(conn, "INSERT INTO usu_tb (cod_usu, nomeusu) VALUES (%s,%s)", usuarios)
+    # carteiras de tamanho bem desigual (Zipf)
+    pesos_op = [1.0 / (i ** 1.1) for i in range(1, operadores + 1)]
+    ids_op = [u[0] for u in usuarios[:-1]]
+
+    cads, hist, acordos, negs, ends = [], [], [], [], []
+    cpfs_vistos = []
+    cod_aco = 0
+    carts, cart_pesos = zip(*CARTEIRA_PESOS)
+    for cod_cad in range(1, clientes + 1):
+        cod_cli = rng.choices(carts, cart_pesos)[0]
+        nmcont = f"{cod_cli}{cod_cad:09d}"
+        # ~8% dos contratos são de um CPF que já tem outro contrato
+        if cpfs_vistos and rng.random() < 0.08:
+            cpf, nome = rng.choice(cpfs_vistos)
+        else:
+            cpf, nome = _cpf(rng), _nome(rng)
+            cpfs_vistos.append((cpf, nome))
+            for _ in range(rng.choice((0, 0, 1, 1, 2, 3))):
+                tipo = "M" if rng.random() < 0.6 else "R"
+                ends.append((cpf, tipo, _email(rng, nome) if tipo == "M" else _texto(rng, 4)))
+        infoad = _texto(rng, rng.choice((0, 3, 10, 40, 250))) if rng.random() < 0.7 else None
+        cads.append((
+            cod_cad, cod_cli, nmcont, cpf, nome, rng.choices(ids_op, pesos_op)[0],
+            "INA" if rng.random() < 0.1 else "ATI",
+            _email(rng, nome) if rng.random() < 0.6 else None,
+            infoad, round(rng.random() * (100 if rng.random() < 0.3 else 1), 4),
+        ))
+
+        # histórico: a maioria tem poucos eventos, alguns têm muitos
+        for _ in range(min(200, int(rng.expovariate(1 / 8)))):
+            quando = hoje - timedelta(days=rng.uniform(0, 150), seconds=rng.randint(0, 86399))
+            hist.append((cod_cad, quando, rng.choice(OCORRENCIAS)[0],
+                         999 if rng.random() < 0.2 else rng.choice(ids_op)))
+
+        if rng.random() < 0.35:
+            inicio = date(2025, 6, 1)
+            span = max(1, (hoje.date() - inicio).days)
+            for _ in range(min(60, int(rng.paretovariate(1.3)))):
+                cod_aco += 1
+                cad = inicio + timedelta(days=rng.randint(0, span))
+                acordos.append((cod_aco, cod_cli, nmcont, cad + timedelta(days=rng.randint(0, 10)), cad,
+                                round(rng.uniform(150, 25000), 2), rng.choice((1, 1, 3, 6, 10, 12, 24)),
+                                rng.choice("QQEEAP")))
+
+        if rng.random() < 0.7:
+            negs.append((nmcont, *(rng.choice((0, 0, 0, 1)) for _ in range(5))))
+
+        if cod_cad % 10000 == 0:
+            progresso(f"  {cod_cad} clientes gerados")
+
+    progresso(f"Inserindo {len(cads)} cadastros, {len(hist)} históricos, {len(acordos)} acordos...")
+    _executar_lotes(conn, "INSERT INTO cadastros_tb VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", cads)
+    _executar_lotes(conn, "INSERT INTO hist_tb (cod_cli, data_at, ocorr, cod_usu) VALUES (%s,%s,%s,%s)", hist)
+    _executar_lotes(conn, "INSERT INTO acordos_tb VALUES (%s,%s,%s,%s,%s,%s,%s,%s)", acordos)
+    _executar_lotes(conn, "INSERT INTO neg_comp_tb VALUES (%s,%s,%s,%s,%s,%s)", negs)
+    _executar_lotes(conn, "INSERT INTO enderecos_tb (cpfcnpj, tipo_domicilio, endereco) VALUES (%s,%s,%s)", ends)
+    with conn.cursor() as cur:
+        for t in TABELAS:
+            cur.execute(f"ANALYZE TABLE {t}")
+    return {"cadastros": len(cads), "hist": len(hist), "acordos": len(acordos),
+            "neg_comp": len(negs), "enderecos": len(ends)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cria a base local sintética do GECOBI")
+    ap.add_argument("--clientes", type=int, default=20000)
+    ap.add_argument("--operadores", type=int, default=40)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--forcar", action="store_true", help="permite host não-local")
+    args = ap.parse_args()
+
+    checar_local(rt.DB, args.forcar)
+    conn = conectar()
+    try:
+        criar_tabelas(conn)
+        tot = popular(conn, args.clientes, args.operadores, args.seed)
+    finally:
+        conn.close()
+    print("Base local pronta:", ", ".join(f"{k}={v}" for k, v in tot.items()))
+
+
+if __name__ == "__main__":
+    main()
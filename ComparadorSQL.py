@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Comparador A/B de consultas do ReguaTotal.
+
+Cada consulta do app (main, qr, cpc, nao, perfil, emails, operadores) pode
+ter variantes registradas. Todas rodam contra a mesma base (de preferência a
+BaseLocal.py), o resultado de cada variante é comparado com o da consulta
+original do app (mesmas linhas, sem depender da ordem) e o relatório mostra
+tempo mediano e linhas examinadas no servidor. Só variante "equivalente" e
+mais rápida é candidata a substituir a original em ReguaTotal.py.
+
+    REGUA_CRED_FILE=local.txt python ComparadorSQL.py [--consultas nao,qr] [--operador NOME]
+
+Sai com código 1 se alguma variante devolver resultado diferente.
+"""
+import argparse, json, re, statistics, time
+
+import numpy as np
+import pandas as pd
+
+import ReguaTotal as rt
+from BaseLocal import checar_local, conectar
+
+# consulta -> template do app (mesmos placeholders de build_load_sqls)
+ORIGINAIS = {
+    "main":       rt.SQL_BASE,
+    "qr":         rt.SQL_NMCONT_QR,
+    "cpc":        rt.SQL_NMCONT_CPC,
+    "nao":        rt.SQL_NMCONT_NAO,
+    "perfil":     rt.SQL_NMCONT_PERFIL,
+    "emails":     rt.SQL_EMAILS_ONE,
+    "operadores": rt.SQL_OPERADORES,
+}
+
+VARIANTES = {nome: {} for nome in ORIGINAIS}
+
+
+def registrar(consulta, nome, sql):
+    """Registra uma variante; o template usa os mesmos placeholders da original."""
+    if consulta not in VARIANTES:
+        raise KeyError(f"Consulta desconhecida: {consulta}")
+    VARIANTES[consulta][nome] = sql
+
+
+# ---------------- Variantes ----------------
+# SQL_BASE: acion já sai agrupado por cod_cad e o JOIN com usu_tb é pela PK,
+# então o GROUP BY de fora não junta nada.
+registrar("main", "sem_group_by", rt.SQL_BASE.replace(
+    "GROUP BY cad.cod_cad, cad.cpfcnpj, cad.nomecli, usu.nomeusu, aci.ultima_data, cad.nmcont\n", ""))
+
+# acion só precisa de cod_cad (cpfcnpj/nomecli vêm da consulta de fora)
+registrar("main", "acion_por_cod", rt.SQL_BASE
+          .replace("    cad.cpfcnpj AS CPFCNPJ1,\n    cad.nomecli AS NOMECLI1,\n", "")
+          .replace("GROUP BY cad.cod_cad, cad.cpfcnpj, cad.nomecli\n)", "GROUP BY cad.cod_cad\n)")
+          .replace("GROUP BY cad.cod_cad, cad.cpfcnpj, cad.nomecli, usu.nomeusu, aci.ultima_data, cad.nmcont\n", ""))
+
+# SQL_NMCONT_QR: a quantidade de acordos é o tamanho da partição; não precisa
+# reler a CTE para tirar MAX(rn_aco) nem de DISTINCT (rn_aco = 1 é único).
+registrar("qr", "count_over", """
+WITH acordos_ranked AS (
+SELECT
+a.nmcont,
+a.data_aco,
+a.vlr_aco,
+a.qtd_p_aco,
+a.staco,
+ROW_NUMBER() OVER (PARTITION BY a.nmcont ORDER BY a.cod_aco DESC) AS rn_aco,
+COUNT(*) OVER (PARTITION BY a.nmcont) AS qtdaco
+FROM acordos_tb a
+WHERE a.cod_cli IN ({in_list})
+AND a.data_cad >= '2025-07-01'
+)
+SELECT aco.nmcont,aco.data_aco,aco.vlr_aco,aco.qtd_p_aco,aco.qtdaco
+FROM acordos_ranked aco
+WHERE aco.rn_aco = 1
+AND aco.staco IN ('Q','E');
+""")
+
+# SQL_NMCONT_NAO: anti-join correlacionado no lugar do NOT IN (SELECT ... GROUP BY).
+# Atenção: NOT IN e NOT EXISTS só coincidem se hist_tb.cod_cli nunca for NULL.
+_NAO_FILTRO_AL = """
+    FROM hist_tb ht
+    JOIN stcob_tb st ON st.st = ht.ocorr
+    WHERE st.bsc LIKE '%AL%'
+      AND ht.cod_usu <> 999
+      AND ht.data_at >= DATE_FORMAT(DATE_SUB(CURDATE(), INTERVAL 3 MONTH), '%Y-%m-01')
+      AND ht.data_at  < DATE_ADD(DATE_FORMAT(CURDATE(), '%Y-%m-01'), INTERVAL 1 MONTH)"""
+
+registrar("nao", "not_exists", """
+SELECT DISTINCT cad.nmcont
+FROM cadastros_tb cad
+JOIN usu_tb   usu ON usu.cod_usu = cad.cod_usu
+WHERE cad.cod_cli IN ({in_list})
+  AND cad.stcli <> 'INA'
+  AND NOT EXISTS (
+    SELECT 1""" + _NAO_FILTRO_AL + """
+      AND ht.cod_cli = cad.cod_cad
+  )
+{operador_where};
+""")
+
+registrar("nao", "left_join", """
+SELECT DISTINCT cad.nmcont
+FROM cadastros_tb cad
+JOIN usu_tb   usu ON usu.cod_usu = cad.cod_usu
+LEFT JOIN (
+    SELECT DISTINCT ht.cod_cli""" + _NAO_FILTRO_AL + """
+) al ON al.cod_cli = cad.cod_cad
+WHERE cad.cod_cli IN ({in_list})
+  AND cad.stcli <> 'INA'
+  AND al.cod_cli IS NULL
+{operador_where};
+""")
+
+# SQL_EMAILS_ONE: LOWER(TRIM(...)) uma vez só, numa tabela derivada, em vez de
+# em cada ramo do CASE (e o LEFT JOIN que o WHERE já transformava em JOIN).
+registrar("emails", "derivada", """
+SELECT
+  CASE
+    WHEN e IS NULL OR e = '' THEN NULL
+    WHEN e LIKE '%%.c'     THEN CONCAT(SUBSTRING(e, 1, CHAR_LENGTH(e) - 2), '.com')
+    WHEN e LIKE '%%.com.'  THEN CONCAT(SUBSTRING_INDEX(e, '.com', 1), '.com.br')
+    WHEN e LIKE '%%.com.b' THEN CONCAT(SUBSTRING_INDEX(e, '.com', 1), '.com.br')
+    WHEN e LIKE '%%.com.r' THEN CONCAT(SUBSTRING_INDEX(e, '.com', 1), '.com.br')
+    ELSE e
+  END AS email
+FROM (
+  SELECT LOWER(TRIM(cad.email)) AS e
+  FROM cadastros_tb cad
+  WHERE cad.cod_cli IN (517,518,519)
+    AND cad.stcli <> 'INA'
+    AND cad.cod_cad = %s
+  UNION ALL
+  SELECT LOWER(TRIM(en.endereco))
+  FROM cadastros_tb cad
+  JOIN enderecos_tb en ON en.cpfcnpj = cad.cpfcnpj AND en.tipo_domicilio = 'M'
+  WHERE cad.cod_cli IN (517,518,519)
+    AND cad.stcli <> 'INA'
+    AND cad.cod_cad = %s
+) x;
+""")
+
+
+# ---------------- Execução ----------------
+def montar(template, carteiras, operador):
+    """
+    (sql, params) como o app manda: montar_consulta vincula carteiras e
+    operador. Template sem placeholder já está no formato do pymysql (os %s
+    são o cod_cad de cada execução).
+    """
+    if not rt._PLACEHOLDER.search(template):
+        return template, []
+    return rt.montar_consulta(template, carteiras, operador)
+
+
+def n_params(sql):
+    return len(re.findall(r"(?<!%)%s", sql))
+
+
+def lotes_params(sql, params, cods):
+    """Parâmetros de cada execução: os vinculados por montar e o cod_cad em cada %s que sobrar."""
+    k = n_params(sql) - len(params)
+    if k:
+        return [(*params, *(c,) * k) for c in cods]
+    return [tuple(params)] if params else None
+
+
+def _linhas_examinadas(cur):
+    """ROWS_EXAMINED da última instrução desta conexão (None sem performance_schema)."""
+    try:
+        cur.execute("""SELECT ROWS_EXAMINED FROM performance_schema.events_statements_history
+                       WHERE THREAD_ID = PS_CURRENT_THREAD_ID()
+                       ORDER BY EVENT_ID DESC LIMIT 1""")
+        row = cur.fetchone()
+        return int(row[0]) if row else None
+    except Exception:
+        return None
+
+
+def executar(conn, sql, lotes_params=None):
+    """
+    Roda `sql` (uma vez, ou uma vez por tupla de `lotes_params`).
+    Devolve (df, ms, linhas_examinadas); com mais de um lote o df os junta com
+    a coluna _param (o cod_cad, último parâmetro).
+    """
+    partes, examinadas, ms = [], 0, 0.0
+    for params in (lotes_params or [None]):
+        t0 = time.perf_counter()
+        df = rt.run_query(sql, conn, params=params)
+        ms += (time.perf_counter() - t0) * 1000
+        with conn.cursor() as cur:
+            ex = _linhas_examinadas(cur)
+        examinadas = None if ex is None or examinadas is None else examinadas + ex
+        if lotes_params and len(lotes_params) > 1:
+            df = df.assign(_param=str(params[-1]))
+        partes.append(df)
+    return pd.concat(partes, ignore_index=True), ms, examinadas
+
+
+def normalizar(df):
+    """Forma canônica para comparar resultados: tipos unificados, linhas ordenadas."""
+    out = pd.DataFrame(index=df.index)
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            out[c] = s.dt.strftime("%Y-%m-%d %H:%M:%S").fillna("\0")
+            continue
+        num = pd.to_numeric(s, errors="coerce")
+        if s.notna().any() and num.notna().sum() == s.notna().sum():
+            out[c] = num.astype(float).round(6).map(repr).where(num.notna(), "\0")
+        else:
+            out[c] = s.map(lambda v: "\0" if v is None or (isinstance(v, float) and np.isnan(v))
+                           else str(v))
+    out.columns = [str(c).lower() for c in out.columns]
+    out = out[sorted(out.columns)]
+    return out.sort_values(list(out.columns), kind="mergesort").reset_index(drop=True)
+
+
+def comparar(ref, outro):
+    """'' se equivalentes; senão uma descrição curta da diferença."""
+    a, b = normalizar(ref), normalizar(outro)
+    if list(a.columns) != list(b.columns):
+        return f"colunas diferentes: {list(a.columns)} x {list(b.columns)}"
+    if a.equals(b):
+        return ""
+    m = a.merge(b, how="outer", indicator=True)
+    so_ref = int((m["_merge"] == "left_only").sum())
+    so_var = int((m["_merge"] == "right_only").sum())
+    return f"{len(a)} x {len(b)} linhas; {so_ref} só na original, {so_var} só na variante"
+
+
+def medir(conn, sql, lotes_params=None, repeticoes=3):
+    """Aquece uma vez e devolve (df, ms mediano, linhas examinadas)."""
+    df, _, examinadas = executar(conn, sql, lotes_params)
+    tempos = [executar(conn, sql, lotes_params)[1] for _ in range(repeticoes)]
+    return df, statistics.median(tempos), examinadas
+
+
+def amostra_cod_cad(conn, carteiras, n, seed=1):
+    sql, params = montar("SELECT cod_cad FROM cadastros_tb WHERE cod_cli IN ({in_list}) AND stcli <> 'INA'",
+                         carteiras, None)
+    cods = rt.run_query(sql, conn, params=params)["cod_cad"].to_numpy()
+    if len(cods) > n:
+        cods = np.random.default_rng(seed).choice(cods, n, replace=False)
+    return [int(c) for c in cods]
+
+
+def comparar_consulta(conn, consulta, carteiras, operador, cods, repeticoes=3):
+    """Roda original + variantes de uma consulta; devolve a lista de linhas do relatório."""
+    linhas, ref = [], None
+    for nome, template in [("original", ORIGINAIS[consulta]), *VARIANTES[consulta].items()]:
+        sql, params = montar(template, carteiras, operador)
+        lotes = lotes_params(sql, params, cods)
+        linha = {"consulta": consulta, "variante": nome}
+        try:
+            df, ms, examinadas = medir(conn, sql, lotes, repeticoes)
+        except Exception as e:
+            linha.update(erro=str(e)[:200])
+            linhas.append(linha)
+            continue
+        linha.update(ms=round(ms, 1), linhas=len(df), linhas_examinadas=examinadas)
+        if ref is None:
+            if nome == "original":
+                ref = df
+            else:
+                linha["diferenca"] = "original falhou"
+        else:
+            linha["diferenca"] = comparar(ref, df)
+            base = linhas[0].get("ms")
+            if base:
+                linha["ganho"] = round(base / ms, 2) if ms else None
+        linhas.append(linha)
+    return linhas
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Comparador A/B das consultas do ReguaTotal")
+    ap.add_argument("--consultas", default=",".join(c for c, v in VARIANTES.items() if v),
+                    help="consultas a comparar (padrão: as que têm variantes)")
+    ap.add_argument("--carteiras", default="517,518,519")
+    ap.add_argument("--operador", default=None, help="operador do operador_where (padrão: Todos)")
+    ap.add_argument("--repeticoes", type=int, default=3)
+    ap.add_argument("--amostra", type=int, default=200, help="cod_cad sorteados para as consultas por cod_cad")
+    ap.add_argument("--json", help="grava o relatório neste arquivo")
+    ap.add_argument("--forcar", action="store_true", help="permite host não-local")
+    args = ap.parse_args()
+
+    checar_local(rt.DB, args.forcar)
+    carteiras = [int(c) for c in args.carteiras.split(",") if c.strip()]
+    consultas = [c.strip() for c in args.consultas.split(",") if c.strip()]
+
+    conn = conectar()
+    try:
+        cods = amostra_cod_cad(conn, carteiras, args.amostra)
+        relatorio = []
+        for consulta in consultas:
+            relatorio += comparar_consulta(conn, consulta, carteiras, args.operador, cods, args.repeticoes)
+    finally:
+        conn.close()
+
+    print(f"{'consulta':<11}{'variante':<16}{'ms':>10}{'linhas':>9}{'examinadas':>12}{'ganho':>7}  resultado")
+    divergiu = False
+    for l in relatorio:
+        if "erro" in l:
+            res = "ERRO: " + l["erro"]
+        elif l["variante"] == "original":
+            res = "referência"
+        else:
+            res = "equivalente" if not l["diferenca"] else "DIFERENTE: " + l["diferenca"]
+            divergiu |= bool(l["diferenca"])
+        ex = "" if l.get("linhas_examinadas") is None else l["linhas_examinadas"]
+        print(f"{l['consulta']:<11}{l['variante']:<16}{l.get('ms', ''):>10}{l.get('linhas', ''):>9}"
+              f"{ex:>12}{l.get('ganho') or '':>7}  {res}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    raise SystemExit(1 if divergiu else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
-import os, json, re, threading, warnings
+import os, sys, json, re, glob, hashlib, hmac, queue, random, struct, tempfile, threading, time, warnings, logging, cProfile
+import asyncio, atexit
+import bisect, heapq, itertools, math, socket, weakref
+import urllib.error, urllib.parse, urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import partial
 import pymysql
+import numpy as np
 import pandas as pd
 import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
@@ -14,6 +21,8 @@ LOCKED_USER = None   # ou None para liberar geral
 
 # ---------------- Caminho de credenciais ----------------
 CRED_FILE_PATH = r"\\fs01\ITAPEVA ATIVAS\DADOS\SA_Credencials.txt"
+# REGUA_CRED_FILE aponta outro arquivo com as mesmas chaves (ex.: base local de testes)
+CRED_FILE_PATH = os.environ.get("REGUA_CRED_FILE") or CRED_FILE_PATH
 
 
 def load_db_config_from_file(path=CRED_FILE_PATH):
@@ -61,13 +70,19 @@ CARTEIRAS = [
     ("Cedidas - 519", 519),
 ]
 
+# REGUA_REPLAY=<pasta>: consultas servidas de fixtures gravadas (ver "Gravação e
+# replay de consultas"); sem banco, as credenciais são dispensadas
+REPLAY_DIR = os.environ.get("REGUA_REPLAY") or None
+
 # Agora o DB vem do arquivo de credenciais
 try:
     DB = load_db_config_from_file()
 except Exception as e:
-    # Se quiser, pode trocar por messagebox + exit, mas como Tk ainda não subiu,
-    # vou apenas levantar o erro:
-    raise RuntimeError(f"Erro ao carregar credenciais do GECOBI:\n{e}")
+    if not REPLAY_DIR:
+        # Se quiser, pode trocar por messagebox + exit, mas como Tk ainda não subiu,
+        # vou apenas levantar o erro:
+        raise RuntimeError(f"Erro ao carregar credenciais do GECOBI:\n{e}")
+    DB = {"host": "replay", "user": "", "password": "", "database": "", "port": 0}
 
 PREFS_FILE = "prefs.json"
 DEFAULT_THEME = "clam"
@@ -136,6 +151,23 @@ WHERE aco.rn_aco = 1
 AND aco.staco IN ('Q','E');  
 """
 
+# Só o conjunto Q/R (modo de colunas sob demanda: acordo vem depois, em lotes)
+SQL_NMCONT_QR_SET = """
+WITH acordos_ranked AS (
+SELECT
+a.nmcont,
+a.staco,
+ROW_NUMBER() OVER (PARTITION BY a.nmcont ORDER BY a.cod_aco DESC) AS rn_aco
+FROM acordos_tb a
+WHERE a.cod_cli IN ({in_list})
+AND a.data_cad >= '2025-07-01'
+)
+SELECT DISTINCT aco.nmcont
+FROM acordos_ranked aco
+WHERE aco.rn_aco = 1
+AND aco.staco IN ('Q','E');
+"""
+
 SQL_NMCONT_CPC = """
 SELECT 
   cad.nmcont,
@@ -203,6 +235,58 @@ FROM perf
 WHERE rn = 1;
 """
 
+# Acordo e perfil de um lote de contratos ({nm_list} = placeholders %s)
+SQL_NMCONT_QR_LOTE = SQL_NMCONT_QR.replace(
+    "AND a.data_cad >= '2025-07-01'\n",
+    "AND a.data_cad >= '2025-07-01'\nAND a.nmcont IN ({nm_list})\n")
+SQL_NMCONT_PERFIL_LOTE = SQL_NMCONT_PERFIL.replace(
+    "    {operador_where}\n)",
+    "    AND cad.nmcont IN ({nm_list})\n    {operador_where}\n)")
+
+# Versões da carga fatiada (uma carteira por vez) das consultas que escolhem
+# "o último" por nmcont: cada fatia devolve o seu candidato com a chave do
+# desempate (cod_aco/cod_cad) e a contagem, sem o filtro de staco; a escolha
+# entre carteiras é feita no cliente (ver load_contratos_sharded).
+SQL_NMCONT_QR_FATIA = """
+WITH acordos_ranked AS (
+SELECT
+a.nmcont,
+a.cod_aco,
+a.data_aco,
+a.vlr_aco,
+a.qtd_p_aco,
+a.staco,
+ROW_NUMBER() OVER (PARTITION BY a.nmcont ORDER BY a.cod_aco DESC) AS rn_aco,
+COUNT(*) OVER (PARTITION BY a.nmcont) AS qtdaco
+FROM acordos_tb a
+WHERE a.cod_cli IN ({in_list})
+AND a.data_cad >= '2025-07-01'
+)
+SELECT aco.nmcont,aco.cod_aco,aco.staco,aco.data_aco,aco.vlr_aco,aco.qtd_p_aco,aco.qtdaco
+FROM acordos_ranked aco
+WHERE aco.rn_aco = 1;
+"""
+
+SQL_NMCONT_QR_SET_FATIA = """
+WITH acordos_ranked AS (
+SELECT
+a.nmcont,
+a.cod_aco,
+a.staco,
+ROW_NUMBER() OVER (PARTITION BY a.nmcont ORDER BY a.cod_aco DESC) AS rn_aco
+FROM acordos_tb a
+WHERE a.cod_cli IN ({in_list})
+AND a.data_cad >= '2025-07-01'
+)
+SELECT aco.nmcont,aco.cod_aco,aco.staco
+FROM acordos_ranked aco
+WHERE aco.rn_aco = 1;
+"""
+
+SQL_NMCONT_PERFIL_FATIA = (SQL_NMCONT_PERFIL
+    .replace("    cad.nmcont,\n    cad.infoad,", "    cad.nmcont,\n    cad.cod_cad,\n    cad.infoad,")
+    .replace("SELECT\n  nmcont,\n  infoad,", "SELECT\n  nmcont,\n  cod_cad,\n  infoad,"))
+
 # --- E-mails: consulta pontual por cod_cad (lazy) ---
 SQL_EMAILS_ONE = """
 SELECT
@@ -248,6 +332,66 @@ WHERE
   AND en.tipo_domicilio = 'M';
 """
 
+# --- E-mails em lote (exportação): endereços crus, a correção é feita no cliente ---
+SQL_EMAILS_LOTE = """
+SELECT cad.cod_cad, cad.email AS email, 0 AS origem
+FROM cadastros_tb cad
+WHERE cad.cod_cad IN ({cod_list})
+  AND cad.stcli <> 'INA'
+  AND cad.email IS NOT NULL
+
+UNION ALL
+
+SELECT cad.cod_cad, en.endereco AS email, 1 AS origem
+FROM cadastros_tb cad
+JOIN enderecos_tb en ON en.cpfcnpj = cad.cpfcnpj AND en.tipo_domicilio = 'M'
+WHERE cad.cod_cad IN ({cod_list})
+  AND cad.stcli <> 'INA';
+"""
+
+# --- Linha do tempo: uma página por fonte, keyset (data, id) decrescente ---
+# O cursor é a última linha já lida; a primeira página usa TEMPO_INICIO.
+SQL_TEMPO_HIST = """
+SELECT
+  his.cod_hist AS id,
+  his.data_at  AS data,
+  his.ocorr,
+  st.dsc,
+  TRIM(usu.nomeusu) AS nomeusu
+FROM hist_tb his
+LEFT JOIN stcob_tb st  ON st.st       = his.ocorr
+LEFT JOIN usu_tb   usu ON usu.cod_usu = his.cod_usu
+WHERE his.cod_cli = %s
+  AND (his.data_at < %s OR (his.data_at = %s AND his.cod_hist < %s))
+ORDER BY his.data_at DESC, his.cod_hist DESC
+LIMIT %s;
+"""
+
+SQL_TEMPO_ACORDOS = """
+SELECT
+  a.cod_aco  AS id,
+  a.data_cad AS data,
+  a.data_aco,
+  a.vlr_aco,
+  a.qtd_p_aco,
+  a.staco
+FROM acordos_tb a
+WHERE a.nmcont = %s
+  AND (a.data_cad < %s OR (a.data_cad = %s AND a.cod_aco < %s))
+ORDER BY a.data_cad DESC, a.cod_aco DESC
+LIMIT %s;
+"""
+
+# --- Operadores das carteiras (combobox da TelaInicial) ---
+SQL_OPERADORES = """
+SELECT DISTINCT TRIM(usu.nomeusu) AS nomeusu
+FROM cadastros_tb cad
+JOIN usu_tb usu ON usu.cod_usu = cad.cod_usu
+WHERE cad.cod_cli IN ({in_list})
+AND cad.stcli <> 'INA'
+ORDER BY 1;
+"""
+
 # ---------------- Utils ----------------
 def fix_email_py(e: str) -> str:
     if not e:
@@ -262,6 +406,15 @@ def fix_email_py(e: str) -> str:
     s = re.sub(r'\.+$', '', s)
     return s
 
+def fix_email_series(s):
+    """fix_email_py vetorizado: mesma correção para uma Series inteira."""
+    s = s.fillna("").astype(str).str.strip().str.lower()
+    s = s.where(~s.str.endswith(".c"), s.str[:-2] + ".com")
+    for sufixo_errado in (".com.", ".com.b", ".com.r"):
+        # depois de trocado o final vira .com.br, que não casa com os sufixos seguintes
+        s = s.where(~s.str.endswith(sufixo_errado), s.str[:-len(sufixo_errado)] + ".com.br")
+    return s.str.replace(r"\.+$", "", regex=True)
+
 def load_prefs():
     if os.path.exists(PREFS_FILE):
         try:
@@ -289,6 +442,9 @@ def fmt_cpf_cnpj(s):
 def only_digits(s):
     return re.sub(r"\D", "", str(s or ""))
 
+def fmt_brl(v):
+    return f"R$ {float(v):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
 def cor_por_data(d, dark=False):
     try:
         d = pd.to_datetime(d).date()
@@ -296,6 +452,8 @@ def cor_por_data(d, dark=False):
         return "#ffffff" if not dark else "#0f1115"
     hoje = datetime.today().date()
     dias = (hoje - d).days
+    if dias < 0:   # data futura: fora das faixas (como no filtro de cor)
+        return "#ffffff" if not dark else "#0f1115"
     if dark:
         if dias <= 7:   return "#13301a"
         if dias <= 30:  return "#2d2615"
@@ -305,6 +463,73 @@ def cor_por_data(d, dark=False):
         if dias <= 30:  return "#fff7e6"
         return "#ffe6e6"
 
+# ---------------- Ordenação da Lista ----------------
+# coluna da Treeview -> (coluna do df, tipo da chave)
+SORT_KEYS = {
+    "contrato": ("contrato",    "texto"),
+    "nome":     ("nomecli",     "texto"),
+    "cpf":      ("cpfcnpj",     "digitos"),
+    "usuario":  ("nomeusu",     "texto"),
+    "dt":       ("ultima_data", "data"),
+    "aco_dt":   ("data_aco",    "data"),
+    "aco_vlr":  ("vlr_aco",     "numero"),
+    "aco_qtd":  ("qtd_p_aco",   "numero"),
+}
+
+def sort_key_col(col):
+    return f"_sk_{col}"
+
+def build_sort_keys(df, cols=None):
+    """
+    Acrescenta ao df uma coluna numérica (float) por coluna da Lista (ou só
+    as de `cols`) com a chave de ordenação já tipada. Texto vira o rank do
+    factorize ordenado, datas viram segundos, valores inválidos viram NaN
+    (sempre no fim).
+    """
+    for col, (src, tipo) in SORT_KEYS.items():
+        if cols is not None and col not in cols:
+            continue
+        s = df[src] if src in df.columns else pd.Series(pd.NA, index=df.index, dtype="object")
+        if tipo == "data":
+            d = pd.to_datetime(s, errors="coerce")
+            k = (d - pd.Timestamp(0)).dt.total_seconds()
+        elif tipo == "numero":
+            k = pd.to_numeric(s, errors="coerce")
+        else:
+            txt = s.fillna("").astype(str).str.strip()
+            if tipo == "digitos":
+                txt = txt.str.replace(r"\D", "", regex=True).str.zfill(14)
+            else:
+                txt = txt.str.casefold()
+            codes, _ = pd.factorize(txt, sort=True)
+            k = pd.Series(codes, index=df.index)
+        df[sort_key_col(col)] = k.astype("float64").to_numpy()
+    return df
+
+def sort_permutation(keys, desc=False):
+    """argsort estável; NaN fica no fim nos dois sentidos."""
+    k = np.asarray(keys, dtype="float64")
+    return np.argsort(-k if desc else k, kind="stable")
+
+# cores de fundo do Detalhe por faixa (mesmas de cor_por_data)
+CORES_DETALHE = {
+    False: {"verde": "#e6ffe6", "amarelo": "#fff7e6", "vermelho": "#ffe6e6", "": "#ffffff"},
+    True:  {"verde": "#13301a", "amarelo": "#2d2615", "vermelho": "#2c1515", "": "#0f1115"},
+}
+
+def color_buckets(s):
+    """
+    Versão vetorizada de cor_por_data: devolve 'verde'/'amarelo'/'vermelho'/''.
+    É a única definição das faixas: a cor das linhas, o filtro de cor (em
+    memória e paginado, pela coluna _cor) e o resumo saem daqui.
+    """
+    d = pd.to_datetime(s, errors="coerce")
+    dias = (pd.Timestamp.today().normalize() - d.dt.normalize()).dt.days
+    out = np.select([(dias >= 0) & (dias <= 7), (dias >= 8) & (dias <= 30), dias > 30],
+                    ["verde", "amarelo", "vermelho"], default="")
+    out[d.isna().to_numpy()] = ""
+    return out
+
 def add_tooltip(widget, text):
     tip = tk.Toplevel(widget); tip.withdraw(); tip.overrideredirect(True)
     lbl = ttk.Label(tip, text=text, relief="solid", borderwidth=1, padding=4); lbl.pack()
@@ -378,27 +603,570 @@ def apply_palette(root, dark: bool):
 
     prefs = load_prefs(); prefs["dark_mode"] = bool(dark); save_prefs(prefs)
 
-# ---------------- Tela Inicial ----------------
-class TelaInicial(tk.Tk):
+# ---------------- Tarefas em segundo plano ----------------
+TASK_WORKERS = 4          # threads do pool de tarefas
+TASK_POLL_MS = 50         # intervalo de leitura da fila de resultados no loop do Tk
+QUERY_TIMEOUT_S = 300     # tempo máximo por consulta (KILL QUERY ao estourar)
+KILL_ESPERA_S = 10        # espera máxima, ao fim da consulta, pelo KILL já disparado contra ela
+
+
+class TaskCancelled(Exception):
+    """A tarefa foi cancelada (usuário voltou/fechou a tela)."""
+
+
+class QueryTimeout(Exception):
+    """A consulta passou do tempo limite e foi interrompida no servidor."""
+
+
+def kill_query(thread_id):
+    """Envia KILL QUERY por uma conexão lateral (a da consulta está ocupada)."""
+    try:
+        side = pymysql.connect(connect_timeout=5, **DB)
+        try:
+            with side.cursor() as cur:
+                cur.execute(f"KILL QUERY {int(thread_id)}")
+        finally:
+            side.close()
+    except Exception:
+        pass
+
+
+class CancelToken:
+    """
+    Token de cancelamento de uma tarefa. Guarda o thread_id das conexões com
+    consulta em andamento; cancel() marca o token e manda KILL QUERY para elas.
+    O thread_id só é solto (_detach) depois que o KILL contra ele saiu: a
+    conexão não volta ao pool com um KILL ainda a caminho.
+    """
     def __init__(self):
-        super().__init__()
-        self.title("Selecionar Carteiras e Operador")
-        self.resizable(False, False)
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()
+        self._matando = {}   # thread_id -> Event do KILL enviado
+        self._callbacks = []
 
-        self.font_base  = tkfont.Font(family="Segoe UI", size=10)
-        self.font_title = tkfont.Font(family="Segoe UI", size=11, weight="bold")
-        self.font_strong= tkfont.Font(family="Segoe UI", size=10, weight="bold")
+    @property
+    def cancelled(self):
+        return self._event.is_set()
 
-        self.style = ttk.Style(self)
-        theme_apply(self, get_initial_theme(self.style))
-        self.option_add("*Font", self.font_base)
-        self.style.configure(".", padding=6)
-        self.style.configure("TButton", padding=(10,6))
-        self.style.configure("Title.TLabel", font=self.font_title)
-        self.style.configure("Strong.TLabel", font=self.font_strong)
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            ids = list(self._running)
+            for t in ids:
+                self._matando[t] = threading.Event()
+            callbacks, self._callbacks = self._callbacks, []
+        if ids:
+            def _matar():
+                for t in ids:
+                    kill_query(t)
+                    self._matando[t].set()
+            # não-daemon: o KILL precisa sair mesmo se o app estiver fechando
+            threading.Thread(target=_matar).start()
+        for fn in callbacks:
+            fn()
+
+    def on_cancel(self, fn):
+        """fn() roda no cancel() (na hora, se o token já foi cancelado)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
 
-        self.dark_var = tk.BooleanVar(value=get_initial_dark())
-        apply_palette(self, self.dark_var.get())
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled()
+
+    def _attach(self, thread_id):
+        with self._lock:
+            self._running.add(thread_id)
+
+    def _detach(self, thread_id):
+        """Solta o thread_id; se um KILL foi disparado contra ele, espera sair e devolve True."""
+        with self._lock:
+            self._running.discard(thread_id)
+            enviado = self._matando.get(thread_id)
+        if enviado is None:
+            return False
+        enviado.wait(KILL_ESPERA_S)
+        return True
+
+
+@contextmanager
+def vigiar_consulta(conn, token=None, timeout=QUERY_TIMEOUT_S):
+    """
+    Cancelamento e tempo limite para o que rodar em `conn` dentro do with:
+    ao cancelar o token ou estourar `timeout` a instrução é morta no servidor
+    com KILL QUERY. Se houve KILL, a sessão é trocada antes de sair daqui (ele
+    pode chegar depois do fim da instrução e pegaria a próxima no mesmo thread_id).
+    """
+    tid = conn.thread_id()
+    if token is not None:
+        token.raise_if_cancelled()   # nada anexado ainda: pode sair direto
+
+    timer, estourou = None, threading.Event()
+    try:
+        # a partir do _attach um cancel() dispara KILL contra tid: o finally
+        # precisa soltar o tid e esperar esse KILL antes da conexão voltar ao pool
+        if token is not None:
+            token._attach(tid)
+            token.raise_if_cancelled()
+        if timeout:
+            def _expirar():
+                estourou.set()
+                kill_query(tid)
+            timer = threading.Timer(timeout, _expirar)
+            timer.daemon = True
+            timer.start()
+        yield
+    except Exception as e:
+        if token is not None and token.cancelled:
+            raise TaskCancelled() from e
+        if estourou.is_set():
+            raise QueryTimeout(f"Consulta interrompida após {timeout}s") from e
+        raise
+    finally:
+        morta = False
+        if timer is not None:
+            timer.cancel()
+            if estourou.is_set():
+                timer.join(KILL_ESPERA_S)   # o KILL do tempo limite termina de sair
+                morta = True
+        if token is not None and token._detach(tid):
+            morta = True
+        if morta:
+            try:
+                conn.close()
+                conn.connect()   # thread_id novo (os prepared statements recomeçam)
+            except Exception:
+                pass             # fechada: o ping do pool reabre no próximo uso
+
+
+def run_query(sql, conn, token=None, timeout=QUERY_TIMEOUT_S, params=None):
+    """pd.read_sql_query com cancelamento e tempo limite (ver vigiar_consulta)."""
+    with vigiar_consulta(conn, token, timeout):
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def run_comando(sql, conn, params=None, token=None, timeout=QUERY_TIMEOUT_S):
+    """Instrução sem resultado (PREPARE, SET, ...) com o mesmo cancelamento e tempo limite."""
+    with vigiar_consulta(conn, token, timeout):
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+
+
+class TaskRunner:
+    """
+    Pool de threads para o trabalho de banco. Os resultados voltam para o
+    loop do Tk por uma fila lida com after(), então nenhum callback roda
+    fora da thread do Tk. Resultados de tarefas canceladas são descartados.
+    """
+    def __init__(self, root, workers=TASK_WORKERS):
+        self.root = root
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="regua")
+        self._results = queue.Queue()
+        self._tokens = set()
+        self._closed = False
+        self._job = root.after(TASK_POLL_MS, self._poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, token=None, **kwargs):
+        """Roda fn(*args, token=token, **kwargs) no pool; devolve o token."""
+        token = token or CancelToken()
+        self._tokens.add(token)
+
+        def run():
+            try:
+                res = fn(*args, token=token, **kwargs)
+                self._results.put((token, on_done, res))
+            except TaskCancelled:
+                self._results.put((token, None, None))
+            except Exception as e:
+                self._results.put((token, on_error, e))
+
+        self._pool.submit(run)
+        return token
+
+    def submit_async(self, coro, on_done=None, on_error=None, token=None):
+        """
+        Agenda a coroutine no loop asyncio (get_aio) e entrega o resultado pela
+        mesma fila do submit. token.cancel() cancela a coroutine, e com ela as
+        consultas em andamento (ver em_thread). Devolve o token.
+        """
+        token = token or CancelToken()
+        self._tokens.add(token)
+        fut = get_aio().submit(coro)
+        token.on_cancel(fut.cancel)
+
+        def entregar(f):
+            if f.cancelled() or isinstance(f.exception(), TaskCancelled):
+                self._results.put((token, None, None))
+            elif f.exception() is not None:
+                self._results.put((token, on_error, f.exception()))
+            else:
+                self._results.put((token, on_done, f.result()))
+
+        fut.add_done_callback(entregar)
+        return token
+
+    def _poll(self):
+        self._job = None
+        try:
+            while True:
+                try:
+                    token, cb, val = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                self._tokens.discard(token)
+                if cb is None or token.cancelled:
+                    continue
+                try:
+                    cb(val)
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            if not self._closed:
+                try:
+                    self._job = self.root.after(TASK_POLL_MS, self._poll)
+                except tk.TclError:
+                    pass
+
+    def cancel_all(self):
+        for token in list(self._tokens):
+            token.cancel()
+        self._tokens.clear()
+
+    def shutdown(self):
+        self._closed = True
+        self.cancel_all()
+        if self._job is not None:
+            try: self.root.after_cancel(self._job)
+            except Exception: pass
+            self._job = None
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# ---------------- Loop asyncio ----------------
+# Camada de dados assíncrona: um loop asyncio numa thread própria, com as
+# chamadas bloqueantes (pymysql, to_csv) no executor dele. As coroutines
+# (fetch_*_async, exportar_*_async) podem ser combinadas com gather/tasks e
+# canceladas; o Tk as agenda com TaskRunner.submit_async.
+AIO_WORKERS = TASK_WORKERS + 2   # threads do executor das chamadas bloqueantes
+
+
+class LoopAssincrono:
+    """Loop asyncio rodando numa thread daemon; submit() vale de qualquer thread."""
+    def __init__(self, workers=AIO_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="regua-aio")
+        self.loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self.loop.run_forever, name="regua-asyncio", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """Agenda a coroutine; devolve um concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Espera a coroutine terminar (scripts e serviço; nunca na thread do Tk)."""
+        return self.submit(coro).result(timeout)
+
+    def fechar(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_aio = None
+_aio_lock = threading.Lock()
+
+def get_aio():
+    global _aio
+    with _aio_lock:
+        if _aio is None:
+            _aio = LoopAssincrono()
+        return _aio
+
+
+def fechar_aio():
+    global _aio
+    with _aio_lock:
+        if _aio is not None:
+            _aio.fechar()
+        _aio = None
+
+
+async def em_thread(fn, *args, token=None, **kwargs):
+    """
+    fn(*args, **kwargs) bloqueante no executor do loop. Com `token`, ele é
+    repassado a fn e cancelado junto com a coroutine: a consulta em
+    andamento leva KILL QUERY em vez de rodar até o fim.
+    """
+    if token is not None:
+        kwargs["token"] = token
+    fut = asyncio.get_running_loop().run_in_executor(None, partial(fn, *args, **kwargs))
+    try:
+        return await fut
+    except asyncio.CancelledError:
+        if token is not None:
+            token.cancel()
+        raise
+
+
+async def aguardar_async(future):
+    """concurrent.futures.Future (ex.: a pré-carga) como coroutine."""
+    return await asyncio.wrap_future(future)
+
+# ---------------- Pool de conexões ----------------
+POOL_SIZE = 6   # conexões simultâneas por processo
+
+
+class ConnectionPool:
+    """Pool simples de conexões pymysql reaproveitadas entre consultas."""
+    def __init__(self, size=POOL_SIZE, **params):
+        self.params = params
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+                conn.ping(reconnect=True)
+            except queue.Empty:
+                conn = None
+            except Exception:
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = pymysql.connect(**self.params)
+            yield conn
+        except Exception:
+            # conexão em estado incerto (erro/KILL no meio da leitura): descarta
+            self._close(conn)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+            self._slots.release()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            if conn is not None:
+                conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if REPLAY is not None:
+        return REPLAY   # sem banco: run_prepared serve as fixtures
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(**DB)
+        return _pool
+
+# ---------------- Consultas parametrizadas ----------------
+# Os SQL_* continuam sendo templates: montar_consulta troca {in_list}, o filtro
+# do operador e as listas de contratos/cod_cad por placeholders e devolve
+# (sql, params), sem colar valor nenhum no texto. As consultas quentes
+# (PREPARED_QUENTES) rodam como prepared statements do servidor, guardados por
+# conexão do pool e por aridade dos parâmetros: o servidor faz parse e
+# resolução uma vez e as chamadas seguintes só mandam os valores.
+# REGUA_PREPARED=0 volta a mandar o texto a cada chamada (ainda com parâmetros).
+PREPARED_ENABLED = os.environ.get("REGUA_PREPARED", "1") != "0"
+PREPARED_POR_CONEXAO = 32   # statements vivos por conexão (o mais antigo sai)
+PREPARED_QUENTES = {"main", "qr", "qr_set", "cpc", "nao", "perfil", "operadores", "emails",
+                    "tempo_hist", "tempo_acordo"}
+
+_PLACEHOLDER = re.compile(r"\{(in_list|operador_where|extra_where|nm_list|cod_list)\}")
+
+
+class ParamOperador(str):
+    """Nome do operador como parâmetro (o pymysql o trata como str; a gravação o anonimiza)."""
+
+
+def montar_consulta(template, carteiras=(), operador=None, lista=None):
+    """
+    Template SQL_* -> (sql, params): cada placeholder vira %s, na ordem em
+    que aparece no texto ({in_list} repetido repete os valores). Os '%' do
+    template são escapados para o pymysql.
+    """
+    op = (LOCKED_USER or operador or "").strip()
+    # só os placeholders presentes no template: nm_list (nmcont é VARCHAR) não passa por int()
+    valores = {
+        "in_list": lambda: [int(c) for c in carteiras],
+        "operador_where": lambda: [ParamOperador(op)] if op else [],
+        "extra_where": lambda: [],
+        "nm_list": lambda: [str(c) for c in lista or ()],
+        "cod_list": lambda: [int(c) for c in lista or ()],
+    }
+    feitos = {}
+    partes, params, pos = [], [], 0
+    for m in _PLACEHOLDER.finditer(template):
+        partes.append(template[pos:m.start()].replace("%", "%%"))
+        nome = m.group(1)
+        if nome not in feitos:
+            feitos[nome] = valores[nome]()
+        v = feitos[nome]
+        if nome == "operador_where":
+            partes.append(" AND TRIM(usu.nomeusu) = %s" if v else "")
+        elif nome != "extra_where":
+            partes.append(",".join(["%s"] * len(v)))
+        params += v
+        pos = m.end()
+    partes.append(template[pos:].replace("%", "%%"))
+    return "".join(partes), params
+
+
+def _texto_prepare(sql):
+    """Formato do pymysql (%s, %%) -> formato do PREPARE (?, %), sem o ';' final."""
+    sql = re.sub(r"%([%s])", lambda m: "%" if m.group(1) == "%" else "?", sql)
+    return sql.strip().rstrip(";")
+
+
+class Preparadas:
+    """
+    Prepared statements por conexão do pool. O pymysql só fala o protocolo
+    texto, então é PREPARE/EXECUTE ... USING @variáveis. Chave: (consulta,
+    aridade); uma conexão reconectada (thread_id novo) começa do zero.
+    PREPARE, DEALLOCATE e o SET das variáveis passam por run_comando (tempo
+    limite e cancelamento como a consulta). O parse/plano poupado é estimado
+    como reusos x tempo médio do PREPARE, menos o tempo medido dos SET (uma
+    ida ao servidor a mais por chamada, que o modo texto não tem).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conexoes = weakref.WeakKeyDictionary()   # conn -> (thread_id, OrderedDict chave -> nome)
+        self._seq = itertools.count(1)
+        self._recusadas = set()   # chaves que o servidor não preparou: ficam no modo texto
+        self.stats = {}           # consulta -> [preparos, reusos, ms de PREPARE, ms de SET]
+
+    def _statements(self, conn):
+        tid = conn.thread_id()
+        with self._lock:
+            atual = self._conexoes.get(conn)
+            if atual is None or atual[0] != tid:
+                atual = self._conexoes[conn] = (tid, OrderedDict())
+            return atual[1]
+
+    def _contar(self, nome, preparo_ms=None):
+        with self._lock:
+            st = self.stats.setdefault(nome, [0, 0, 0.0, 0.0])
+            if preparo_ms is None:
+                st[1] += 1
+                medio = st[2] / st[0] if st[0] else 0.0
+            else:
+                st[0] += 1
+                st[2] += preparo_ms
+        if preparo_ms is None:
+            METRICAS.inc("regua_sql_reusos_total", consulta=nome)
+            METRICAS.inc("regua_sql_poupado_ms_total", round(medio, 3), consulta=nome)
+        else:
+            METRICAS.inc("regua_sql_preparos_total", consulta=nome)
+            METRICAS.observar("regua_sql_preparo_ms", preparo_ms, consulta=nome)
+
+    def _contar_set(self, nome, ms):
+        with self._lock:
+            self.stats.setdefault(nome, [0, 0, 0.0, 0.0])[3] += ms
+        METRICAS.inc("regua_sql_set_ms_total", round(ms, 3), consulta=nome)
+
+    def executar(self, nome, sql, params, conn, token=None, timeout=QUERY_TIMEOUT_S):
+        chave = (nome, len(params))
+        if not PREPARED_ENABLED or nome not in PREPARED_QUENTES or chave in self._recusadas:
+            return run_query(sql, conn, token=token, timeout=timeout, params=params)
+
+        stmts = self._statements(conn)
+        stmt = stmts.get(chave)
+        if stmt is None:
+            stmt = f"regua_{nome}_{next(self._seq)}"
+            t0 = time.perf_counter()
+            try:
+                run_comando(f"PREPARE {stmt} FROM %s", conn, (_texto_prepare(sql),),
+                            token=token, timeout=timeout)
+            except pymysql.MySQLError as e:
+                codigo = e.args[0] if e.args else 0
+                if not (isinstance(codigo, int) and 1000 <= codigo < 2000):
+                    raise   # erro de conexão, não do statement
+                if codigo != 1461:   # 1461 = max_prepared_stmt_count: tenta de novo depois
+                    self._recusadas.add(chave)
+                return run_query(sql, conn, token=token, timeout=timeout, params=params)
+            self._contar(nome, (time.perf_counter() - t0) * 1000)
+            stmts[chave] = stmt
+            while len(stmts) > PREPARED_POR_CONEXAO:
+                _k, velho = stmts.popitem(last=False)
+                run_comando(f"DEALLOCATE PREPARE {velho}", conn, token=token, timeout=timeout)
+        else:
+            stmts.move_to_end(chave)
+            self._contar(nome)
+        if params:
+            t0 = time.perf_counter()
+            run_comando("SET " + ", ".join(f"@regua_p{i}=%s" for i in range(len(params))), conn,
+                        params, token=token, timeout=timeout)
+            self._contar_set(nome, (time.perf_counter() - t0) * 1000)
+        using = " USING " + ", ".join(f"@regua_p{i}" for i in range(len(params))) if params else ""
+        return run_query(f"EXECUTE {stmt}{using}", conn, token=token, timeout=timeout)
+
+    def resumo(self):
+        """consulta -> preparos, reusos, ms médio do PREPARE, ms dos SET e ms poupados (estimativa, já sem os SET)."""
+        with self._lock:
+            out = {}
+            for nome, (prep, reusos, ms, set_ms) in sorted(self.stats.items()):
+                medio = ms / prep if prep else 0.0
+                out[nome] = {"preparos": prep, "reusos": reusos, "preparo_ms": round(medio, 2),
+                             "set_ms": round(set_ms, 1), "poupado_ms": round(medio * reusos - set_ms, 1)}
+            return out
+
+
+PREPARADAS = Preparadas()
+
+
+def run_prepared(nome, sql, params, conn, token=None, timeout=QUERY_TIMEOUT_S):
+    """
+    run_query com parâmetros vinculados; as consultas quentes reaproveitam o
+    PREPARE. Toda consulta do app passa aqui: é o ponto de gravação/replay.
+    """
+    if REPLAY is not None:
+        return REPLAY.executar(nome, params, token=token)
+    t0 = time.perf_counter()
+    df = PREPARADAS.executar(nome, sql, params, conn, token=token, timeout=timeout)
+    if GRAVADOR is not None:
+        GRAVADOR.gravar(nome, params, df, (time.perf_counter() - t0) * 1000)
+    return df
+
+# ---------------- Tela Inicial ----------------
+class TelaInicial(ttk.Frame):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        app.title("Selecionar Carteiras e Operador")
+        app.resizable(False, False)
+
+        self.font_base, self.font_title, self.font_strong = app.font_base, app.font_title, app.font_strong
+        self.style = app.style
+        self.dark_var = app.dark_var
+        self.tasks = app.tasks
+        self._binds = []
+        self._confirmado = False
+        self._ops_token = None           # busca de operadores em andamento
+        self._continuar_pendente = False # Continuar pedido antes da lista chegar
 
         top = ttk.Frame(self); top.grid(row=0, column=0, sticky="ew", padx=12, pady=(10,4))
         ttk.Label(top, text="Selecione as carteiras e (opcional) o operador", style="Title.TLabel").pack(side="left")
@@ -409,16 +1177,21 @@ class TelaInicial(tk.Tk):
                                       values=self.style.theme_names())
         self.theme_box.pack(side="left")
         self.theme_box.bind("<<ComboboxSelected>>",
-                            lambda e: (theme_apply(self, self.theme_var.get()),
-                                       apply_palette(self, self.dark_var.get())))
+                            lambda e: (theme_apply(app, self.theme_var.get()),
+                                       apply_palette(app, self.dark_var.get())))
         self.dark_chk = ttk.Checkbutton(right, text="🌙 Escuro", variable=self.dark_var,
-                                        command=lambda: apply_palette(self, self.dark_var.get()))
+                                        command=lambda: apply_palette(app, self.dark_var.get()))
         self.dark_chk.pack(side="left", padx=(8,0))
 
         self.prefs = load_prefs()
         self.vars = []
         pref_carts = set(self.prefs.get("carteiras", []))
 
+        # seleção salva: começa a carregar já, em segundo plano
+        # (a não ser que a sessão já tenha esses dados)
+        if pref_carts and app.sessao.get(pref_carts, self.prefs.get("operador")) is None:
+            start_prefetch(pref_carts, self.prefs.get("operador"))
+
         for i, (label, code) in enumerate(CARTEIRAS, start=1):
             v = tk.BooleanVar(value=(code in pref_carts) if pref_carts else (code == 517))
             self.vars.append((v, code, label))
@@ -432,13 +1205,14 @@ class TelaInicial(tk.Tk):
         self.operadores_cbx = ttk.Combobox(self, state="readonly", values=["— carregando —"], width=40)
         self.operadores_cbx.grid(row=len(CARTEIRAS)+3, column=0, padx=14, pady=(0, 10), sticky="w")
         self.operadores_cbx.set("— carregando —")
+        self.operadores_cbx.bind("<<ComboboxSelected>>", lambda e: self._revisar_prefetch())
 
         bar = ttk.Frame(self); bar.grid(row=len(CARTEIRAS)+4, column=0, padx=14, pady=(0, 14), sticky="ew")
         ttk.Button(bar, text="Cancelar", command=self._cancelar).pack(side="right", padx=(0,6))
         ttk.Button(bar, text="Continuar", command=self._continuar).pack(side="right")
 
-        self.bind("<Return>", lambda e: self._continuar())
-        self.bind("<Escape>", lambda e: self._cancelar())
+        self._bind_app("<Return>", lambda e: self._continuar())
+        self._bind_app("<Escape>", lambda e: self._cancelar())
 
         self._atualizar_operadores()
 
@@ -448,31 +1222,37 @@ class TelaInicial(tk.Tk):
     def _carteiras_escolhidas(self):
         return [code for v, code, _ in self.vars if v.get()]
 
-    def _buscar_operadores(self, carteiras):
-        if not carteiras: return []
-        in_list = ",".join(str(c) for c in carteiras)
-        sql = f"""
-        SELECT DISTINCT TRIM(usu.nomeusu) AS nomeusu
-        FROM cadastros_tb cad
-        JOIN usu_tb usu ON usu.cod_usu = cad.cod_usu
-        WHERE cad.cod_cli IN ({in_list})
-        AND cad.stcli <> 'INA'
-        ORDER BY 1;""".strip()
-        try:
-            conn = pymysql.connect(**DB)
-            df = pd.read_sql_query(sql, conn); conn.close()
-            ops = df["nomeusu"].dropna().astype(str).str.strip().unique().tolist()
+    def _buscar_operadores(self, carteiras, on_done):
+        """Busca os operadores no loop asyncio e entrega a lista a on_done (na thread do Tk)."""
+        if self._ops_token is not None:
+            self._ops_token.cancel()
+        if not carteiras:
+            self._ops_token = None
+            on_done([])
+            return
+
+        def _ok(ops):
+            self._ops_token = None
             if LOCKED_USER:
                 alvo = LOCKED_USER.strip().lower()
                 ops = [o for o in ops if o.strip().lower() == alvo]
-            return [o for o in ops if o]
-        except Exception as e:
+            on_done([o for o in ops if o])
+
+        def _erro(e):
+            self._ops_token = None
             messagebox.showwarning("Aviso", f"Não foi possível carregar operadores:\n{e}")
-            return []
+            on_done([])
+
+        self._ops_token = self.tasks.submit_async(fetch_operadores_async(carteiras),
+                                                  on_done=_ok, on_error=_erro)
 
     def _atualizar_operadores(self):
-        liste = self._carteiras_escolhidas()
-        ops = self._buscar_operadores(liste)
+        if not LOCKED_USER:
+            self.operadores_cbx.config(values=["— carregando —"])
+            self.operadores_cbx.set("— carregando —")
+        self._buscar_operadores(self._carteiras_escolhidas(), self._preencher_operadores)
+
+    def _preencher_operadores(self, ops):
         valores = ["— Todos —"] + ops if ops else ["— Todos —"]
 
         if LOCKED_USER:
@@ -483,33 +1263,63 @@ class TelaInicial(tk.Tk):
             self.operadores_cbx.config(values=valores, state="readonly")
             preferido = self.prefs.get("operador") or "— Todos —"
             self.operadores_cbx.set(preferido if preferido in valores else valores[0])
+        self._revisar_prefetch()
+        if self._continuar_pendente:
+            self._continuar_pendente = False
+            self._continuar()
+
+    def _operador_escolhido(self):
+        if LOCKED_USER:
+            return LOCKED_USER
+        op = self.operadores_cbx.get().strip()
+        return None if (op == "" or op.startswith("—")) else op
+
+    def _revisar_prefetch(self):
+        check_prefetch(self._carteiras_escolhidas(), self._operador_escolhido())
 
     def _continuar(self):
+        if self._confirmado:
+            return
+        if self._ops_token is not None:
+            # lista de operadores ainda chegando: continua quando ela chegar
+            self._continuar_pendente = True
+            return
         escolhidas = self._carteiras_escolhidas()
         if not escolhidas:
             messagebox.showwarning("Aviso", "Selecione ao menos uma carteira."); return
-        if LOCKED_USER:
-            self._operador = LOCKED_USER
-        else:
-            op = self.operadores_cbx.get().strip()
-            self._operador = None if (op == "" or op.startswith("—")) else op
+        self._operador = self._operador_escolhido()
         self._carteiras = escolhidas
+        self._confirmado = True
         prefs = load_prefs()
         prefs["carteiras"] = escolhidas
         if self._operador: prefs["operador"] = self._operador
         prefs["theme"] = ttk.Style(self).theme_use()
         prefs["dark_mode"] = self.dark_var.get()
         save_prefs(prefs)
-        self.destroy()
+        # troca fora do callback do botão (que pertence a esta tela)
+        self.app.after_idle(self.app.mostrar_dados, self._carteiras, self._operador)
 
     def _cancelar(self):
         self._carteiras, self._operador = None, None
-        self.destroy()
+        self.app.fechar()
 
     @property
     def resultado(self):
         return self._carteiras, self._operador
 
+    # ---- troca de tela ----
+    def _bind_app(self, seq, fn):
+        self._binds.append((seq, self.app.bind(seq, fn)))
+
+    def sair(self):
+        if self._ops_token is not None:
+            self._ops_token.cancel()
+            self._ops_token = None
+        for seq, fid in self._binds:
+            try: self.app.unbind(seq, fid)
+            except Exception: pass
+        self._binds = []
+
 # ---------------- helpers de flags ----------------
 def _fmt_flag(x):
     try:
@@ -537,43 +1347,2688 @@ def _fmt_comprometimento(x):
     except Exception:
         return str(x)
 
-# ---------------- Tela de Dados ----------------
-class TelaDados(tk.Tk):
-    def __init__(self, carteiras, operador):
-        super().__init__()
-        self.title("Navegação de Contratos")
-        self.resizable(True, True)
+# ---------------- Carga de dados ----------------
+# Modo de colunas sob demanda (REGUA_LAZY=1): a carga traz só a base e os
+# conjuntos dos filtros; acordo e perfil de cada contrato vêm em lotes quando
+# ele (ou um vizinho na navegação) aparece. Ver ColunasSobDemanda.
+LAZY_COLUMNS = os.environ.get("REGUA_LAZY", "0") == "1"
+
+
+def load_query_names(lazy=None):
+    lazy = LAZY_COLUMNS if lazy is None else lazy
+    return ("main", "qr_set", "cpc", "nao") if lazy else ("main", "qr", "cpc", "nao", "perfil")
+
+
+LOAD_TEMPLATES = {
+    "main":   SQL_BASE,
+    # QR / CPC / NAO
+    "qr":     SQL_NMCONT_QR,
+    "qr_set": SQL_NMCONT_QR_SET,
+    "cpc":    SQL_NMCONT_CPC,
+    "nao":    SQL_NMCONT_NAO,
+    # NOVO perfil
+    "perfil": SQL_NMCONT_PERFIL,
+}
+
+
+def build_load_sqls(carteiras, operador, lazy=None):
+    """SQLs da carga da TelaDados (base principal + conjuntos + perfil): nome -> (sql, params)."""
+    return {nome: montar_consulta(LOAD_TEMPLATES[nome], carteiras, operador)
+            for nome in load_query_names(lazy)}
+
+
+# colunas que acordo/perfil acrescentam à base
+COLUNAS_ACORDO = ["data_aco", "vlr_aco", "qtd_p_aco", "qtdaco"]
+COLUNAS_PERFIL = ["infoad", "comprom_txt", "flag_apos_txt", "flag_bolsa_txt",
+                  "flag_veic_txt", "flag_vinc_txt", "flag_obito_txt"]
+
+# colunas dos auxiliares quando a consulta falha
+EMPTY_COLS = {
+    "qr":     ["nmcont", "data_aco", "vlr_aco", "qtd_p_aco"],
+    "qr_set": ["nmcont"],
+    "cpc":    ["nmcont", "dt_ultimo_cpc"],
+    "nao":    ["nmcont"],
+    "perfil": ["nmcont", "infoad", "comprometimento_credito", "flag_aposentado",
+               "flag_bolsafamilia", "flag_veiculo", "flag_vinculo_empregaticio", "flag_obito"],
+    "qr_fatia":     ["nmcont", "cod_aco", "staco", "data_aco", "vlr_aco", "qtd_p_aco", "qtdaco"],
+    "qr_set_fatia": ["nmcont", "cod_aco", "staco"],
+    "perfil_fatia": ["nmcont", "cod_cad", "infoad", "comprometimento_credito", "flag_aposentado",
+                     "flag_bolsafamilia", "flag_veiculo", "flag_vinculo_empregaticio", "flag_obito"],
+}
+
+
+def _prep_acordo(df_qr):
+    """SQL_NMCONT_QR -> contrato + COLUNAS_ACORDO."""
+    df = df_qr.rename(columns={"nmcont": "contrato"})
+    for col in COLUNAS_ACORDO:
+        if col not in df.columns:
+            df[col] = pd.NA
+    df["data_aco"] = pd.to_datetime(df["data_aco"], errors="coerce")
+    return df[["contrato"] + COLUNAS_ACORDO]
+
+
+def _prep_perfil(df_perfil):
+    """SQL_NMCONT_PERFIL -> contrato + COLUNAS_PERFIL (textos prontos para o Detalhe)."""
+    df_pf = df_perfil.rename(columns={"nmcont":"contrato"}).copy()
+    # formatações amigáveis
+    df_pf["comprom_txt"] = df_pf["comprometimento_credito"].apply(_fmt_comprometimento)
+    df_pf["flag_apos_txt"]  = df_pf["flag_aposentado"].apply(_fmt_flag)
+    df_pf["flag_bolsa_txt"] = df_pf["flag_bolsafamilia"].apply(_fmt_flag)
+    df_pf["flag_veic_txt"]  = df_pf["flag_veiculo"].apply(_fmt_flag)
+    df_pf["flag_vinc_txt"]  = df_pf["flag_vinculo_empregaticio"].apply(_fmt_flag)
+    df_pf["flag_obito_txt"] = df_pf["flag_obito"].apply(_fmt_flag)
+    return df_pf[["contrato"] + COLUNAS_PERFIL]
+
+
+def merge_contratos(df_main, df_qr, df_cpc, df_nao, df_perfil):
+    """
+    Mescla base + acordo + CPC + perfil; devolve (df, set_qr, set_cpc, set_nao).
+    df_perfil None = modo sob demanda: df_qr é só o conjunto e a base fica sem
+    as colunas de acordo/perfil.
+    """
+    lazy = df_perfil is None
 
-        self.font_base  = tkfont.Font(family="Segoe UI", size=10)
-        self.font_title = tkfont.Font(family="Segoe UI", size=11, weight="bold")
-        self.font_strong= tkfont.Font(family="Segoe UI", size=10, weight="bold")
+    # --- MESCLA: acordo ---
+    if lazy:
+        pass
+    elif not df_qr.empty:
+        df_main = df_main.merge(_prep_acordo(df_qr), on="contrato", how="left")
+    else:
+        df_main["data_aco"] = pd.NaT
+        df_main["vlr_aco"]  = pd.NA
+        df_main["qtd_p_aco"]= pd.NA
+        df_main["qtdaco"]   = pd.NA
+
+    # --- MESCLA: CPC ---
+    if not df_cpc.empty:
+        df_cpc_ren = df_cpc.rename(columns={"nmcont": "contrato"})
+        df_cpc_ren["dt_ultimo_cpc"] = pd.to_datetime(df_cpc_ren["dt_ultimo_cpc"], errors="coerce")
+        df_main = df_main.merge(
+            df_cpc_ren[["contrato", "dt_ultimo_cpc"]],
+            on="contrato", how="left"
+        )
+    else:
+        df_main["dt_ultimo_cpc"] = pd.NaT
 
-        self.style = ttk.Style(self)
-        theme_apply(self, get_initial_theme(self.style))
-        self.option_add("*Font", self.font_base)
-        self.style.configure(".", padding=6)
-        self.style.configure("TButton", padding=(10,6))
-        self.style.configure("Title.TLabel", font=self.font_title)
-        self.style.configure("Strong.TLabel", font=self.font_strong)
+    # --- MESCLA: PERFIL ---
+    if lazy:
+        pass
+    elif not df_perfil.empty:
+        df_main = df_main.merge(_prep_perfil(df_perfil), on="contrato", how="left")
+    else:
+        for col in COLUNAS_PERFIL:
+            df_main[col] = ""
 
-        self.dark_var = tk.BooleanVar(value=get_initial_dark())
-        apply_palette(self, self.dark_var.get())
+    # conjuntos para filtros por nmcont
+    set_qr  = set(df_qr["nmcont"].astype(str))  if not df_qr.empty  else set()
+    set_cpc = set(df_cpc["nmcont"].astype(str)) if not df_cpc.empty else set()
+    set_nao = set(df_nao["nmcont"].astype(str)) if not df_nao.empty else set()
+    return df_main, set_qr, set_cpc, set_nao
 
-        self.columnconfigure(0, weight=1)
-        self.rowconfigure(7, weight=1)
 
-        self.carteiras = carteiras
-        self.operador = operador
+def load_contratos(carteiras, operador, token=None):
+    """Carga completa da TelaDados (roda no TaskRunner)."""
+    sqls = build_load_sqls(carteiras, operador)
+    with get_pool().connection() as conn:
+        def _ler(nome):
+            try:
+                return run_prepared(nome, *sqls[nome], conn, token=token)
+            except TaskCancelled:
+                raise
+            except Exception:
+                return pd.DataFrame(columns=EMPTY_COLS[nome])
+
+        # base principal
+        df_main = run_prepared("main", *sqls["main"], conn, token=token)
+        # conjuntos auxiliares + perfil
+        if "perfil" in sqls:
+            df_qr, df_cpc, df_nao, df_perfil = (_ler(n) for n in ("qr", "cpc", "nao", "perfil"))
+        else:
+            df_qr, df_cpc, df_nao = (_ler(n) for n in ("qr_set", "cpc", "nao"))
+            df_perfil = None
+
+    return merge_contratos(df_main, df_qr, df_cpc, df_nao, df_perfil)
+
+def filtrar_contratos(df_src, conjuntos, cor="todos"):
+    """Filtros da TelaDados: união dos conjuntos de nmcont marcados + faixa de cor."""
+    if isinstance(df_src, BaseMapeada):
+        return VisaoPaginada(df_src, df_src.filtrar(conjuntos, cor))
+    if not conjuntos:
+        df_filtrado = df_src
+    else:
+        allow = set().union(*conjuntos) if conjuntos else set()
+        df_filtrado = df_src[df_src["contrato"].astype(str).isin(allow)]
+
+    if cor in ("verde", "amarelo", "vermelho"):
+        # a mesma faixa do modo paginado: _cor da carga (color_buckets)
+        faixa = (df_filtrado["_cor"].to_numpy() if "_cor" in df_filtrado.columns
+                 else color_buckets(df_filtrado["ultima_data"]))
+        df_filtrado = df_filtrado[faixa == cor]
+    return df_filtrado
+
+
+# ---- carga fatiada por carteira ----
+# Cada consulta roda uma vez por carteira, em conexões separadas do pool, e as
+# partes são concatenadas. Partes já carregadas ficam em cache por alguns
+# minutos: incluir/remover uma carteira na TelaInicial só consulta a diferença.
+#
+# Opcional (REGUA_SHARDED=1). Contrato com acordos/cadastros em mais de uma
+# carteira: Q/R e perfil rodam nas versões _FATIA, que devolvem o candidato
+# de cada carteira com cod_aco/cod_cad; fica o de maior chave, qtdaco é a
+# soma das fatias e o staco IN ('Q','E') é testado depois dessa escolha,
+# como na consulta única. CPC (MAX) e NAO (existe algum) já se juntam sem perda.
+SHARDED_LOAD      = os.environ.get("REGUA_SHARDED", "0") == "1"
+SHARD_CACHE_TTL_S = 600
+
+_shard_cache = {}   # (carteira, operador, consulta) -> (instante, df)
+_shard_lock = threading.Lock()
+
+# consulta da carga -> (nome da versão por fatia, template)
+FATIAS = {
+    "qr":     ("qr_fatia", SQL_NMCONT_QR_FATIA),
+    "qr_set": ("qr_set_fatia", SQL_NMCONT_QR_SET_FATIA),
+    "perfil": ("perfil_fatia", SQL_NMCONT_PERFIL_FATIA),
+}
+
+
+def _shard_query(carteira, operador, nome, token=None):
+    chave = (carteira, (LOCKED_USER or operador or "").strip(), nome)
+    with _shard_lock:
+        hit = _shard_cache.get(chave)
+    if hit is not None and time.time() - hit[0] < SHARD_CACHE_TTL_S:
+        return hit[1]
+
+    nome_sql, template = FATIAS.get(nome, (nome, LOAD_TEMPLATES[nome]))
+    sql, params = montar_consulta(template, [carteira], operador)
+    try:
+        with get_pool().connection() as conn:
+            df = run_prepared(nome_sql, sql, params, conn, token=token)
+    except TaskCancelled:
+        raise
+    except Exception:
+        if nome == "main":
+            raise
+        return pd.DataFrame(columns=EMPTY_COLS[nome_sql])   # falha não entra no cache
+
+    with _shard_lock:
+        _shard_cache[chave] = (time.time(), df)
+    return df
+
+
+def clear_shard_cache(carteiras=None, operador=None):
+    """Limpa o cache de partes (só o das carteiras/operador, se informados)."""
+    with _shard_lock:
+        if carteiras is None:
+            _shard_cache.clear()
+            return
+        op = (LOCKED_USER or operador or "").strip()
+        for chave in [k for k in _shard_cache if k[0] in carteiras and k[1] == op]:
+            del _shard_cache[chave]
+
+
+def _concat(partes):
+    partes = [p for p in partes if not p.empty] or partes[:1]
+    return pd.concat(partes, ignore_index=True)
+
+
+def _maior_por_nmcont(df, chave):
+    """Uma linha por nmcont: a de maior `chave` entre as fatias (o ROW_NUMBER ... DESC da consulta única)."""
+    k = pd.to_numeric(df[chave], errors="coerce").to_numpy()
+    ordem = np.argsort(-np.nan_to_num(k, nan=-np.inf), kind="stable")
+    return df.iloc[ordem].drop_duplicates("nmcont").reset_index(drop=True)
+
+
+def _reduzir_qr(df):
+    """Candidatos Q/R das fatias -> resultado da consulta única (acordo mais novo, qtdaco total, staco Q/E)."""
+    if df.empty:
+        return df.drop(columns=["cod_aco", "staco"], errors="ignore")
+    topo = _maior_por_nmcont(df, "cod_aco")
+    if "qtdaco" in df.columns:
+        total = pd.to_numeric(df["qtdaco"], errors="coerce").groupby(df["nmcont"], sort=False).sum()
+        topo["qtdaco"] = topo["nmcont"].map(total).to_numpy()
+    # o IN do MySQL ignora caixa e espaço à direita
+    qe = topo["staco"].fillna("").astype(str).str.rstrip().str.upper().isin(["Q", "E"])
+    return topo[qe.to_numpy()].drop(columns=["cod_aco", "staco"]).reset_index(drop=True)
+
+
+def load_contratos_sharded(carteiras, operador, token=None):
+    """Igual a load_contratos, mas consultando cada carteira em paralelo."""
+    nomes = load_query_names()
+    jobs = [(c, n) for c in carteiras for n in nomes]
+    with ThreadPoolExecutor(max_workers=min(len(jobs), POOL_SIZE),
+                            thread_name_prefix="regua-shard") as ex:
+        futs = {job: ex.submit(_shard_query, job[0], operador, job[1], token) for job in jobs}
+        partes = {job: f.result() for job, f in futs.items()}
+
+    def juntar(nome):
+        return _concat([partes[(c, nome)] for c in carteiras])
+
+    # mesma ordem do SQL_BASE: ultima_data, nomecli
+    df_main = juntar("main")
+    if not df_main.empty:
+        ordem = pd.DataFrame({
+            "d": pd.to_datetime(df_main["ultima_data"], errors="coerce"),
+            "n": df_main["nomecli"].fillna("").astype(str).str.casefold(),
+        })
+        df_main = df_main.iloc[ordem.sort_values(["d", "n"], kind="stable").index].reset_index(drop=True)
+
+    # um nmcont por linha, como no resultado com IN (...)
+    df_qr = _reduzir_qr(juntar("qr" if "qr" in nomes else "qr_set"))
+    df_cpc = juntar("cpc")
+    if not df_cpc.empty:
+        df_cpc = df_cpc.groupby("nmcont", as_index=False, sort=False)["dt_ultimo_cpc"].max()
+    df_nao = juntar("nao").drop_duplicates("nmcont")
+    df_perfil = (_maior_por_nmcont(juntar("perfil"), "cod_cad").drop(columns=["cod_cad"])
+                 if "perfil" in nomes else None)
+
+    return merge_contratos(df_main, df_qr, df_cpc, df_nao, df_perfil)
+
+
+# ---------------- Cache compartilhado no host ----------------
+# Em servidores de terminal dezenas de sessões carregam as mesmas carteiras.
+# O primeiro processo que carrega um conjunto (carteiras, versão das consultas)
+# publica o resultado "Todos" como arquivo Arrow IPC; os demais o mapeiam em
+# memória (sem cópia das colunas de texto) e filtram o operador localmente.
+# Opcional (REGUA_HOST_CACHE=1): cada falta carrega a carteira inteira, mesmo
+# para um operador só, e grava a base toda em disco compartilhado da máquina.
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as pa_ipc
+except ImportError:   # pyarrow é opcional: sem ele o cache do host e o modo paginado ficam desligados
+    pa = None
+
+HOST_CACHE_ENABLED = (pa is not None and os.environ.get("REGUA_HOST_CACHE", "0") == "1"
+                      and not os.environ.get("REGUA_GRAVAR"))   # gravando, toda carga vai ao banco
+HOST_CACHE_DIR = os.environ.get("REGUA_HOST_CACHE_DIR") or os.path.join(
+    os.environ.get("PROGRAMDATA") or tempfile.gettempdir(), "ReguaTotal", "cache")
+HOST_CACHE_TTL_S  = SHARD_CACHE_TTL_S
+HOST_CACHE_BEAT_S = 15    # o dono da carga renova o mtime do .lock nesse intervalo
+HOST_CACHE_LOCK_S = max(QUERY_TIMEOUT_S, 10 * HOST_CACHE_BEAT_S)   # .lock sem renovação há mais que isso: dono morreu
+
+QUERY_VERSION = hashlib.sha1("".join(
+    (SQL_BASE, SQL_NMCONT_QR, SQL_NMCONT_QR_SET, SQL_NMCONT_CPC, SQL_NMCONT_NAO, SQL_NMCONT_PERFIL)
+).encode("utf-8")).hexdigest()[:10]
+
+_HOST_DATE_COLS = ("ultima_data", "data_aco", "dt_ultimo_cpc")
+_HOST_NUM_COLS  = ("vlr_aco", "qtd_p_aco", "qtdaco")
+
+
+def _host_key(carteiras):
+    modo = "_lazy" if LAZY_COLUMNS else ""
+    if LOCKED_USER:
+        # build travado: o "Todos" dele só tem as linhas do usuário, não pode servir aos outros
+        modo += "_u" + hashlib.sha1(LOCKED_USER.strip().encode("utf-8")).hexdigest()[:8]
+    return "contratos_" + "-".join(str(c) for c in sorted(int(c) for c in carteiras)) + modo + "_" + QUERY_VERSION
+
+
+def _host_files(key):
+    """Arquivos publicados para a chave, do mais novo para o mais antigo: [(stamp_ms, path)]."""
+    out = []
+    for path in glob.glob(os.path.join(HOST_CACHE_DIR, key + "_*.arrow")):
+        if path.endswith(".sets.arrow"):
+            continue
+        try:
+            out.append((int(path.rsplit("_", 1)[1].split(".")[0]), path))
+        except ValueError:
+            pass
+    return sorted(out, reverse=True)
+
+
+def _to_arrow_frame(df):
+    """Tipos estáveis para o Arrow: datas, números float e texto sem nulos."""
+    df = df.copy()
+    for col in df.columns:
+        if col in _HOST_DATE_COLS:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif col in _HOST_NUM_COLS:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        elif not (pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_datetime64_any_dtype(df[col])):
+            df[col] = df[col].where(df[col].notna(), "").astype(str)
+    return df
+
+
+def _map_arrow(path):
+    # sem `with`: os buffers da tabela mantêm o mapeamento vivo
+    return pa_ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def _result_tables(resultado):
+    """(df, set_qr, set_cpc, set_nao) -> (tabela da base, tabela nmcont/conjunto)."""
+    df, set_qr, set_cpc, set_nao = resultado
+    table = pa.Table.from_pandas(_to_arrow_frame(df), preserve_index=False)
+    nm, conj = [], []
+    for nome, st in (("qr", set_qr), ("cpc", set_cpc), ("nao", set_nao)):
+        nm.extend(st); conj.extend([nome] * len(st))
+    sets = pa.table({"nmcont": pa.array(nm, pa.string()), "conjunto": pa.array(conj, pa.string())})
+    return table, sets
+
+
+def _tabela_para_frame(table):
+    return table.to_pandas(split_blocks=True,
+                           types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+
+def _conjuntos_da_tabela(sets):
+    grupos = {"qr": set(), "cpc": set(), "nao": set()}
+    sets = sets.to_pydict()
+    for nmcont, conj in zip(sets["nmcont"], sets["conjunto"]):
+        grupos[conj].add(nmcont)
+    return grupos["qr"], grupos["cpc"], grupos["nao"]
+
+
+def _result_from_tables(table, sets):
+    return (_tabela_para_frame(table), *_conjuntos_da_tabela(sets))
+
+
+def _host_tabelas(carteiras, desde_ms=0):
+    """(tabela da base, tabela dos conjuntos) mapeadas do arquivo fresco mais novo, ou None."""
+    if not HOST_CACHE_ENABLED:
+        return None
+    agora_ms = time.time() * 1000
+    for stamp, path in _host_files(_host_key(carteiras)):
+        if agora_ms - stamp > HOST_CACHE_TTL_S * 1000 or stamp < desde_ms:
+            break
+        try:
+            return _map_arrow(path), _map_arrow(path[:-len(".arrow")] + ".sets.arrow")
+        except Exception:
+            continue
+    return None
+
+
+def host_cache_get(carteiras, desde_ms=0):
+    """Resultado de load_contratos (operador "Todos") publicado e ainda fresco, ou None.
+
+    desde_ms ignora o que foi publicado antes desse instante (recarga pedida pelo usuário).
+    """
+    tabs = _host_tabelas(carteiras, desde_ms)
+    return _result_from_tables(*tabs) if tabs is not None else None
+
+
+def host_cache_put(carteiras, resultado):
+    """Publica o resultado; falhas de disco não atrapalham a carga."""
+    if not HOST_CACHE_ENABLED:
+        return
+    key = _host_key(carteiras)
+    stamp = int(time.time() * 1000)
+    base = os.path.join(HOST_CACHE_DIR, f"{key}_{stamp}")
+    try:
+        os.makedirs(HOST_CACHE_DIR, exist_ok=True)
+        meta = {b"stamp": str(stamp).encode(), b"query_version": QUERY_VERSION.encode()}
+        table, sets = _result_tables(resultado)
+        table = table.replace_schema_metadata(meta)
+
+        # conjuntos primeiro; o arquivo principal aparece por último (rename atômico)
+        for tbl, path in ((sets, base + ".sets.arrow"), (table, base + ".arrow")):
+            tmp = path + ".tmp"
+            with pa.OSFile(tmp, "wb") as sink, pa_ipc.new_file(sink, tbl.schema) as w:
+                w.write_table(tbl)
+            os.replace(tmp, path)
+    except Exception:
+        return
+
+    # versões antigas: remove o que der (no Windows, arquivos mapeados por outro processo ficam)
+    for _, old in _host_files(key)[1:]:
+        for p in (old, old[:-len(".arrow")] + ".sets.arrow"):
+            try: os.remove(p)
+            except OSError: pass
+
+
+def _ler_dono(path):
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+
+class TravaHost:
+    """
+    .lock da carga do host em nome deste processo: o arquivo guarda o dono e
+    uma thread renova o mtime a cada HOST_CACHE_BEAT_S enquanto a carga roda
+    (uma consulta sozinha pode levar QUERY_TIMEOUT_S). soltar() só apaga o
+    lock se ele ainda for nosso.
+    """
+    def __init__(self, path, dono):
+        self.path, self.dono = path, dono
+        self._fim = threading.Event()
+        t = threading.Thread(target=self._renovar, daemon=True, name="regua-host-lock")
+        t.start()
+
+    def _renovar(self):
+        while not self._fim.wait(HOST_CACHE_BEAT_S):
+            if _ler_dono(self.path) != self.dono:
+                return
+            try: os.utime(self.path)
+            except OSError: pass
+
+    def soltar(self):
+        self._fim.set()
+        if _ler_dono(self.path) == self.dono:
+            try: os.remove(self.path)
+            except OSError: pass
+
+
+def _host_lock(key, carteiras, token=None, desde_ms=0):
+    """
+    Disputa a carga entre processos com um arquivo .lock (O_EXCL). Devolve a
+    TravaHost se este processo deve carregar, ou None se outro processo
+    publicou enquanto esperávamos. Enquanto o dono renova o lock a espera
+    continua; sem renovação por HOST_CACHE_LOCK_S o lock é dado como abandonado.
+    """
+    path = os.path.join(HOST_CACHE_DIR, key + ".lock")
+    try:
+        os.makedirs(HOST_CACHE_DIR, exist_ok=True)
+    except OSError:
+        return None
+    while True:
+        dono = f"{os.getpid()}:{os.urandom(8).hex()}"
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            try:
+                os.write(fd, dono.encode("ascii"))
+            finally:
+                os.close(fd)
+            return TravaHost(path, dono)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
+        try:
+            atual = _ler_dono(path)
+            if time.time() - os.path.getmtime(path) > HOST_CACHE_LOCK_S and _ler_dono(path) == atual:
+                os.remove(path)   # lock abandonado (processo morreu no meio da carga)
+                continue
+        except OSError:
+            continue
+        if token is not None:
+            token.raise_if_cancelled()
+        if _host_tabelas(carteiras, desde_ms) is not None:
+            return None
+        time.sleep(0.5)
+
+
+def filter_operador(resultado, operador):
+    """Recorta um resultado "Todos" para um operador (como o operador_where faria)."""
+    op = (LOCKED_USER or operador or "").strip().casefold()
+    if not op:
+        return resultado
+    df, set_qr, set_cpc, set_nao = resultado
+    mask = df["nomeusu"].astype(str).str.strip().str.casefold() == op
+    df = df[mask.to_numpy()].reset_index(drop=True)
+    contratos = set(df["contrato"].astype(str))
+    # Q/R não tem filtro de operador no SQL; CPC/NAO são por contrato do operador
+    return df, set_qr, set_cpc & contratos, set_nao & contratos
+
+
+def load_dataset(carteiras, operador, token=None, recarregar=False, paginado=False):
+    """
+    Ponto de entrada da carga: cache do host (se houver) e depois o banco.
+    recarregar=True (F5) não aceita nada carregado antes do pedido: descarta as
+    partes da carga fatiada e só usa arquivo do host publicado depois dele.
+    paginado=True deixa a base grande sair do arquivo do host já como
+    BaseMapeada (ver resultado_do_host), sem passar inteira pelo heap.
+    """
+    loader = load_contratos_sharded if SHARDED_LOAD else load_contratos
+    desde_ms = 0
+    if recarregar:
+        desde_ms = time.time() * 1000
+        clear_shard_cache(carteiras, operador)
+        clear_shard_cache(carteiras, None)   # a carga do host é sempre "Todos"
+    if not HOST_CACHE_ENABLED:
+        return loader(carteiras, operador, token=token)
+
+    def do_host():
+        tabs = _host_tabelas(carteiras, desde_ms)
+        return resultado_do_host(*tabs, operador, paginado, token=token) if tabs is not None else None
+
+    res = do_host()
+    if res is not None:
+        return res
+    key = _host_key(carteiras)
+    lock = _host_lock(key, carteiras, token=token, desde_ms=desde_ms)
+    try:
+        res = do_host()
+        if res is not None:
+            return res
+        res = loader(carteiras, None, token=token)
+        host_cache_put(carteiras, res)
+    finally:
+        if lock is not None:
+            lock.soltar()
+    if paginado:
+        # a carga do banco já passou pelo heap (o pymysql entrega tudo de uma vez); daqui
+        # em diante a base vem do arquivo recém-publicado e o DataFrame pode ir embora
+        publicado = do_host()
+        if publicado is not None:
+            return publicado
+    return filter_operador(res, operador)
+
+LAZY_GRUPOS = {"acordo": COLUNAS_ACORDO, "perfil": COLUNAS_PERFIL}
+
+
+def load_grupo(grupo, carteiras, operador, contratos=None, token=None):
+    """
+    Colunas de um grupo sob demanda ("acordo"/"perfil") para uma lista de
+    contratos, ou para a seleção inteira com contratos=None.
+    Devolve contrato + colunas do grupo, já formatadas como na carga completa.
+    """
+    if contratos is None:
+        nome = "qr" if grupo == "acordo" else "perfil"
+        sql, params = montar_consulta(LOAD_TEMPLATES[nome], carteiras, operador)
+    else:
+        if not contratos:
+            return pd.DataFrame(columns=["contrato"] + LAZY_GRUPOS[grupo])
+        # aridade muda a cada lote: parâmetros vinculados, sem PREPARE
+        nome = grupo + "_lote"
+        tpl = SQL_NMCONT_QR_LOTE if grupo == "acordo" else SQL_NMCONT_PERFIL_LOTE
+        sql, params = montar_consulta(tpl, carteiras, operador, lista=contratos)
+    with get_pool().connection() as conn:
+        df = run_prepared(nome, sql, params, conn, token=token)
+    if grupo == "acordo":
+        return _prep_acordo(df.drop_duplicates("nmcont"))
+    return _prep_perfil(df.drop_duplicates("nmcont"))
+
+# ---------------- Modo paginado (fora da memória) ----------------
+# Seleções grandes (ex.: "Todos" em todas as carteiras) não ficam no heap: a
+# base preparada vai para um arquivo Arrow IPC mapeado em memória e a
+# TelaDados trabalha com posições (VisaoPaginada). Filtros leem só as colunas
+# que usam, o Detalhe lê uma linha e a Lista uma página por vez; as páginas do
+# arquivo ficam a cargo do SO. REGUA_PAGINADO=1 força, =0 desliga.
+PAGINADO_MODO       = os.environ.get("REGUA_PAGINADO", "auto")
+PAGINADO_MIN_LINHAS = int(os.environ.get("REGUA_PAGINADO_MIN", "200000"))
+PAGINADO_DIR        = os.environ.get("REGUA_PAGINADO_DIR") or tempfile.gettempdir()
+PAGINADO_TTL_S      = 24 * 3600   # arquivos órfãos (processo que caiu) mais velhos que isso são apagados
+PAGINA_BLOCO = 50_000   # linhas por bloco do arquivo e das exportações
+LISTA_PAGINA = 1000     # linhas da Lista por página no modo paginado
+
+
+def usar_paginado(n):
+    if pa is None or PAGINADO_MODO == "0" or not n:
+        return False
+    return PAGINADO_MODO == "1" or n >= PAGINADO_MIN_LINHAS
+
+
+def limpar_paginados(pasta=None, idade_s=PAGINADO_TTL_S):
+    for path in glob.glob(os.path.join(pasta or PAGINADO_DIR, "regua_pag_*.arrow")):
+        try:
+            if time.time() - os.path.getmtime(path) > idade_s:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class BaseMapeada:
+    """
+    Base da TelaDados num arquivo Arrow mapeado. Cada leitura devolve um
+    DataFrame só com as linhas/colunas pedidas; o arquivo é apagado junto
+    com o objeto (ou por limpar_paginados, se o Windows ainda o segurar).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tabela = _map_arrow(path)
+
+    @classmethod
+    def gravar(cls, partes, pasta=None):
+        """Despeja os blocos (DataFrames de mesmas colunas) num arquivo novo e o mapeia."""
+        fd, path = tempfile.mkstemp(prefix="regua_pag_", suffix=".arrow", dir=pasta or PAGINADO_DIR)
+        os.close(fd)
+        try:
+            with pa.OSFile(path, "wb") as sink:
+                writer = schema = None
+                for parte in partes:
+                    tbl = pa.Table.from_pandas(_to_arrow_frame(parte), schema=schema, preserve_index=False)
+                    if writer is None:
+                        schema = tbl.schema
+                        writer = pa_ipc.new_file(sink, schema)
+                    writer.write_table(tbl)
+                writer.close()
+        except BaseException:
+            try: os.remove(path)
+            except OSError: pass
+            raise
+        return cls(path)
+
+    @classmethod
+    def de_frame(cls, df):
+        return cls.gravar(df.iloc[i:i + PAGINA_BLOCO] for i in range(0, len(df), PAGINA_BLOCO))
+
+    def __del__(self):
+        self.tabela = None
+        try: os.remove(self.path)
+        except OSError: pass
+
+    def __len__(self):
+        return self.tabela.num_rows
+
+    @property
+    def empty(self):
+        return self.tabela.num_rows == 0
+
+    @property
+    def columns(self):
+        return self.tabela.column_names
+
+    def __getitem__(self, col):
+        return self.tabela.column(col).to_pandas()
+
+    def linhas(self, pos, cols=None):
+        tbl = self.tabela if cols is None else self.tabela.select(cols)
+        return tbl.take(pa.array(np.asarray(pos, dtype="int64"))).to_pandas()
+
+    def coluna(self, col, pos):
+        return self.tabela.column(col).take(pa.array(np.asarray(pos, dtype="int64"))).to_pandas()
+
+    def filtrar(self, conjuntos, cor="todos"):
+        """Posições (na ordem da base) que passam nos filtros da TelaDados; lê só contrato e _cor."""
+        mask = None
+        if conjuntos:
+            allow = pa.array(sorted(set().union(*conjuntos)), type=pa.string())
+            mask = pc.is_in(self.tabela.column("contrato"), value_set=allow)
+        if cor in ("verde", "amarelo", "vermelho"):
+            # mesma faixa do filtro em memória (color_buckets, calculada na carga)
+            m = pc.equal(self.tabela.column("_cor"), cor)
+            mask = m if mask is None else pc.and_(mask, m)
+        if mask is None:
+            return np.arange(len(self), dtype="int64")
+        return np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+
+    def posicoes(self, contrato):
+        mask = pc.equal(self.tabela.column("contrato"), str(contrato))
+        return np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+
+    def completar(self, lazy, grupo, token=None):
+        """Nova base com as colunas do grupo (do cache sob demanda), reescrita bloco a bloco."""
+        # as chaves do grupo são data/número: dá para calcular bloco a bloco
+        chaves = [c for c, (src, _t) in SORT_KEYS.items() if src in LAZY_GRUPOS[grupo]]
+
+        def partes():
+            for lote in self.tabela.to_batches(max_chunksize=PAGINA_BLOCO):
+                if token is not None:
+                    token.raise_if_cancelled()
+                yield build_sort_keys(lazy.completar(lote.to_pandas(), grupo), chaves)
+
+        return BaseMapeada.gravar(partes())
+
+
+class VisaoPaginada:
+    """
+    Linhas de uma BaseMapeada por posição (filtro + ordenação), com o pedaço
+    da interface do DataFrame que a TelaDados usa: len/empty, iloc (inteiro
+    -> Series, fatia/lista -> outra visão), df[col] e df[[cols]].
+    """
+    def __init__(self, base, pos):
+        self.base = base
+        self.pos = np.asarray(pos, dtype="int64")
+
+    def __len__(self):
+        return len(self.pos)
+
+    @property
+    def empty(self):
+        return len(self.pos) == 0
+
+    @property
+    def columns(self):
+        return self.base.columns
+
+    @property
+    def iloc(self):
+        return _ILocPaginado(self)
+
+    def __getitem__(self, col):
+        if isinstance(col, list):
+            return self.base.linhas(self.pos, col)
+        return self.base.coluna(col, self.pos)
+
+    def copy(self):
+        return self   # imutável
+
+    def blocos(self, tamanho=PAGINA_BLOCO):
+        for i in range(0, len(self.pos), tamanho):
+            yield self.base.linhas(self.pos[i:i + tamanho])
+
+    def iterrows(self):
+        for bloco in self.blocos():
+            yield from bloco.iterrows()
+
+    def posicao(self, contrato):
+        """Primeira posição do contrato nesta visão, ou None."""
+        achados = np.flatnonzero(np.isin(self.pos, self.base.posicoes(contrato)))
+        return int(achados[0]) if len(achados) else None
+
+
+class _ILocPaginado:
+    def __init__(self, visao):
+        self.visao = visao
+
+    def __getitem__(self, k):
+        v = self.visao
+        if isinstance(k, (int, np.integer)):
+            return v.base.linhas([v.pos[k]]).iloc[0]
+        return VisaoPaginada(v.base, v.pos[k])
+
+
+def preparar_base(df, paginado=False, token=None):
+    """Chaves de ordenação e faixa de cor da base; no modo paginado já a despeja em disco."""
+    df = build_sort_keys(df if paginado else df.copy())
+    df["_cor"] = color_buckets(df["ultima_data"])
+    return BaseMapeada.de_frame(df) if paginado else df
+
+
+def resultado_do_host(table, sets, operador, paginado=False, token=None):
+    """
+    Resultado "Todos" publicado no host (tabelas mapeadas) recortado para o
+    operador. Com paginado=True e seleção grande, devolve a base já preparada
+    como BaseMapeada: recorte, chaves de ordenação e cor são calculados uma
+    coluna por vez e o arquivo é escrito bloco a bloco, então a base inteira
+    nunca vira DataFrame. Mesmo resultado de
+    preparar_base(filter_operador(...)[0], paginado=True).
+    """
+    if not paginado:
+        return filter_operador(_result_from_tables(table, sets), operador)
+    set_qr, set_cpc, set_nao = _conjuntos_da_tabela(sets)
+    op = (LOCKED_USER or operador or "").strip().casefold()
+    if op:
+        nomes = table.column("nomeusu").to_pandas().astype(str).str.strip().str.casefold()
+        table = table.filter(pa.array((nomes == op).to_numpy()))
+        contratos = set(table.column("contrato").to_pylist())
+        set_cpc, set_nao = set_cpc & contratos, set_nao & contratos
+    if not usar_paginado(table.num_rows):
+        return _tabela_para_frame(table), set_qr, set_cpc, set_nao
+
+    extras = {}
+    for col, (origem, _tipo) in SORT_KEYS.items():
+        if token is not None:
+            token.raise_if_cancelled()
+        cols = [origem] if origem in table.column_names else []
+        s = _tabela_para_frame(table.select(cols)) if cols else pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+        extras[sort_key_col(col)] = build_sort_keys(s, [col])[sort_key_col(col)].to_numpy()
+    extras["_cor"] = color_buckets(_tabela_para_frame(table.select(["ultima_data"]))["ultima_data"])
+
+    def partes():
+        for i in range(0, table.num_rows, PAGINA_BLOCO):
+            if token is not None:
+                token.raise_if_cancelled()
+            parte = _tabela_para_frame(table.slice(i, PAGINA_BLOCO))
+            for c, v in extras.items():
+                parte[c] = v[i:i + PAGINA_BLOCO]
+            yield parte
+
+    return BaseMapeada.gravar(partes()), set_qr, set_cpc, set_nao
+
+
+def posicao_contrato(df, contrato):
+    """Posição do contrato na ordem atual (DataFrame ou VisaoPaginada), ou None."""
+    if isinstance(df, VisaoPaginada):
+        return df.posicao(contrato)
+    pos = np.flatnonzero(df["contrato"].astype(str).to_numpy() == str(contrato))
+    return int(pos[0]) if len(pos) else None
+
+
+def blocos(df, tamanho=PAGINA_BLOCO):
+    """DataFrame inteiro ou VisaoPaginada em blocos (exportações)."""
+    if isinstance(df, VisaoPaginada):
+        yield from df.blocos(tamanho)
+    else:
+        yield df
+
+# ---------------- Resumo da carteira ----------------
+# Aba Resumo da TelaDados: contratos por operador x cor x conjunto (Q/R, CPC,
+# não acionado) e totais de acordo. A base vira um "cubo" pequeno (um
+# groupby por operador, cor e pertinência aos conjuntos) e cada combinação de
+# filtros é respondida a partir dele. Ao recarregar, só as linhas que mudaram
+# entram no cubo (saem as antigas, entram as novas).
+RESUMO_CHAVE    = ["nomeusu", "_cor", "qr", "cpc", "nao"]
+RESUMO_MEDIDAS  = ["n", "vlr", "acordos"]
+RESUMO_COLUNAS  = ["n", "qr", "cpc", "nao", "acordos", "vlr"]
+
+
+def pertence(valores, conjunto):
+    """Máscara de valores (array de str) presentes no set; set.__contains__ é bem mais rápido que Series.isin."""
+    return np.fromiter(map(conjunto.__contains__, valores), bool, len(valores))
+
+
+def _agregar_resumo(linhas):
+    return (linhas.groupby(RESUMO_CHAVE, sort=False)
+            .agg(n=("contrato", "size"), vlr=("vlr", "sum"), acordos=("acordos", "sum")))
+
+
+class ResumoCarteira:
+    """Cubo de contagens/totais de uma seleção, mantido entre recargas (ver Sessao.resumo)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fonte = None     # (base, conjuntos) da última atualização
+        self._linhas = None    # uma linha por contrato: chave do cubo + medidas + hash
+        self.cubo = _agregar_resumo(pd.DataFrame(columns=["contrato", "vlr", "acordos"] + RESUMO_CHAVE))
+
+    @staticmethod
+    def _linhas_de(base, set_qr, set_cpc, set_nao):
+        contrato = base["contrato"].astype(str).to_numpy(dtype=object)
+        cols = base.columns
+        membro = partial(pertence, contrato)
+        linhas = pd.DataFrame({
+            "contrato": contrato,
+            "nomeusu":  base["nomeusu"].fillna("").astype(str).str.strip().to_numpy(),
+            "_cor":     np.asarray(base["_cor"]),
+            "qr":       membro(set_qr),
+            "cpc":      membro(set_cpc),
+            "nao":      membro(set_nao),
+            "vlr":      (pd.to_numeric(base["vlr_aco"], errors="coerce").fillna(0.0).to_numpy()
+                         if "vlr_aco" in cols else 0.0),
+            "acordos":  (pd.to_numeric(base["qtdaco"], errors="coerce").notna().to_numpy()
+                         if "qtdaco" in cols else False),
+        })
+        # contrato repetido conta uma vez por ocorrência
+        ocorr = linhas.groupby("contrato", sort=False).cumcount()
+        linhas["_h"] = pd.util.hash_pandas_object(linhas.assign(_o=ocorr), index=False).to_numpy()
+        return linhas
+
+    def atualizar(self, base, set_qr, set_cpc, set_nao, token=None):
+        """Leva o cubo ao estado da base (tarefa do TaskRunner). Devolve quantas linhas mudaram."""
+        fonte = (base, set_qr, set_cpc, set_nao)
+        if self._fonte is not None and all(a is b for a, b in zip(self._fonte, fonte)):
+            return 0
+        novas = self._linhas_de(base, set_qr, set_cpc, set_nao)
+        if token is not None:
+            token.raise_if_cancelled()
+        with self._lock:
+            if self._linhas is None:
+                cubo, mudou = _agregar_resumo(novas), len(novas)
+            else:
+                saem = self._linhas[~self._linhas["_h"].isin(novas["_h"])]
+                entram = novas[~novas["_h"].isin(self._linhas["_h"])]
+                cubo = self.cubo.add(_agregar_resumo(entram), fill_value=0) \
+                                .sub(_agregar_resumo(saem), fill_value=0)
+                cubo = cubo[cubo["n"] > 0]
+                mudou = len(saem) + len(entram)
+            self.cubo, self._linhas, self._fonte = cubo, novas, fonte
+        return mudou
+
+    def visao(self, conjuntos=(), cor="todos"):
+        """
+        Tabela operador x cor para os filtros da TelaDados (conjuntos marcados
+        entre "qr"/"cpc"/"nao" e a faixa de cor): contratos, quantos estão em
+        cada conjunto, contratos com acordo e soma de vlr_aco.
+        """
+        with self._lock:
+            c = self.cubo.reset_index()
+        mask = np.ones(len(c), dtype=bool)
+        if conjuntos:
+            mask &= c[list(conjuntos)].any(axis=1).to_numpy()
+        if cor != "todos":
+            mask &= (c["_cor"] == cor).to_numpy()
+        c = c[mask]
+        for k in ("qr", "cpc", "nao"):
+            c[k] = c["n"].where(c[k], 0)
+        return (c.groupby(["nomeusu", "_cor"], sort=True)[RESUMO_COLUNAS].sum()
+                .astype({"n": "int64", "qr": "int64", "cpc": "int64", "nao": "int64", "acordos": "int64"}))
+
+# ---------------- Fila priorizada ----------------
+# Modo de navegação do Detalhe em que Próximo leva ao contrato de maior escore
+# ainda não atendido, em vez de seguir a ordem da Lista. O escore é uma soma
+# ponderada e vetorizada (pesos em FILA_PESOS, REGUA_FILA_PESOS="qr=3,cpc=2"
+# sobrescreve); datas valem 1 no dia e caem pela metade a cada FILA_MEIA_VIDA_D.
+FILA_PESOS = {
+    "qr":      3.0,   # acordo quebrado/rejeitado
+    "cpc":     2.0,   # CPC recente
+    "contato": 1.0,   # último acionamento recente
+    "nao":     0.5,   # nunca acionado
+    "valor":   1.0,   # valor do acordo (log, 1 = R$ 100 mil)
+}
+FILA_MEIA_VIDA_D = 15
+FILA_COLUNAS = ["contrato", "ultima_data", "dt_ultimo_cpc", "vlr_aco"]
+
+
+def _pesos_fila(texto=os.environ.get("REGUA_FILA_PESOS", "")):
+    pesos = dict(FILA_PESOS)
+    for par in filter(None, (p.strip() for p in texto.split(","))):
+        nome, _, valor = par.partition("=")
+        if nome.strip() in pesos:
+            try: pesos[nome.strip()] = float(valor)
+            except ValueError: pass
+    return pesos
+
+FILA_PESOS = _pesos_fila()
+
+
+def pontuar(df, set_qr, set_nao, pesos=None, hoje=None):
+    """Escore de prioridade por linha (array float, maior = antes)."""
+    pesos = pesos or FILA_PESOS
+    # referência no dia (não no instante): recalcular no mesmo dia dá o mesmo escore
+    hoje = hoje if hoje is not None else pd.Timestamp.today().normalize()
+    n = len(df)
+    contrato = df["contrato"].astype(str).to_numpy(dtype=object)
+
+    def recencia(col):
+        if col not in df.columns:
+            return np.zeros(n)
+        dias = (hoje - pd.to_datetime(df[col], errors="coerce")).dt.total_seconds().to_numpy(
+            dtype="float64", na_value=np.nan) / 86400
+        return np.nan_to_num(np.exp2(-np.clip(dias, 0, None) / FILA_MEIA_VIDA_D))   # sem data = 0
+
+    valor = np.zeros(n)
+    if "vlr_aco" in df.columns:
+        vlr = pd.to_numeric(df["vlr_aco"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        valor = np.nan_to_num(np.log10(1 + np.clip(vlr, 0, None)) / 5)
+
+    return (pesos["qr"] * pertence(contrato, set_qr)
+            + pesos["cpc"] * recencia("dt_ultimo_cpc")
+            + pesos["contato"] * recencia("ultima_data")
+            + pesos["nao"] * pertence(contrato, set_nao)
+            + pesos["valor"] * valor)
+
+
+class FilaPriorizada:
+    """
+    Contratos servidos do maior escore para o menor (heapq). Escore alterado
+    entra como nova entrada e a antiga, obsoleta, é descartada quando chega ao
+    topo: atualizar custa O(log n) por contrato, sem reordenar a fila.
+    Anterior/Próximo percorrem o histórico antes de tirar um novo do heap.
+    """
+    def __init__(self, contratos, escores):
+        self._escore = dict(zip(contratos, (float(e) for e in escores)))
+        self._heap = [(-e, i, c) for i, (c, e) in enumerate(self._escore.items())]
+        heapq.heapify(self._heap)
+        self._seq = itertools.count(len(self._heap))
+        self._atendidos = set()
+        self.vistos = []     # ordem de atendimento
+        self.cursor = -1     # posição atual em vistos
+
+    def restantes(self):
+        return len(self._escore) - len(self._atendidos & self._escore.keys())
+
+    def escore(self, contrato):
+        return self._escore.get(contrato)
+
+    def diferencas(self, contratos, escores):
+        """
+        (saíram, [(contrato, escore)] que mudaram) em relação aos escores
+        atuais. Só lê a fila (sobre uma cópia): pode rodar fora do loop do Tk.
+        """
+        atual = self._escore.copy()
+        novos = dict(zip(contratos, (float(e) for e in escores)))
+        return list(atual.keys() - novos.keys()), [(c, e) for c, e in novos.items() if atual.get(c) != e]
+
+    def aplicar(self, sairam, mudaram):
+        """Quem saiu é descartado; escore novo entra no heap (a entrada antiga fica obsoleta)."""
+        for c in sairam:
+            self._escore.pop(c, None)
+        for c, e in mudaram:
+            self._escore[c] = e
+            if c not in self._atendidos:
+                heapq.heappush(self._heap, (-e, next(self._seq), c))
+        return len(sairam) + len(mudaram)
+
+    def sincronizar(self, contratos, escores):
+        """Leva a fila aos escores atuais sem reordenar: só o que mudou entra no heap."""
+        return self.aplicar(*self.diferencas(contratos, escores))
+
+    def proximo(self, na_visao=None):
+        """
+        Próximo contrato (histórico adiante, depois o topo do heap). na_visao(c)
+        confirma que o contrato ainda está na visão: entre uma recarga e a
+        chegada de aplicar() o heap pode ter contratos que saíram, e esses são
+        descartados sem contar como atendidos.
+        """
+        ok = na_visao or (lambda _c: True)
+        while self.cursor + 1 < len(self.vistos):
+            self.cursor += 1
+            c = self.vistos[self.cursor]
+            if c in self._escore and ok(c):
+                return c
+        while self._heap:
+            neg, _i, c = heapq.heappop(self._heap)
+            if c in self._atendidos or self._escore.get(c) != -neg:
+                continue   # já atendido, saiu da visão ou escore antigo
+            if not ok(c):
+                self._escore.pop(c, None)   # se voltar à visão, aplicar() o recoloca
+                continue
+            self._atendidos.add(c)
+            self.vistos.append(c)
+            self.cursor = len(self.vistos) - 1
+            return c
+        return None
+
+    def anterior(self, na_visao=None):
+        ok = na_visao or (lambda _c: True)
+        for i in range(self.cursor - 1, -1, -1):
+            if self.vistos[i] in self._escore and ok(self.vistos[i]):
+                self.cursor = i
+                return self.vistos[i]
+        return None
+
+    def tem_anterior(self):
+        return any(c in self._escore for c in self.vistos[:max(self.cursor, 0)])
+
+    def tem_proximo(self):
+        return self.cursor + 1 < len(self.vistos) or self.restantes() > 0
+
+
+def escores_fila(df, set_qr, set_nao, token=None):
+    """(contratos, escores) da visão (DataFrame ou VisaoPaginada); tarefa do TaskRunner."""
+    dados = df[[c for c in FILA_COLUNAS if c in df.columns]]
+    if token is not None:
+        token.raise_if_cancelled()
+    return dados["contrato"].astype(str).to_numpy(dtype=object), pontuar(dados, set_qr, set_nao)
+
+
+def montar_fila(df, set_qr, set_nao, token=None):
+    return FilaPriorizada(*escores_fila(df, set_qr, set_nao, token=token))
+
+
+def diferencas_fila(fila, df, set_qr, set_nao, token=None):
+    """Escores da visão e diferença para a fila, fora do loop do Tk; aplicar() fica no Tk."""
+    return fila.diferencas(*escores_fila(df, set_qr, set_nao, token=token))
+
+# ---------------- Clientes (CPF/CNPJ) ----------------
+# O mesmo documento aparece em vários contratos (e carteiras). O índice agrupa
+# as posições da visão atual pelos dígitos do cpfcnpj, em CSR: posições
+# ordenadas por cliente + início de cada cliente, então achar os contratos de
+# um cliente, o cliente de uma posição ou o cliente vizinho é O(1). Clientes
+# ficam na ordem em que aparecem na visão (a ordem da Lista).
+def chaves_cliente(cpfcnpj, contrato):
+    """Dígitos do documento; sem documento, cada contrato é um cliente à parte."""
+    dig = pd.Series(np.asarray(cpfcnpj, dtype=object)).fillna("").astype(str).str.replace(r"\D", "", regex=True)
+    sem = dig.to_numpy(dtype=object) == ""
+    chaves = dig.to_numpy(dtype=object)
+    chaves[sem] = "#" + pd.Series(np.asarray(contrato, dtype=object)[sem]).astype(str).to_numpy(dtype=object)
+    return chaves
+
+
+class IndiceClientes:
+    def __init__(self, chaves):
+        self.codigo, self.chaves = pd.factorize(np.asarray(chaves, dtype=object))   # posição -> cliente
+        self._ordem = np.argsort(self.codigo, kind="stable")
+        cortes = np.flatnonzero(np.diff(self.codigo[self._ordem])) + 1
+        self._inicio = np.concatenate(([0], cortes, [len(self.codigo)])).astype("int64")
+        self._por_chave = {c: i for i, c in enumerate(self.chaves)}
+
+    @classmethod
+    def da_visao(cls, df, token=None):
+        """Índice da visão (DataFrame ou VisaoPaginada); tarefa do TaskRunner."""
+        dados = df[["contrato", "cpfcnpj"]]
+        if token is not None:
+            token.raise_if_cancelled()
+        return cls(chaves_cliente(dados["cpfcnpj"], dados["contrato"]))
+
+    def __len__(self):
+        return len(self.chaves)
+
+    def cliente(self, pos):
+        return int(self.codigo[pos])
+
+    def posicoes(self, cliente):
+        """Posições (na visão, em ordem) dos contratos do cliente."""
+        return self._ordem[self._inicio[cliente]:self._inicio[cliente + 1]]
+
+    def posicoes_da_chave(self, chave):
+        k = self._por_chave.get(chave)
+        return self.posicoes(k) if k is not None else self._ordem[:0]
+
+    def primeira(self, cliente):
+        return int(self._ordem[self._inicio[cliente]])
+
+
+def resumo_cliente(linhas):
+    """Agregados dos contratos de um cliente (DataFrame com as linhas dele)."""
+    def maior(col):
+        if col not in linhas.columns:
+            return pd.NaT
+        return pd.to_datetime(linhas[col], errors="coerce").max()
+
+    vlr = pd.to_numeric(linhas["vlr_aco"], errors="coerce") if "vlr_aco" in linhas.columns else pd.Series(dtype=float)
+    return {
+        "contratos": len(linhas),
+        "operadores": sorted({str(u).strip() for u in linhas["nomeusu"].dropna()}),
+        "ultima_data": maior("ultima_data"),
+        "dt_ultimo_cpc": maior("dt_ultimo_cpc"),
+        "acordos": int(vlr.notna().sum()),
+        "vlr_acordos": float(vlr.sum()) if vlr.notna().any() else 0.0,
+    }
+
+# ---------------- Linha do tempo do contrato ----------------
+# A aba "Linha do tempo" mostra hist_tb (com a descrição do stcob_tb) e
+# acordos_tb do contrato atual, do mais novo para o mais antigo. Cada fonte é
+# paginada por keyset — (data_at, cod_hist) / (data_cad, cod_aco) menores que
+# a última linha lida — em vez de OFFSET, então a página N custa o mesmo que
+# a primeira. As linhas do tempo já vistas ficam num LRU da sessão: voltar a
+# um contrato não consulta de novo. Acordos sem data_cad não entram.
+TEMPO_PAGINA = 50      # linhas por página de cada fonte
+TEMPO_CACHE = 64       # contratos no LRU da sessão
+TEMPO_INICIO = (datetime(9999, 12, 31), 2 ** 62)   # cursor da primeira página
+FONTES_TEMPO = ("hist", "acordo")
+
+
+def _eventos_tempo(fonte, df):
+    """Página de uma fonte -> [(data, fonte, id, descrição, detalhe)]."""
+    datas = pd.to_datetime(df["data"], errors="coerce").tolist()
+    ids = [int(i) for i in df["id"].tolist()]
+    if fonte == "hist":
+        desc = [f"{str(o or '').strip()} - {str(d or '').strip()}".strip(" -")
+                for o, d in zip(df["ocorr"].tolist(), df["dsc"].tolist())]
+        det = [str(u or "").strip() for u in df["nomeusu"].tolist()]
+    else:
+        desc = [f"Acordo ({str(s or '').strip() or '?'})" for s in df["staco"].tolist()]
+        det = []
+        for d, v, q in zip(pd.to_datetime(df["data_aco"], errors="coerce").tolist(),
+                           pd.to_numeric(df["vlr_aco"], errors="coerce").tolist(),
+                           pd.to_numeric(df["qtd_p_aco"], errors="coerce").tolist()):
+            partes = [f"acordo em {d:%d/%m/%Y}" if pd.notna(d) else "",
+                      fmt_brl(v) if pd.notna(v) else "",
+                      f"{int(q)} parcela(s)" if pd.notna(q) else ""]
+            det.append(" • ".join(p for p in partes if p))
+    return list(zip(datas, [fonte] * len(ids), ids, desc, det))
+
+
+class LinhaDoTempo:
+    """
+    Eventos de um contrato, mais novos primeiro. Cada fonte tem o próprio
+    cursor; um evento só é liberado quando nenhuma fonte ainda aberta pode
+    trazer algo mais novo que ele (fronteira = cursor mais recente entre as
+    fontes não esgotadas), então as páginas das duas fontes se intercalam
+    sem reordenar o que já foi mostrado.
+    """
+    def __init__(self, cod_cad, contrato):
+        self.chaves = {"hist": int(cod_cad), "acordo": str(contrato)}
+        self.eventos = []                                 # liberados, em ordem
+        self._pend = {f: [] for f in FONTES_TEMPO}        # lidos e ainda não liberados
+        self._cursor = dict.fromkeys(FONTES_TEMPO)        # (data, id) da última linha lida
+        self._fim = dict.fromkeys(FONTES_TEMPO, False)
+        self._lock = threading.Lock()   # uma leitura de páginas por vez (ida e volta rápida no contrato)
+
+    @property
+    def completa(self):
+        return all(self._fim.values()) and not any(self._pend.values())
+
+    def _abertas(self):
+        return [f for f in FONTES_TEMPO if not self._fim[f]]
+
+    def _a_buscar(self):
+        """Fontes nunca lidas; senão a que segura a fronteira."""
+        abertas = self._abertas()
+        novas = [f for f in abertas if self._cursor[f] is None]
+        if novas or not abertas:
+            return novas
+        return [max(abertas, key=lambda f: self._cursor[f])]
+
+    def _liberar(self):
+        abertas = self._abertas()
+        if any(self._cursor[f] is None for f in abertas):
+            return
+        limite = max((self._cursor[f][0] for f in abertas), default=None)
+        prontos = []
+        for f in FONTES_TEMPO:
+            fica = [e for e in self._pend[f] if limite is not None and e[0] < limite]
+            prontos += [e for e in self._pend[f] if limite is None or e[0] >= limite]
+            self._pend[f] = fica
+        prontos.sort(key=lambda e: (e[0], e[2]), reverse=True)
+        self.eventos = self.eventos + prontos   # nova lista: o Tk pode estar lendo a antiga
+
+    def mais(self, buscar, n=TEMPO_PAGINA, token=None):
+        """
+        Lê páginas (buscar(fonte, chave, cursor, n, token=)) até liberar mais n
+        eventos ou esgotar as fontes. Tarefa do TaskRunner; devolve quantos
+        eventos foram liberados.
+        """
+        with self._lock:
+            antes = len(self.eventos)
+            while len(self.eventos) < antes + n and not self.completa:
+                for f in self._a_buscar():
+                    df = buscar(f, self.chaves[f], self._cursor[f], n, token=token)
+                    brutos = _eventos_tempo(f, df)
+                    evs = [e for e in brutos if pd.notna(e[0])]
+                    # estado da fonte muda de uma vez: um cancelamento no meio não deixa cursor sem linhas
+                    self._pend[f] = self._pend[f] + evs
+                    if evs:
+                        self._cursor[f] = (evs[-1][0], evs[-1][2])
+                    # data inválida (zero date do MySQL, NULL) vem por último na ordem DESC: daí em
+                    # diante não há data para o keyset, então a fonte acaba (sem isso a mesma
+                    # página voltaria para sempre)
+                    self._fim[f] = len(df) < n or pd.isna(brutos[-1][0])
+                self._liberar()
+            return len(self.eventos) - antes
+
+
+class CacheLinhasDoTempo:
+    """LRU contrato -> LinhaDoTempo (com as páginas já lidas)."""
+    def __init__(self, maximo=TEMPO_CACHE):
+        self.maximo = maximo
+        self._itens = OrderedDict()
+
+    def obter(self, cod_cad, contrato):
+        chave = (str(cod_cad).strip(), str(contrato))
+        tl = self._itens.get(chave)
+        if tl is None:
+            tl = self._itens[chave] = LinhaDoTempo(cod_cad, contrato)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.maximo:
+            self._itens.popitem(last=False)
+        return tl
+
+    def __len__(self):
+        return len(self._itens)
+
+    def clear(self):
+        self._itens.clear()
+
+# ---------------- Fotos diárias e diferenças ----------------
+# Cada carga vinda do banco grava uma "foto" compacta da seleção (uma por
+# dia; a última carga do dia vale) com tipos enxutos: operador como
+# dicionário, cor em int8, datas em date32, valor em float32. O relatório de
+# diferenças junta a foto anterior à atual por contrato (hash join via
+# Index.get_indexer) e compara colunas inteiras: entrou/saiu da carteira, trocou de operador,
+# mudou de cor, ganhou acordo ou CPC novo. REGUA_FOTOS=0 desliga.
+FOTOS_ENABLED = pa is not None and os.environ.get("REGUA_FOTOS", "1") != "0"
+FOTOS_DIR = os.environ.get("REGUA_FOTOS_DIR") or os.path.join(
+    os.environ.get("PROGRAMDATA") or tempfile.gettempdir(), "ReguaTotal", "fotos")
+FOTOS_DIAS = 35   # fotos mais velhas que isso são apagadas ao gravar a do dia
+FAIXAS_COR = ["", "verde", "amarelo", "vermelho"]
+EVENTOS_FOTO = ["entrou", "saiu", "operador", "cor", "acordo", "cpc"]
+_FOTO_DATAS = ("ultima_data", "dt_ultimo_cpc", "data_aco")
+
+
+def _chave_foto(carteiras, operador):
+    cart, op = selection_key(carteiras, operador)
+    op = re.sub(r"\W+", "_", op, flags=re.ASCII).strip("_") or "todos"
+    return "foto_" + "-".join(str(c) for c in cart) + "_" + op
+
+
+def _fotos(chave, pasta=None):
+    """Fotos gravadas da seleção, da mais nova para a mais antiga: [(date, path)]."""
+    out = []
+    for path in glob.glob(os.path.join(pasta or FOTOS_DIR, chave + "_*.arrow")):
+        try:
+            out.append((datetime.strptime(path.rsplit("_", 1)[1][:8], "%Y%m%d").date(), path))
+        except ValueError:
+            continue
+    return sorted(out, reverse=True)
+
+
+def foto_compacta(base):
+    """Tabela Arrow da foto (um contrato por linha) a partir da base (DataFrame ou BaseMapeada)."""
+    cols = [c for c in ("contrato", "nomeusu", "_cor", "ultima_data", "dt_ultimo_cpc",
+                        "data_aco", "vlr_aco", "qtdaco") if c in base.columns]
+    df = pd.DataFrame({c: base[c] for c in cols}).drop_duplicates("contrato")
+    arr = {
+        "contrato": pa.array(df["contrato"].astype(str).to_numpy(dtype=object), pa.string()),
+        "nomeusu":  pa.array(df["nomeusu"].fillna("").astype(str).str.strip().to_numpy(dtype=object),
+                             pa.string()).dictionary_encode(),
+        "cor":      pa.array(pd.Categorical(df["_cor"], categories=FAIXAS_COR).codes.astype("int8")),
+    }
+    for c in _FOTO_DATAS:
+        if c in df.columns:
+            d = pd.to_datetime(df[c], errors="coerce").dt.normalize()
+            arr[c] = pa.array(d, from_pandas=True).cast(pa.date32(), safe=False)
+    if "vlr_aco" in df.columns:
+        arr["vlr_aco"] = pa.array(pd.to_numeric(df["vlr_aco"], errors="coerce").astype("float32"), from_pandas=True)
+    if "qtdaco" in df.columns:
+        arr["qtdaco"] = pa.array(pd.to_numeric(df["qtdaco"], errors="coerce"), from_pandas=True).cast(pa.int16())
+    return pa.table(arr)
+
+
+def gravar_foto(base, carteiras, operador, dia=None, pasta=None, token=None):
+    """Grava a foto do dia da seleção (tarefa do TaskRunner). Devolve o caminho, ou None se não deu."""
+    if not FOTOS_ENABLED:
+        return None
+    pasta = pasta or FOTOS_DIR
+    dia = dia or datetime.now().date()
+    chave = _chave_foto(carteiras, operador)
+    path = os.path.join(pasta, f"{chave}_{dia:%Y%m%d}.arrow")
+    try:
+        tbl = foto_compacta(base)
+        if token is not None:
+            token.raise_if_cancelled()
+        os.makedirs(pasta, exist_ok=True)
+        # pasta compartilhada: várias sessões do servidor podem gravar a mesma seleção ao mesmo tempo
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with pa.OSFile(tmp, "wb") as sink, pa_ipc.new_file(sink, tbl.schema, options=_ipc_options()) as w:
+                w.write_table(tbl)
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+    except (OSError, pa.ArrowException):
+        return None
+    for d, antiga in _fotos(chave, pasta):
+        if (dia - d).days > FOTOS_DIAS:
+            try: os.remove(antiga)
+            except OSError: pass
+    return path
+
+
+def ler_foto(path):
+    with pa.OSFile(path, "rb") as f:
+        return pa_ipc.open_file(f).read_all().to_pandas()
+
+
+def foto_anterior(carteiras, operador, dia=None, pasta=None):
+    """(data, caminho) da foto mais recente anterior a `dia` (padrão: hoje), ou None."""
+    dia = dia or datetime.now().date()
+    for d, path in _fotos(_chave_foto(carteiras, operador), pasta):
+        if d < dia:
+            return d, path
+    return None
+
+
+def comparar_fotos(antes, depois):
+    """
+    Eventos entre duas fotos (DataFrames de ler_foto), um por linha:
+    contrato, operador (o atual; o antigo para quem saiu), evento, antes, depois.
+    """
+    # hash join pelo contrato (único em cada foto): pos[i] = linha de `antes`
+    # do i-ésimo contrato de `depois`, -1 se entrou
+    ca = antes["contrato"].to_numpy(dtype=object)
+    cd = depois["contrato"].to_numpy(dtype=object)
+    pos = pd.Index(ca).get_indexer(cd)
+    entrou = pos < 0
+    saiu = np.ones(len(ca), dtype=bool)
+    saiu[pos[~entrou]] = False
+    ia, idd = pos[~entrou], np.flatnonzero(~entrou)   # pares (antes, depois) dos que ficaram
+
+    def textos(s):
+        """Operador como array de str (o dicionário da foto vira categorias no pandas)."""
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            cats = np.append(np.asarray(s.cat.categories, dtype=object), "")
+            return cats[s.cat.codes.to_numpy()]      # código -1 (nulo) cai no "" do fim
+        return s.astype(object).fillna("").astype(str).to_numpy(dtype=object)
+
+    faixas = np.asarray(FAIXAS_COR, dtype=object)
+    op_a, op_d = textos(antes["nomeusu"]), textos(depois["nomeusu"])
+    cor_a = faixas[antes["cor"].fillna(0).astype("int8").to_numpy()]
+    cor_d = faixas[depois["cor"].fillna(0).astype("int8").to_numpy()]
+
+    def datas(v):
+        """dd/mm/aaaa; as fotos guardam dias, então cada dia distinto é formatado uma vez só."""
+        codigos, dias = pd.factorize(pd.to_datetime(pd.Series(v), errors="coerce"))
+        return np.append(dias.strftime("%d/%m/%Y").to_numpy(dtype=object), "")[codigos]   # -1 (NaT) -> ""
+
+    def par(nome):
+        """Coluna `nome` nas duas fotos, alinhada aos que ficaram (NaT se a foto não tem)."""
+        return tuple(pd.to_datetime(df[nome], errors="coerce").to_numpy()[idx] if nome in df.columns
+                     else np.full(len(idx), np.datetime64("NaT"), dtype="datetime64[ns]")
+                     for df, idx in ((antes, ia), (depois, idd)))
+
+    def mais_recente(da, dd):
+        return ~np.isnat(dd) & (np.isnat(da) | (dd > da))
+
+    partes = []
+
+    def evento(nome, contratos, operador, de, para):
+        if len(contratos):
+            partes.append(pd.DataFrame({"contrato": contratos, "operador": operador, "evento": nome,
+                                        "antes": de, "depois": para}))
+
+    vazio = np.full(max(len(ca), len(cd)), "", dtype=object)
+    evento("entrou", cd[entrou], op_d[entrou], vazio[:entrou.sum()], cor_d[entrou])
+    evento("saiu", ca[saiu], op_a[saiu], cor_a[saiu], vazio[:saiu.sum()])
+    oa, od = op_a[ia], op_d[idd]
+    m = oa != od
+    evento("operador", cd[idd[m]], od[m], oa[m], od[m])
+    fa, fd = cor_a[ia], cor_d[idd]
+    m = fa != fd
+    evento("cor", cd[idd[m]], od[m], fa[m], fd[m])
+
+    aco_a, aco_d = par("data_aco")
+    m = mais_recente(aco_a, aco_d)
+    if "qtdaco" in antes.columns and "qtdaco" in depois.columns:
+        qa = antes["qtdaco"].fillna(0).to_numpy()[ia]
+        qd = depois["qtdaco"].fillna(0).to_numpy()[idd]
+        m = m | (qd > qa)
+    if m.any():
+        txt = datas(aco_d[m])
+        if "vlr_aco" in depois.columns:
+            vlr = depois["vlr_aco"].to_numpy()[idd[m]]
+            txt = txt + np.array(["" if pd.isna(v) else " " + fmt_brl(v) for v in vlr], dtype=object)
+        evento("acordo", cd[idd[m]], od[m], datas(aco_a[m]), txt)
+
+    cpc_a, cpc_d = par("dt_ultimo_cpc")
+    m = mais_recente(cpc_a, cpc_d)
+    if m.any():
+        evento("cpc", cd[idd[m]], od[m], datas(cpc_a[m]), datas(cpc_d[m]))
+
+    if not partes:
+        return pd.DataFrame(columns=["contrato", "operador", "evento", "antes", "depois"])
+    out = pd.concat(partes, ignore_index=True)
+    out["evento"] = pd.Categorical(out["evento"], categories=EVENTOS_FOTO)
+    return out.sort_values(["operador", "evento", "contrato"], kind="stable", ignore_index=True)
+
+
+def resumo_diferencas(eventos):
+    """Contagem de eventos por operador (linhas) x evento (colunas)."""
+    return (eventos.groupby(["operador", "evento"], observed=False).size()
+            .unstack(fill_value=0).reindex(columns=EVENTOS_FOTO, fill_value=0))
+
+
+def diferencas_do_dia(base, carteiras, operador, token=None):
+    """
+    (data da foto anterior, eventos) da base atual contra a foto anterior mais
+    recente; (None, None) se não há foto anterior. Tarefa do TaskRunner.
+    """
+    ant = foto_anterior(carteiras, operador)
+    if ant is None:
+        return None, None
+    antes = ler_foto(ant[1])
+    if token is not None:
+        token.raise_if_cancelled()
+    return ant[0], comparar_fotos(antes, foto_compacta(base).to_pandas())
+
+# ---------------- Gravação e replay de consultas ----------------
+# Dados sintéticos (BaseLocal.py) não reproduzem a distorção do GECOBI real:
+# poucos operadores com carteiras enormes, contratos com dezenas de acordos,
+# infoad longos. REGUA_GRAVAR=<pasta> grava o resultado de cada consulta do
+# app (os SQL_* e a lista de operadores: tudo passa por run_prepared) em
+# fixtures Arrow IPC comprimidas, já anonimizadas: CPF/CNPJ vira outros
+# dígitos do mesmo tamanho, nomes de cliente e de operador viram apelidos e
+# e-mails perdem a parte local, sempre com o mesmo resultado para o mesmo
+# valor (HMAC com sal de REGUA_GRAVAR_SAL, ou aleatório por processo), então
+# agrupamentos e junções continuam valendo; o infoad vira máscara do mesmo
+# tamanho. O manifesto guarda a impressão do sal: gravar de novo na mesma
+# pasta exige o mesmo REGUA_GRAVAR_SAL, senão o mesmo CPF/operador ganharia
+# outro pseudônimo. REGUA_REPLAY=<pasta> serve essas fixtures no lugar do pymysql, com
+# latência simulada opcional (REGUA_REPLAY_LATENCIA: ms fixos, faixa "20-200"
+# ou "gravada"), e o app inteiro roda sem banco e sem credenciais.
+GRAVAR_DIR = (os.environ.get("REGUA_GRAVAR") or None) if pa is not None else None
+GRAVAR_MANIFESTO_S = 5   # o manifesto é regravado no máximo nesse intervalo (e no fim do processo)
+REPLAY_LATENCIA = os.environ.get("REGUA_REPLAY_LATENCIA", "0").strip().lower()
+# consultas por lista de contratos/cod_cad: sem a lista exata gravada, o
+# replay recorta as linhas pedidas de tudo o que foi gravado dela e da
+# consulta da seleção inteira que traz as mesmas colunas
+REPLAY_POR_LISTA = {"acordo_lote": ("nmcont", ("acordo_lote", "qr")),
+                    "perfil_lote": ("nmcont", ("perfil_lote", "perfil")),
+                    "emails_lote": ("cod_cad", ("emails_lote",))}
+
+replay_log = logging.getLogger("regua.replay")
+
+
+def _chave_fixture(nome, params):
+    return hashlib.sha1(json.dumps([nome, [str(p) for p in params]], ensure_ascii=False)
+                        .encode("utf-8")).hexdigest()[:20]
+
+
+class Anonimizador:
+    """Pseudônimos determinísticos (HMAC) das colunas com dado pessoal."""
+    def __init__(self, sal=None):
+        sal = sal or os.environ.get("REGUA_GRAVAR_SAL")
+        self._sal = sal.encode("utf-8") if sal else os.urandom(16)
+
+    def _h(self, valor):
+        return hmac.digest(self._sal, valor.encode("utf-8"), "sha256")
+
+    def impressao(self):
+        """Identifica o sal no manifesto sem revelá-lo."""
+        return hmac.digest(self._sal, b"regua-manifesto", "sha256").hex()[:16]
+
+    def cpf(self, v):
+        s = str(v)
+        dig = s if s.isdigit() else only_digits(s)
+        if not dig:
+            return v
+        novo = str(int.from_bytes(self._h(dig), "big") % 10 ** len(dig)).zfill(len(dig))
+        if dig is s:
+            return novo
+        novos = iter(novo)   # mantém a pontuação do original
+        return "".join(next(novos) if c.isdigit() else c for c in s)
+
+    def nome(self, v, prefixo):
+        s = str(v).strip()
+        if not s:
+            return v
+        return f"{prefixo} {self._h(s).hex()[:8].upper()}"
+
+    def email(self, v):
+        s = str(v)
+        if "@" not in s:
+            return "x" * len(s)
+        local, dominio = s.split("@", 1)
+        # mantém espaços, caixa e o domínio (com os erros de digitação que fix_email corrige)
+        ini = len(local) - len(local.lstrip())
+        novo = "u" + self._h(local.strip().lower()).hex()[:10]
+        return local[:ini] + (novo.upper() if local.strip().isupper() else novo) + "@" + dominio
+
+    @staticmethod
+    def texto(v):
+        return re.sub(r"\d", "9", re.sub(r"[^\W\d_]", "x", str(v)))
+
+    COLUNAS = {"cpfcnpj": "cpf", "nomecli": "cliente", "nomeusu": "operador", "email": "email", "infoad": "texto"}
+
+    def frame(self, df):
+        """Cópia anonimizada (só as colunas de COLUNAS; cada valor distinto é calculado uma vez)."""
+        out = df.copy()
+        for col, tipo in self.COLUNAS.items():
+            if col not in out.columns:
+                continue
+            fn = {"cpf": self.cpf, "email": self.email, "texto": self.texto,
+                  "cliente": lambda v: self.nome(v, "CLIENTE"),
+                  "operador": lambda v: self.nome(v, "OPERADOR")}[tipo]
+            codigos, valores = pd.factorize(out[col], use_na_sentinel=True)
+            novos = np.array([fn(v) for v in np.asarray(valores, dtype=object).tolist()], dtype=object)
+            coluna = np.full(len(out), None, dtype=object)
+            ok = codigos >= 0
+            coluna[ok] = novos[codigos[ok]]
+            out[col] = coluna
+        return out
+
+    def param(self, p):
+        """
+        Parâmetro na forma em que o replay o verá (operador escolhido na tela =
+        apelido). O operador é sempre trocado, mesmo antes de aparecer em algum
+        resultado (pré-carga das preferências): a chave da fixture nunca leva o nome real.
+        """
+        return self.nome(p, "OPERADOR") if isinstance(p, ParamOperador) else p
+
+
+def _tabela_fixture(df):
+    """DataFrame do pymysql -> tabela Arrow (colunas mistas viram texto)."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError):
+        df = df.copy()
+        for col in df.columns:
+            try:
+                pa.array(df[col], from_pandas=True)
+            except (pa.ArrowException, TypeError, ValueError):
+                df[col] = df[col].map(lambda v: None if v is None or v is pd.NaT else str(v))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class Gravador:
+    """
+    Grava cada resultado de run_prepared: <pasta>/<consulta>/<chave>.arrow,
+    mais manifesto.json (consulta, linhas e ms de cada chave, colunas por
+    consulta, a QUERY_VERSION e a impressão do sal). A mesma chave gravada de
+    novo é sobrescrita. Pasta já gravada com outro sal é recusada. O
+    manifesto vai para o disco a cada GRAVAR_MANIFESTO_S e em fechar().
+    """
+    def __init__(self, pasta, anon=None):
+        self.pasta = pasta
+        self.anon = anon or Anonimizador()
+        self._lock = threading.Lock()
+        self.manifesto = _ler_manifesto(pasta) or {"consultas": {}, "colunas": {}}
+        impressao = self.anon.impressao()
+        if self.manifesto["consultas"] and self.manifesto.get("sal") != impressao:
+            raise RuntimeError(
+                f"As fixtures de {pasta} foram gravadas com outro sal: use o mesmo REGUA_GRAVAR_SAL "
+                "da gravação anterior ou outra pasta.")
+        self.manifesto["versao"] = QUERY_VERSION
+        self.manifesto["sal"] = impressao
+        self._sujo, self._gravado_em = False, 0.0
+        atexit.register(self.fechar)
+
+    def gravar(self, nome, params, df, ms):
+        try:
+            tbl = _tabela_fixture(self.anon.frame(df))
+            chave = _chave_fixture(nome, [self.anon.param(p) for p in params])
+            os.makedirs(os.path.join(self.pasta, nome), exist_ok=True)
+            path = os.path.join(self.pasta, nome, chave + ".arrow")
+            tmp = f"{path}.{threading.get_ident()}.tmp"   # a mesma consulta pode vir de duas threads
+            with pa.OSFile(tmp, "wb") as sink, pa_ipc.new_file(sink, tbl.schema, options=_ipc_options()) as w:
+                w.write_table(tbl)
+            os.replace(tmp, path)
+            with self._lock:
+                self.manifesto["consultas"][chave] = {"consulta": nome, "linhas": len(df), "ms": round(ms, 1)}
+                self.manifesto["colunas"][nome] = [str(c) for c in df.columns]
+                self._sujo = True
+                if time.time() - self._gravado_em >= GRAVAR_MANIFESTO_S:
+                    self._gravar_manifesto()
+        except Exception as e:
+            # gravar é acessório: a consulta do operador segue normalmente
+            replay_log.warning("falha ao gravar fixture de %s: %s", nome, e)
+
+    def _gravar_manifesto(self):
+        """Com self._lock."""
+        tmp = os.path.join(self.pasta, "manifesto.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifesto, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(self.pasta, "manifesto.json"))
+        self._sujo, self._gravado_em = False, time.time()
+
+    def fechar(self):
+        """Grava o que falta do manifesto (chamado também na saída do processo)."""
+        with self._lock:
+            if not self._sujo:
+                return
+            try:
+                self._gravar_manifesto()
+            except Exception as e:
+                replay_log.warning("falha ao gravar o manifesto das fixtures: %s", e)
+
+
+def _ler_manifesto(pasta):
+    try:
+        with open(os.path.join(pasta, "manifesto.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Replay:
+    """
+    Fixtures gravadas no lugar do banco. Faz o papel do pool (get_pool) e
+    responde run_prepared pela chave (consulta, parâmetros); consulta não
+    gravada devolve vazio com as colunas gravadas daquela consulta.
+    """
+    def __init__(self, pasta, latencia=REPLAY_LATENCIA):
+        if pa is None:
+            raise RuntimeError("REGUA_REPLAY precisa do pyarrow (pip install pyarrow).")
+        self.pasta = pasta
+        self.manifesto = _ler_manifesto(pasta)
+        if self.manifesto is None:
+            raise RuntimeError(f"Sem manifesto.json de fixtures em {pasta} (grave antes com REGUA_GRAVAR).")
+        if self.manifesto.get("versao") != QUERY_VERSION:
+            replay_log.warning("fixtures gravadas com outra versão das consultas (%s, atual %s)",
+                               self.manifesto.get("versao"), QUERY_VERSION)
+        self.latencia = latencia
+        self._lock = threading.Lock()
+        self._frames = {}     # chave -> DataFrame lido
+        self._listas = {}     # consulta -> tudo o que foi gravado dela (REPLAY_POR_LISTA)
+        self.stats = {"acertos": 0, "recortes": 0, "faltas": 0}
+
+    # ---- papel de pool ----
+    @contextmanager
+    def connection(self):
+        yield None
+
+    def close_all(self):
+        pass
+
+    def _ler(self, nome, chave):
+        with self._lock:
+            df = self._frames.get(chave)
+        if df is None:
+            with pa.OSFile(os.path.join(self.pasta, nome, chave + ".arrow"), "rb") as f:
+                df = pa_ipc.open_file(f).read_all().to_pandas()
+            with self._lock:
+                self._frames[chave] = df
+        return df
+
+    def _tudo(self, nome):
+        with self._lock:
+            df = self._listas.get(nome)
+        if df is None:
+            col, origens = REPLAY_POR_LISTA[nome]
+            partes = [self._ler(info["consulta"], k) for k, info in self.manifesto["consultas"].items()
+                      if info["consulta"] in origens]
+            df = pd.concat(partes, ignore_index=True).drop_duplicates() if partes else None
+            with self._lock:
+                self._listas[nome] = df
+        return df
+
+    def _esperar(self, info, token):
+        lat = self.latencia
+        if lat in ("", "0"):
+            return
+        if lat == "gravada":
+            ms = (info or {}).get("ms", 0.0)
+        elif "-" in lat:
+            lo, hi = (float(x) for x in lat.split("-", 1))
+            ms = random.uniform(lo, hi)
+        else:
+            ms = float(lat)
+        if token is not None:
+            token._event.wait(ms / 1000)
+            token.raise_if_cancelled()
+        else:
+            time.sleep(ms / 1000)
+
+    def _contar(self, tipo):
+        with self._lock:
+            self.stats[tipo] += 1
+
+    def executar(self, nome, params, token=None):
+        if token is not None:
+            token.raise_if_cancelled()
+        chave = _chave_fixture(nome, params)
+        info = self.manifesto["consultas"].get(chave)
+        self._esperar(info, token)
+        if info is not None:
+            self._contar("acertos")
+            return self._ler(nome, chave).copy()
+        col = REPLAY_POR_LISTA.get(nome, (None,))[0]
+        tudo = self._tudo(nome) if col else None
+        if tudo is not None:
+            self._contar("recortes")
+            pedidos = {str(p).strip() for p in params}
+            return tudo[pertence(tudo[col].astype(str).str.strip().to_numpy(dtype=object), pedidos)] \
+                .reset_index(drop=True)
+        self._contar("faltas")
+        colunas = self.manifesto["colunas"].get(nome)
+        if colunas is None:
+            raise LookupError(f"Consulta '{nome}' não foi gravada nas fixtures de {self.pasta}")
+        replay_log.info("sem fixture para %s %s", nome, chave)
+        return pd.DataFrame(columns=colunas)
+
+
+GRAVADOR = Gravador(GRAVAR_DIR) if GRAVAR_DIR and not REPLAY_DIR else None
+REPLAY = Replay(REPLAY_DIR) if REPLAY_DIR else None
+
+# ---------------- Backend de dados ----------------
+# O app fala com o banco por fetch_*: com REGUA_SERVICE=1 e o ServicoContratos.py
+# no ar (REGUA_SERVICE_URL) as consultas vão para ele, que coalesce pedidos
+# idênticos; senão, ou se o serviço falhar, vão direto via pymysql.
+# Pedido e resposta são assinados (HMAC) com o segredo de SERVICE_SEGREDO_PATH,
+# arquivo ao lado das credenciais e com o mesmo acesso: outra sessão da máquina
+# não lê carteiras pelo serviço nem se passa por ele ocupando a porta.
+SERVICE_URL     = os.environ.get("REGUA_SERVICE_URL", "http://127.0.0.1:8765")
+SERVICE_PROBE_S = 30     # de quanto em quanto tempo re-testar a presença do serviço
+SERVICE_TIMEOUT = 600    # a carga completa pode demorar
+SERVICE_SEGREDO_PATH = os.environ.get("REGUA_SERVICE_SEGREDO") or os.path.join(
+    os.path.dirname(CRED_FILE_PATH), "Regua_Servico.txt")
+SERVICE_JANELA_S = 60    # pedido assinado há mais que isso é recusado
+
+
+def ler_segredo_servico(path=SERVICE_SEGREDO_PATH):
+    """Segredo compartilhado com o serviço (primeira linha, 16+ caracteres) ou None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            segredo = f.readline().strip()
+    except OSError:
+        return None
+    return segredo.encode("utf-8") if len(segredo) >= 16 else None
+
+
+def assinatura_servico(segredo, *partes):
+    """HMAC-SHA256 (hex) das partes (str ou bytes) separadas por quebra de linha."""
+    msg = b"\n".join(p if isinstance(p, bytes) else str(p).encode("utf-8") for p in partes)
+    return hmac.new(segredo, msg, "sha256").hexdigest()
+
+
+def db_operadores(carteiras):
+    if not carteiras:
+        return []
+    sql, params = montar_consulta(SQL_OPERADORES, carteiras)
+    with get_pool().connection() as conn:
+        df = run_prepared("operadores", sql, params, conn)
+    return [o for o in df["nomeusu"].dropna().astype(str).str.strip().unique().tolist() if o]
+
+
+def db_emails(cod_cad):
+    """E-mails de um cod_cad (corrigidos, deduplicados sem diferenciar maiúsculas)."""
+    with get_pool().connection() as conn:
+        df = run_prepared("emails", SQL_EMAILS_ONE, [cod_cad, cod_cad], conn)
+
+    emails = []
+    for r in df["email"].tolist():
+        e = (r if isinstance(r, str) else "").strip()
+        if e:
+            e = fix_email_py(e)
+            emails.append(e)
+
+    seen = set()
+    uniq = []
+    for e in emails:
+        k = e.lower()
+        if k not in seen:
+            seen.add(k)
+            uniq.append(e)
+    return uniq
+
+
+def db_tempo(fonte, chave, cursor=None, n=TEMPO_PAGINA, token=None):
+    """
+    Uma página (até n linhas, mais novas primeiro) de uma fonte da linha do
+    tempo abaixo do cursor (data, id): hist_tb por cod_cad, acordos_tb por nmcont.
+    """
+    data, ident = cursor or TEMPO_INICIO
+    sql = SQL_TEMPO_HIST if fonte == "hist" else SQL_TEMPO_ACORDOS
+    with get_pool().connection() as conn:
+        df = run_prepared("tempo_" + fonte, sql, [chave, data, data, int(ident), int(n)], conn, token=token)
+    for c in ("data", "data_aco"):
+        if c in df.columns:
+            df[c] = pd.to_datetime(df[c], errors="coerce")
+    return df
+
+
+EMAILS_LOTE = 5000   # cod_cad por consulta na exportação de e-mails
+
+
+def db_emails_lote(cod_cads, token=None):
+    """E-mails crus (cod_cad, email, origem) de vários cod_cad numa consulta só."""
+    cols = ["cod_cad", "email", "origem"]
+    if not len(cod_cads):
+        return pd.DataFrame(columns=cols)
+    sql, params = montar_consulta(SQL_EMAILS_LOTE, lista=cod_cads)
+    with get_pool().connection() as conn:
+        return run_prepared("emails_lote", sql, params, conn, token=token)[cols]
+
+
+def normalizar_emails(df):
+    """
+    Corrige (fix_email_series) e deduplica por cod_cad, como db_emails faz
+    para um cliente: primeiro o e-mail do cadastro, depois os de endereço.
+    """
+    df = df.assign(cod_cad=df["cod_cad"].astype(str).str.strip(),
+                   email=fix_email_series(df["email"]))
+    df = df[df["email"] != ""]
+    df = df.sort_values(["cod_cad", "origem"], kind="stable")
+    return df.drop_duplicates(["cod_cad", "email"])[["cod_cad", "email"]]
+
+
+async def exportar_emails_async(df_lista, path):
+    """
+    Exporta contrato/cliente/e-mail de toda a lista para CSV, em lotes de
+    EMAILS_LOTE cod_cad: enquanto um lote é normalizado e gravado o seguinte
+    já está sendo consultado. Grava num .tmp e só troca pelo destino no fim.
+    Devolve (linhas, segundos, mapa cod_cad -> e-mails) para alimentar o
+    cache de e-mails da sessão.
+    """
+    inicio = time.time()
+    base = df_lista[["cod_cad", "contrato", "nomecli", "cpfcnpj"]].copy()
+    base["cod_cad"] = base["cod_cad"].astype(str).str.strip()
+    base["CPFCNPJ_Limpo"] = base["cpfcnpj"].astype(str).str.replace(r"\D", "", regex=True)
+    cods = base["cod_cad"].drop_duplicates().tolist()
+    lotes = [cods[i:i + EMAILS_LOTE] for i in range(0, len(cods), EMAILS_LOTE)]
+    token = CancelToken()
+    mapa = {}
+
+    def buscar(lote):
+        return asyncio.ensure_future(em_thread(fetch_emails_lote, lote, token=token))
+
+    def gravar(f, lote, df_em):
+        em = normalizar_emails(df_em)
+        for cod, e in zip(em["cod_cad"].tolist(), em["email"].tolist()):
+            mapa.setdefault(cod, []).append(e)
+        for cod in lote:
+            mapa.setdefault(cod, [])
+        out = base[base["cod_cad"].isin(lote)].merge(em, on="cod_cad", how="inner")
+        out[["contrato", "nomecli", "CPFCNPJ_Limpo", "email"]].to_csv(
+            f, sep=";", index=False, header=False)
+        return len(out)
+
+    tmp = path + ".tmp"
+    linhas = 0
+    proximo = buscar(lotes[0]) if lotes else None
+    try:
+        with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
+            f.write("contrato;nomecli;CPFCNPJ_Limpo;email\n")
+            for i, lote in enumerate(lotes):
+                df_em = await proximo
+                proximo = buscar(lotes[i + 1]) if i + 1 < len(lotes) else None
+                linhas += await em_thread(gravar, f, lote, df_em)
+        os.replace(tmp, path)
+    except BaseException:
+        if proximo is not None:
+            proximo.cancel()
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+    return linhas, time.time() - inicio, mapa
+
+
+async def exportar_csv_async(df_src, path, preparar=None):
+    """
+    CSV da Lista (Tudo/Seleção) gravado fora da thread do Tk, via .tmp, bloco
+    a bloco no modo paginado; preparar(bloco) monta as colunas de saída.
+    Devolve os segundos.
+    """
+    def gravar():
+        t0 = time.perf_counter()
+        tmp = path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8-sig", newline="") as f:
+                for i, parte in enumerate(blocos(df_src)):
+                    if preparar is not None:
+                        parte = preparar(parte)
+                    parte.to_csv(f, index=False, sep=";", header=(i == 0))
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+        return time.perf_counter() - t0
+
+    return await em_thread(gravar)
+
+
+def _ipc_bytes(tbl):
+    sink = pa.BufferOutputStream()
+    with pa_ipc.new_stream(sink, tbl.schema, options=_ipc_options()) as w:
+        w.write_table(tbl)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_result(resultado):
+    """Resultado de carga -> bytes (dois streams Arrow IPC: base e conjuntos)."""
+    partes = [_ipc_bytes(tbl) for tbl in _result_tables(resultado)]
+    return struct.pack("<Q", len(partes[0])) + partes[0] + partes[1]
+
+
+def decode_result(payload):
+    n = struct.unpack_from("<Q", payload)[0]
+    table = pa_ipc.open_stream(pa.py_buffer(payload[8:8 + n])).read_all()
+    sets = pa_ipc.open_stream(pa.py_buffer(payload[8 + n:])).read_all()
+    return _result_from_tables(table, sets)
+
+
+def encode_frame(df):
+    return _ipc_bytes(pa.Table.from_pandas(_to_arrow_frame(df), preserve_index=False))
+
+
+def decode_frame(payload):
+    return pa_ipc.open_stream(pa.py_buffer(payload)).read_all().to_pandas()
+
+
+def _ipc_options():
+    for codec in ("zstd", "lz4"):
+        try:
+            if pa.Codec.is_available(codec):
+                return pa_ipc.IpcWriteOptions(compression=codec)
+        except Exception:
+            pass
+    return pa_ipc.IpcWriteOptions()
+
+
+class DirectBackend:
+    """Consultas direto no GECOBI (pymysql + pool)."""
+    name = "direto"
+
+    def operadores(self, carteiras):
+        return db_operadores(carteiras)
+
+    def contratos(self, carteiras, operador, token=None, recarregar=False, paginado=False):
+        return load_dataset(carteiras, operador, token=token, recarregar=recarregar, paginado=paginado)
+
+    def emails(self, cod_cad):
+        return db_emails(cod_cad)
+
+    def colunas(self, grupo, carteiras, operador, contratos=None, token=None):
+        return load_grupo(grupo, carteiras, operador, contratos, token=token)
+
+    def emails_lote(self, cod_cads, token=None):
+        return db_emails_lote(cod_cads, token=token)
+
+    def tempo(self, fonte, chave, cursor=None, n=TEMPO_PAGINA, token=None):
+        return db_tempo(fonte, chave, cursor, n, token=token)
+
+
+class ErroServico(RuntimeError):
+    """O serviço respondeu com erro (consulta falhou nele): não é motivo para repetir direto no banco."""
+
+
+def servico_inacessivel(e):
+    """
+    Falha de conexão com o serviço (não está no ar, recusou, derrubou a
+    conexão). Só nesses casos a consulta é repetida direto no banco; erro
+    devolvido pelo serviço e tempo esgotado (consulta lenta) vão para quem
+    chamou, senão o GECOBI receberia a mesma consulta duas vezes justo quando
+    está sofrendo.
+    """
+    if isinstance(e, urllib.error.HTTPError):
+        return False
+    if isinstance(e, urllib.error.URLError):
+        e = e.reason
+    return isinstance(e, OSError) and not isinstance(e, (TimeoutError, socket.timeout))
+
+
+class ServiceBackend:
+    """
+    Cliente HTTP do ServicoContratos.py (mesma máquina). Cada pedido leva um
+    nonce com o instante e a assinatura de método, caminho e corpo; a resposta
+    só é aceita com a assinatura do serviço sobre o nonce e o corpo.
+    """
+    name = "servico"
+
+    def __init__(self, url=SERVICE_URL, segredo=None):
+        self.url = url.rstrip("/")
+        self.segredo = segredo
+
+    def _abrir(self, path, body=None, timeout=SERVICE_TIMEOUT):
+        metodo = "GET" if body is None else "POST"
+        nonce = f"{int(time.time())}.{os.urandom(8).hex()}"
+        cab = {"X-Regua-Nonce": nonce,
+               "X-Regua-Auth": assinatura_servico(self.segredo, nonce, metodo, path, body or b"")}
+        if body is not None:
+            cab["Content-Type"] = "text/plain"
+        req = urllib.request.Request(self.url + path, data=body, headers=cab, method=metodo)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                payload = resp.read()
+                assinatura = resp.headers.get("X-Regua-Assinatura") or ""
+        except urllib.error.HTTPError as e:
+            # o serviço respondeu: o erro é da consulta (vem no corpo), não da conexão
+            try:
+                msg = json.loads(e.read()).get("erro") or e.reason
+            except Exception:
+                msg = e.reason
+            raise ErroServico(f"Serviço de contratos (HTTP {e.code}): {msg}") from e
+        if not hmac.compare_digest(assinatura, assinatura_servico(self.segredo, nonce, payload)):
+            raise ErroServico("Resposta do serviço de contratos sem assinatura válida")
+        return payload
+
+    def _get(self, path, timeout=SERVICE_TIMEOUT, **params):
+        qs = urllib.parse.urlencode({k: v for k, v in params.items() if v not in (None, "")})
+        return self._abrir(f"{path}?{qs}", timeout=timeout)
+
+    def alive(self):
+        try:
+            return json.loads(self._get("/health", timeout=0.5)).get("ok") is True
+        except Exception:
+            return False
+
+    def operadores(self, carteiras):
+        return json.loads(self._get("/operadores", carteiras=",".join(map(str, carteiras))))
+
+    def contratos(self, carteiras, operador, token=None, recarregar=False, paginado=False):
+        # paginado não atravessa o HTTP: o resultado chega inteiro e a TelaDados o despeja
+        if token is not None:
+            token.raise_if_cancelled()
+        payload = self._get("/contratos", carteiras=",".join(map(str, carteiras)), operador=operador,
+                            recarregar="1" if recarregar else "")
+        if token is not None:
+            token.raise_if_cancelled()
+        return decode_result(payload)
+
+    def emails(self, cod_cad):
+        return json.loads(self._get("/emails", cod_cad=cod_cad))
+
+    def colunas(self, grupo, carteiras, operador, contratos=None, token=None):
+        if token is not None:
+            token.raise_if_cancelled()
+        payload = self._get("/colunas", grupo=grupo, carteiras=",".join(map(str, carteiras)),
+                            operador=operador, todos="1" if contratos is None else "",
+                            contratos=",".join(map(str, contratos or [])))
+        return decode_frame(payload)
+
+    def emails_lote(self, cod_cads, token=None):
+        if token is not None:
+            token.raise_if_cancelled()
+        body = ",".join(str(c) for c in cod_cads).encode("ascii")
+        return decode_frame(self._abrir("/emails_lote", body))
+
+    def tempo(self, fonte, chave, cursor=None, n=TEMPO_PAGINA, token=None):
+        if token is not None:
+            token.raise_if_cancelled()
+        data, ident = cursor or TEMPO_INICIO
+        return decode_frame(self._get("/tempo", fonte=fonte, chave=chave, n=n,
+                                      data=pd.Timestamp(data).isoformat(), id=ident))
+
+
+_direct = DirectBackend()
+_service = None
+_service_checked = 0.0
+_service_lock = threading.Lock()
+
+
+def get_backend():
+    """ServiceBackend se o serviço respondeu (assinado) no último teste, senão DirectBackend."""
+    global _service, _service_checked
+    if pa is None or os.environ.get("REGUA_SERVICE", "0") != "1" or REPLAY is not None or GRAVADOR is not None:
+        # gravação e replay acontecem nas consultas deste processo
+        return _direct
+    with _service_lock:
+        if time.time() - _service_checked > SERVICE_PROBE_S:
+            segredo = ler_segredo_servico()
+            cand = ServiceBackend(segredo=segredo) if segredo else None
+            _service = cand if cand is not None and cand.alive() else None
+            _service_checked = time.time()
+        return _service or _direct
+
+
+def _with_fallback(metodo, *args, **kwargs):
+    global _service, _service_checked
+    backend = get_backend()
+    if backend is _direct:
+        return getattr(_direct, metodo)(*args, **kwargs)
+    try:
+        return getattr(backend, metodo)(*args, **kwargs)
+    except Exception as e:
+        if not servico_inacessivel(e):
+            raise   # cancelamento, erro da consulta no serviço, tempo esgotado
+        # serviço caiu no meio: marca como ausente e segue direto no banco
+        with _service_lock:
+            _service, _service_checked = None, time.time()
+        return getattr(_direct, metodo)(*args, **kwargs)
+
+
+def fetch_operadores(carteiras):
+    return _with_fallback("operadores", carteiras)
+
+
+def fetch_contratos(carteiras, operador, token=None, recarregar=False, paginado=False):
+    return _with_fallback("contratos", carteiras, operador, token=token, recarregar=recarregar,
+                          paginado=paginado)
+
+
+def fetch_emails(cod_cad):
+    return _with_fallback("emails", cod_cad)
+
+
+def fetch_colunas(grupo, carteiras, operador, contratos=None, token=None):
+    return _with_fallback("colunas", grupo, carteiras, operador, contratos, token=token)
+
+
+def fetch_emails_lote(cod_cads, token=None):
+    return _with_fallback("emails_lote", cod_cads, token=token)
+
+
+def fetch_tempo(fonte, chave, cursor=None, n=TEMPO_PAGINA, token=None):
+    return _with_fallback("tempo", fonte, chave, cursor, n, token=token)
+
+
+# ---- coroutines do backend (loop asyncio; ver em_thread) ----
+async def fetch_operadores_async(carteiras):
+    return await em_thread(fetch_operadores, carteiras)
+
+
+async def fetch_contratos_async(carteiras, operador, recarregar=False, paginado=False):
+    return await em_thread(fetch_contratos, carteiras, operador, token=CancelToken(),
+                           recarregar=recarregar, paginado=paginado)
+
+
+async def fetch_emails_async(cod_cad):
+    return await em_thread(fetch_emails, cod_cad)
+
+
+# ---- pré-carga especulativa ----
+# Enquanto a TelaInicial está aberta, a seleção salva em prefs.json já começa
+# a carregar. Se o usuário confirmar a mesma seleção a TelaDados usa esse
+# resultado; se mudar algo, a pré-carga é cancelada (KILL QUERY).
+PREFETCH_ENABLED = os.environ.get("REGUA_PREFETCH", "1") != "0"
+
+_prefetch = None
+
+
+def selection_key(carteiras, operador):
+    return tuple(sorted(int(c) for c in carteiras)), (LOCKED_USER or operador or "").strip()
+
+
+class Prefetch:
+    """Carga iniciada antes da confirmação do usuário (coroutine no loop asyncio)."""
+    def __init__(self, carteiras, operador):
+        self.key = selection_key(carteiras, operador)
+        self.token = CancelToken()
+        self.future = get_aio().submit(fetch_contratos_async(list(carteiras), operador))
+        self.token.on_cancel(self.future.cancel)
+
+    def matches(self, carteiras, operador):
+        return not self.token.cancelled and self.key == selection_key(carteiras, operador)
+
+    def cancel(self):
+        self.token.cancel()
+
+
+def start_prefetch(carteiras, operador):
+    global _prefetch
+    cancel_prefetch()
+    if PREFETCH_ENABLED and carteiras:
+        _prefetch = Prefetch(carteiras, operador)
+    return _prefetch
+
+
+def cancel_prefetch():
+    global _prefetch
+    if _prefetch is not None:
+        _prefetch.cancel()
+    _prefetch = None
+
+
+def check_prefetch(carteiras, operador):
+    """Cancela a pré-carga se a seleção atual não bate mais com ela."""
+    if _prefetch is not None and not _prefetch.matches(carteiras, operador):
+        cancel_prefetch()
+
+
+def take_prefetch(carteiras, operador):
+    """Entrega a pré-carga se for da mesma seleção (e a retira do slot)."""
+    global _prefetch
+    pre, _prefetch = _prefetch, None
+    if pre is not None and pre.matches(carteiras, operador):
+        return pre
+    if pre is not None:
+        pre.cancel()
+    return None
+
+# ---- colunas sob demanda ----
+LAZY_VIZINHOS = 25    # contratos antes/depois do atual buscados junto com ele
+LAZY_LOTE     = 200   # máximo de contratos por consulta de lote
+
+# grupo -> chaves do Detalhe que dependem dele (mostram "…" até o lote chegar)
+LAZY_CAMPOS = {
+    "acordo": ("aco_data", "aco_valor", "aco_qtd", "qtdaco"),
+    "perfil": ("infoad", "comprom", "flag_apos", "flag_bolsa", "flag_veic", "flag_vinc", "flag_obito"),
+}
+
+
+class ColunasSobDemanda:
+    """
+    Cache das colunas de acordo/perfil de uma seleção, preenchido em lotes.
+    Os lotes rodam no TaskRunner e as leituras vêm do loop do Tk, por isso
+    tudo passa pelo lock. Contrato sem linha no lote fica como carregado vazio.
+    """
+    def __init__(self, carteiras, operador):
+        self.carteiras, self.operador = list(carteiras), operador
+        self.completos = set()   # grupos já carregados para a seleção inteira
+        self._lock = threading.Lock()
+        self._valores = {g: {} for g in LAZY_GRUPOS}      # grupo -> contrato -> {coluna: valor}
+        self._pendentes = {g: set() for g in LAZY_GRUPOS}
+
+    def carregado(self, grupo, contrato):
+        return grupo in self.completos or contrato in self._valores[grupo]
+
+    def valores(self, contrato):
+        """Colunas já carregadas do contrato (grupos ainda ausentes ficam de fora)."""
+        out = {}
+        with self._lock:
+            for g in LAZY_GRUPOS:
+                out.update(self._valores[g].get(contrato, {}))
+        return out
+
+    def reservar(self, grupo, contratos):
+        """Marca como pendentes e devolve os que ainda precisam ser buscados (até LAZY_LOTE)."""
+        if grupo in self.completos:
+            return []
+        faltam = []
+        with self._lock:
+            feitos, pend = self._valores[grupo], self._pendentes[grupo]
+            for c in contratos:
+                if c not in feitos and c not in pend:
+                    faltam.append(c)
+                    pend.add(c)
+                    if len(faltam) >= LAZY_LOTE:
+                        break
+        return faltam
+
+    def buscar(self, grupo, contratos, todos=False, token=None):
+        """
+        Tarefa do TaskRunner: consulta o lote (ou a seleção inteira com
+        todos=True) e guarda no cache. Devolve (grupo, contratos).
+        """
+        try:
+            df = fetch_colunas(grupo, self.carteiras, self.operador,
+                               None if todos else contratos, token=token)
+            cols = LAZY_GRUPOS[grupo]
+            recs = dict(zip(df["contrato"].astype(str), df[cols].to_dict("records")))
+            with self._lock:
+                vals = self._valores[grupo]
+                for c in (recs if todos else contratos):
+                    vals[c] = recs.get(c, {})
+                if todos:
+                    for c in contratos:
+                        vals.setdefault(c, {})
+            if todos:
+                self.completos.add(grupo)
+            return grupo, contratos
+        finally:
+            with self._lock:
+                self._pendentes[grupo].difference_update(contratos)
+
+    def completar(self, df, grupo):
+        """Cópia do df com as colunas do grupo preenchidas a partir do cache."""
+        df = df.copy()
+        chave = df["contrato"].astype(str)
+        with self._lock:
+            vals = self._valores[grupo]
+            for col in LAZY_GRUPOS[grupo]:
+                df[col] = chave.map(lambda c: vals.get(c, {}).get(col))
+        if grupo == "acordo":
+            df["data_aco"] = pd.to_datetime(df["data_aco"], errors="coerce")
+        return df
+
+# ---- dados da sessão ----
+class Sessao:
+    """
+    Dados que sobrevivem à troca de telas (Voltar -> Continuar): bases já
+    preparadas por seleção e os caches de e-mails e de linhas do tempo. Subconjuntos de carteiras
+    saem do cache de partes da carga fatiada sem voltar ao banco.
+    """
+    def __init__(self, ttl=SHARD_CACHE_TTL_S):
+        self.ttl = ttl
+        self.email_map = {}
+        self._datasets = {}   # selection_key -> (instante, (df_all, set_qr, set_cpc, set_nao))
+        self._colunas = {}    # selection_key -> (instante, ColunasSobDemanda)
+        self._resumos = {}    # selection_key -> ResumoCarteira (sobrevive à atualização)
+        self.tempo = CacheLinhasDoTempo()   # linhas do tempo vistas (LRU por contrato)
+
+    def get(self, carteiras, operador):
+        hit = self._datasets.get(selection_key(carteiras, operador))
+        if hit is None or time.time() - hit[0] >= self.ttl:
+            return None
+        return hit[1]
+
+    def put(self, carteiras, operador, resultado):
+        self._datasets[selection_key(carteiras, operador)] = (time.time(), resultado)
+
+    def colunas(self, carteiras, operador):
+        """Cache de colunas sob demanda da seleção (novo se expirou)."""
+        key = selection_key(carteiras, operador)
+        hit = self._colunas.get(key)
+        if hit is None or time.time() - hit[0] >= self.ttl:
+            hit = self._colunas[key] = (time.time(), ColunasSobDemanda(carteiras, operador))
+        return hit[1]
+
+    def resumo(self, carteiras, operador):
+        """Cubo da aba Resumo da seleção; atualizar() o leva à base nova só pelas diferenças."""
+        return self._resumos.setdefault(selection_key(carteiras, operador), ResumoCarteira())
+
+    def clear(self):
+        self._datasets.clear()
+        self._colunas.clear()
+        self._resumos.clear()
+        self.email_map.clear()
+        self.tempo.clear()
+        clear_shard_cache()
+
+    def descartar(self, carteiras, operador):
+        """Esquece a seleção (base, colunas sob demanda e partes da carga fatiada) para recarregar do banco."""
+        key = selection_key(carteiras, operador)
+        self._datasets.pop(key, None)
+        self._colunas.pop(key, None)
+        clear_shard_cache(carteiras, operador)
+
+# ---------------- Métricas de uso ----------------
+# Contadores e histogramas por operador/carteiras, gravados a cada
+# METRICS_FLUSH_S no formato texto do Prometheus (um arquivo por processo),
+# para somar entre máquinas. REGUA_METRICS=0 desliga.
+METRICS_ENABLED = os.environ.get("REGUA_METRICS", "1") != "0"
+METRICS_DIR = os.environ.get("REGUA_METRICS_DIR") or os.path.join(
+    os.environ.get("PROGRAMDATA") or tempfile.gettempdir(), "ReguaTotal", "metrics")
+METRICS_FLUSH_S = 60
+METRICS_TTL_S   = 10 * METRICS_FLUSH_S   # .prom sem regravação há mais que isso é de processo que caiu
+
+# nome -> (tipo, ajuda, faixa do histograma)
+METRICAS_DEF = {
+    "regua_tela_dados_abertura_ms": ("histogram", "Da abertura da TelaDados até a primeira Lista desenhada", (1, 600_000)),
+    "regua_carga_ms":               ("histogram", "Duração da carga de contratos por origem (sessao/prefetch/banco)", (1, 600_000)),
+    "regua_carga_linhas":           ("histogram", "Contratos por carga", (1, 10_000_000)),
+    "regua_filtros_total":          ("counter",   "Filtros aplicados na TelaDados", None),
+    "regua_filtros_ms":             ("histogram", "Tempo para filtrar e ordenar a base", (0.1, 60_000)),
+    "regua_lista_render_ms":        ("histogram", "Tempo de desenho da Lista", (0.1, 600_000)),
+    "regua_lista_linhas_total":     ("counter",   "Linhas da Lista inseridas/alteradas/removidas pela reconciliação", None),
+    "regua_emails_consultas_total": ("counter",   "Consultas de e-mail por resultado do cache (hit/miss/erro)", None),
+    "regua_emails_ms":              ("histogram", "Tempo de busca de e-mails fora do cache", (0.1, 60_000)),
+    "regua_exportacoes_total":      ("counter",   "Exportações por tipo", None),
+    "regua_exportacao_ms":          ("histogram", "Duração das exportações", (1, 600_000)),
+    "regua_exportacao_linhas":      ("histogram", "Linhas por exportação", (1, 10_000_000)),
+    "regua_exportacao_bytes":       ("histogram", "Tamanho do arquivo exportado", (64, 10_000_000_000)),
+    "regua_diferencas_total":       ("counter",   "Relatórios de diferenças contra a foto anterior", None),
+    "regua_tempo_ms":               ("histogram", "Tempo para buscar páginas da linha do tempo", (0.1, 60_000)),
+    "regua_sql_preparos_total":     ("counter",   "PREPAREs no servidor por consulta", None),
+    "regua_sql_reusos_total":       ("counter",   "Execuções que reaproveitaram um statement já preparado", None),
+    "regua_sql_preparo_ms":         ("histogram", "Tempo do PREPARE (parse e resolução no servidor)", (0.01, 60_000)),
+    "regua_sql_poupado_ms_total":   ("counter",   "Parse/plano poupado pelos reusos (ms, bruto: descontar regua_sql_set_ms_total)", None),
+    "regua_sql_set_ms_total":       ("counter",   "Tempo medido dos SET das variáveis do EXECUTE (ida ao servidor a mais, ms)", None),
+}
+
+
+class Histograma:
+    """Faixas logarítmicas fixas (estilo HDR): `sub` faixas por potência de 2."""
+    def __init__(self, minimo, maximo, sub=4):
+        n = int(math.ceil(math.log2(maximo / minimo) * sub)) + 1
+        self.limites = [minimo * 2 ** (i / sub) for i in range(n)]
+
+    def novo(self):
+        return [0] * (len(self.limites) + 1) + [0.0]   # faixas..., +Inf, soma
+
+    def observar(self, serie, valor):
+        serie[bisect.bisect_left(self.limites, valor)] += 1
+        serie[-1] += valor
+
+
+def _prom_labels(labels):
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{esc(v)}"' for k, v in labels)
+
+
+def metric_labels(carteiras, operador):
+    return {"operador": (LOCKED_USER or operador or "Todos").strip(),
+            "carteiras": "-".join(str(c) for c in sorted(int(c) for c in carteiras))}
+
+
+class Metricas:
+    """Registro thread-safe de contadores e histogramas (ver METRICAS_DEF)."""
+    def __init__(self, enabled=METRICS_ENABLED, out_dir=METRICS_DIR):
+        self.enabled = enabled
+        self.out_dir = out_dir
+        self.host = os.environ.get("COMPUTERNAME") or socket.gethostname()
+        self._lock = threading.Lock()
+        self._hist = {nome: Histograma(*faixa) for nome, (tipo, _a, faixa) in METRICAS_DEF.items()
+                      if tipo == "histogram"}
+        self._series = {nome: {} for nome in METRICAS_DEF}   # nome -> labels -> valor/faixas
+        self._timer = None
+        self._arq_lock = threading.Lock()   # gravar x parar: um ciclo em curso não recria o arquivo
+        self._parado = False
+
+    @staticmethod
+    def _chave(labels):
+        return tuple(sorted(labels.items()))
+
+    def inc(self, nome, n=1, **labels):
+        if not self.enabled:
+            return
+        k = self._chave(labels)
+        with self._lock:
+            series = self._series[nome]
+            series[k] = series.get(k, 0) + n
+
+    def observar(self, nome, valor, **labels):
+        if not self.enabled or valor is None:
+            return
+        k = self._chave(labels)
+        h = self._hist[nome]
+        with self._lock:
+            serie = self._series[nome].get(k)
+            if serie is None:
+                serie = self._series[nome][k] = h.novo()
+            h.observar(serie, float(valor))
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus."""
+        host = (("host", self.host),)
+        out = []
+        with self._lock:
+            for nome, (tipo, ajuda, _f) in METRICAS_DEF.items():
+                series = self._series[nome]
+                if not series:
+                    continue
+                out.append(f"# HELP {nome} {ajuda}")
+                out.append(f"# TYPE {nome} {tipo}")
+                for k, v in series.items():
+                    lab = _prom_labels(host + k)
+                    if tipo == "counter":
+                        out.append(f"{nome}{{{lab}}} {round(v, 3) if isinstance(v, float) else v}")
+                        continue
+                    acum = 0
+                    for limite, n in zip(self._hist[nome].limites + ["+Inf"], v[:-1]):
+                        acum += n
+                        le = limite if limite == "+Inf" else f"{limite:.4g}"
+                        out.append(f'{nome}_bucket{{{lab},le="{le}"}} {acum}')
+                    out.append(f"{nome}_sum{{{lab}}} {v[-1]:.3f}")
+                    out.append(f"{nome}_count{{{lab}}} {acum}")
+        out.append("# TYPE regua_metricas_gravado_em gauge")
+        out.append(f"regua_metricas_gravado_em{{{_prom_labels(host)}}} {time.time():.0f}")
+        return "\n".join(out) + "\n"
+
+    def _arquivo(self):
+        return os.path.join(self.out_dir, f"regua_{self.host}_{os.getpid()}.prom")
+
+    def gravar(self):
+        """Grava regua_<host>_<pid>.prom (troca atômica); falhas não atrapalham o app."""
+        if not self.enabled:
+            return
+        with self._arq_lock:
+            if self._parado:
+                return
+            try:
+                os.makedirs(self.out_dir, exist_ok=True)
+                path = self._arquivo()
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(self.render())
+                os.replace(path + ".tmp", path)
+            except Exception:
+                pass
+
+    def limpar(self, idade_s=METRICS_TTL_S):
+        """Apaga .prom (e .tmp) de processos que não fecharam direito: um processo
+        vivo regrava o seu a cada METRICS_FLUSH_S, então mtime antigo = órfão."""
+        for path in glob.glob(os.path.join(self.out_dir, "regua_*.prom*")):
+            try:
+                if time.time() - os.path.getmtime(path) > idade_s:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def iniciar(self, intervalo=METRICS_FLUSH_S):
+        """Gravação periódica numa thread daemon."""
+        if not self.enabled or self._timer is not None:
+            return
+        self._parado = False
+        self.limpar(max(METRICS_TTL_S, 10 * intervalo))
+
+        def ciclo():
+            self.gravar()
+            if self._parado:
+                return
+            self._timer = threading.Timer(intervalo, ciclo)
+            self._timer.daemon = True
+            self._timer.start()
+
+        self._timer = threading.Timer(intervalo, ciclo)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def parar(self):
+        """Para a gravação e apaga o arquivo deste processo: um .prom que fica
+        para trás seria somado para sempre pelo coletor."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.enabled:
+            return
+        with self._arq_lock:
+            self._parado = True
+            for path in (self._arquivo(), self._arquivo() + ".tmp"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+METRICAS = Metricas()
+
+# ---------------- Painel de Detalhe ----------------
+DETAIL_MIN_INTERVAL_MS = 60   # intervalo mínimo entre redesenhos do Detalhe
+
+class PainelDetalhe:
+    """
+    Renderizador do painel de Detalhe.
+
+    Guarda as opções (texto/bg/fg) já aplicadas em cada tk.Label e só chama
+    config() no que mudou. Pedidos de render são coalescidos em um único
+    callback: com a seta pressionada só o registro mais recente é desenhado,
+    no máximo uma vez a cada DETAIL_MIN_INTERVAL_MS.
+    """
+    def __init__(self, root, min_interval_ms=DETAIL_MIN_INTERVAL_MS):
+        self.root = root
+        self.min_interval = min_interval_ms / 1000.0
+        self.values = {}      # key -> tk.Label do valor
+        self.titles = []      # tk.Label dos títulos
+        self._shown = {}      # tk.Label -> opções já aplicadas
+        self._producer = None
+        self._job = None
+        self._last = 0.0
+
+    def registrar(self, key, lab_title, lab_val):
+        self.values[key] = lab_val
+        self.titles.append(lab_title)
+
+    def _aplicar(self, lbl, **opts):
+        atual = self._shown.setdefault(lbl, {})
+        diff = {k: v for k, v in opts.items() if atual.get(k) != v}
+        if diff:
+            try:
+                lbl.config(**diff)
+                atual.update(diff)
+            except Exception:
+                pass
+        return len(diff)
+
+    def render(self, textos, bg, fg):
+        """Aplica imediatamente; `textos` é {key: texto}. Retorna nº de opções alteradas."""
+        n = 0
+        for key, lbl in self.values.items():
+            if key in textos:
+                n += self._aplicar(lbl, text=textos[key], bg=bg, fg=fg)
+            else:
+                n += self._aplicar(lbl, bg=bg, fg=fg)
+        for lbl in self.titles:
+            n += self._aplicar(lbl, bg=bg, fg=fg)
+        return n
+
+    def agendar(self, producer):
+        """producer() -> (textos, bg, fg) ou None; só é chamado na hora do flush."""
+        self._producer = producer
+        if self._job is not None:
+            return
+        espera = self.min_interval - (time.perf_counter() - self._last)
+        if espera > 0:
+            self._job = self.root.after(int(espera * 1000) + 1, self._flush)
+        else:
+            self._job = self.root.after_idle(self._flush)
+
+    def cancelar(self):
+        if self._job is not None:
+            try: self.root.after_cancel(self._job)
+            except Exception: pass
+        self._job, self._producer = None, None
+
+    def invalidar(self):
+        """Esquece o estado conhecido (ex.: após trocar tema) para reaplicar tudo."""
+        self._shown.clear()
+
+    def _flush(self):
+        self._job = None
+        prod, self._producer = self._producer, None
+        self._last = time.perf_counter()
+        if prod is None:
+            return
+        res = prod()
+        if res:
+            self.render(*res)
+
+# ---------------- Tela de Dados ----------------
+class TelaDados(ttk.Frame):
+    def __init__(self, app, carteiras, operador):
+        super().__init__(app)
+        self.app = app
+        app.title("Navegação de Contratos")
+        app.resizable(True, True)
+
+        self.font_base, self.font_title, self.font_strong = app.font_base, app.font_title, app.font_strong
+        self.style = app.style
+        self.dark_var = app.dark_var
+        self._binds = []
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(7, weight=1)
+
+        self.carteiras = carteiras
+        self.operador = operador
+
+        # métricas: abertura até a primeira Lista, origem e duração da carga
+        self._mlabels = metric_labels(carteiras, operador)
+        self._t_abertura = time.perf_counter()
+        self._t_carga = None
+        self._origem_carga = None
 
-        # base cheia e visão filtrada
+        # base cheia e visão filtrada (BaseMapeada/VisaoPaginada no modo paginado)
         self.df_all = pd.DataFrame()
         self.df = pd.DataFrame()
         self.idx = 0
-        self._restart = False
+        self._pag_ini = self._pag_fim = 0   # linhas do df mostradas na Lista
+
+        # ordenação da Lista: df filtrado na ordem do SQL + permutações por coluna
+        self._df_base = pd.DataFrame()
+        self._sort_col = None
+        self._sort_desc = False
+        self._sort_cache = {}
 
         # listas de labels para atualizar cores
         self._detail_title_labels = []
         self._detail_value_labels = []
+        self._painel = PainelDetalhe(self)
 
         # conjuntos de nmcont para filtros
         self.set_qr  = set()  # Quebrado/Rejeitado
@@ -585,8 +4040,23 @@ class TelaDados(tk.Tk):
         self.var_cpc = tk.BooleanVar(value=False)
         self.var_nao = tk.BooleanVar(value=False)
 
-        # cache de e-mails por cod_cad
-        self.email_map = {}
+        # cache de e-mails por cod_cad (da sessão: sobrevive ao "Voltar")
+        self.email_map = app.sessao.email_map
+
+        # tarefas de banco em segundo plano (canceladas ao voltar/fechar)
+        self.tasks = app.tasks
+        self._load_token = None
+        self._export_token = None
+        self._email_token = None
+
+        # colunas de acordo/perfil sob demanda (None = base completa)
+        self._lazy = None
+        self._lazy_tokens = set()
+        self._lazy_job = None
+        self._tree_items = {}   # contrato -> itens da Treeview (para preencher células depois)
+        self._tree_linhas = {}  # (contrato, ocorrência) -> item mostrado na Lista
+        self._tree_hash = {}    # item -> hash dos valores/tags mostrados (reconciliação)
+        self._atualizando = False
 
         # Header + tema + switch
         hdr = ttk.Frame(self); hdr.grid(row=0, column=0, sticky="ew", padx=12, pady=(12,4))
@@ -599,8 +4069,8 @@ class TelaDados(tk.Tk):
                                       values=self.style.theme_names())
         self.theme_box.pack(side="left")
         self.theme_box.bind("<<ComboboxSelected>>",
-                            lambda e: (theme_apply(self, self.theme_var.get()),
-                                       apply_palette(self, self.dark_var.get()),
+                            lambda e: (theme_apply(app, self.theme_var.get()),
+                                       apply_palette(app, self.dark_var.get()),
                                        self._refresh_detail_colors()))
         self.dark_chk = ttk.Checkbutton(right, text="🌙 Escuro", variable=self.dark_var,
                                         command=self._toggle_dark)
@@ -615,8 +4085,11 @@ class TelaDados(tk.Tk):
         chk1.pack(side="left"); chk2.pack(side="left", padx=(8,0)); chk3.pack(side="left", padx=(8,0))
         btn_apl = ttk.Button(flt, text="Aplicar filtros", command=self._aplicar_filtros_nmcont)
         btn_lim = ttk.Button(flt, text="Limpar", command=self._limpar_filtros_nmcont)
+        btn_atu = ttk.Button(flt, text="⟳ Atualizar", command=self.atualizar)
         btn_apl.pack(side="right")
         btn_lim.pack(side="right", padx=(0,8))
+        btn_atu.pack(side="right", padx=(0,8))
+        add_tooltip(btn_atu, "Recarrega do banco mantendo filtros, seleção e posição (F5)")
         self.lbl_counts = ttk.Label(flt, text="(carregando conjuntos...)", anchor="e")
         self.lbl_counts.pack(side="right", padx=(12,12))
 
@@ -635,8 +4108,14 @@ class TelaDados(tk.Tk):
         self.nb.grid(row=7, column=0, sticky="nsew", padx=12, pady=12)
         self.tab_detalhe = ttk.Frame(self.nb)
         self.tab_lista   = ttk.Frame(self.nb)
+        self.tab_resumo  = ttk.Frame(self.nb)
+        self.tab_tempo   = ttk.Frame(self.nb)
         self.nb.add(self.tab_detalhe, text="Detalhe")
         self.nb.add(self.tab_lista, text="Lista")
+        self.nb.add(self.tab_resumo, text="Resumo")
+        self.nb.add(self.tab_tempo, text="Linha do tempo")
+        self.nb.bind("<<NotebookTabChanged>>", lambda e: (self._sincronizar_pagina(), self._agendar_visiveis(),
+                                                          self._atualizar_resumo(), self._atualizar_tempo()))
 
         # ---- Detalhe ----
         self.tab_detalhe.columnconfigure(0, weight=1)
@@ -660,6 +4139,7 @@ class TelaDados(tk.Tk):
 
         # Linha adicional: Último CPC
         self._mk_row(detail, "Último CPC:", "cpc_data", row=9, bold=True)
+        self._mk_row(detail, "Cliente (CPF/CNPJ):", "cliente", row=10, bold=True)
 
         # --- NOVAS LINHAS: Perfil do contrato ---
         sep1 = ttk.Separator(self.tab_detalhe, orient="horizontal")
@@ -678,6 +4158,19 @@ class TelaDados(tk.Tk):
         self._mk_row(perfil, "Vínculo Empregat.:", "flag_vinc", row=5)
         self._mk_row(perfil, "Óbito:", "flag_obito", row=6)
 
+        # --- contratos do mesmo CPF/CNPJ ---
+        frm_cli = ttk.LabelFrame(self.tab_detalhe, text="Contratos do cliente")
+        frm_cli.grid(row=7, column=0, sticky="ew", padx=8, pady=(0,6))
+        frm_cli.columnconfigure(0, weight=1)
+        self.tree_cliente = ttk.Treeview(
+            frm_cli, columns=("contrato","usuario","dt","cpc","aco_dt","aco_vlr"), show="headings", height=4)
+        for c, txt, w in [("contrato","CONTRATO",120), ("usuario","USUÁRIO",180), ("dt","ÚLTIMA DATA",110),
+                          ("cpc","ÚLTIMO CPC",110), ("aco_dt","DATA ACORDO",110), ("aco_vlr","VALOR ACORDO",120)]:
+            self.tree_cliente.heading(c, text=txt)
+            self.tree_cliente.column(c, width=w, anchor="w")
+        self.tree_cliente.grid(row=0, column=0, sticky="ew", padx=4, pady=4)
+        self.tree_cliente.bind("<Double-1>", self._ir_para_contrato_do_cliente)
+
         self._refresh_detail_colors()
 
         action = ttk.Frame(self.tab_detalhe); action.grid(row=1, column=0, sticky="ew", padx=8, pady=(0,6))
@@ -691,9 +4184,14 @@ class TelaDados(tk.Tk):
         b1 = ttk.Button(export_bar, text="💾 Exportar CSV (Tudo)", command=self.exportar_csv_tudo); b1.pack(side="left")
         b2 = ttk.Button(export_bar, text="🗂️ Exportar Seleção", command=self.exportar_csv_selecao); b2.pack(side="left", padx=(6,0))
         b3 = ttk.Button(export_bar, text="📋 Copiar Detalhe", command=self.copiar_detalhe); b3.pack(side="left", padx=(6,0))
+        b4 = ttk.Button(export_bar, text="📧 Exportar E-mails", command=self.exportar_emails_lista); b4.pack(side="left", padx=(6,0))
         add_tooltip(b1, "Exporta toda a lista para CSV")
         add_tooltip(b2, "Exporta apenas as linhas selecionadas na aba Lista")
         add_tooltip(b3, "Copia o registro atual (Detalhe) como CSV")
+        b5 = ttk.Button(export_bar, text="📊 Diferenças (D-1)", command=self.relatorio_diferencas); b5.pack(side="left", padx=(6,0))
+        add_tooltip(b4, "Exporta os e-mails de todos os clientes da lista filtrada")
+        add_tooltip(b5, "Compara a carteira atual com a foto do último dia gravado: "
+                        "entradas, saídas, trocas de operador e de cor, acordos e CPCs novos")
 
         nav = ttk.Frame(self.tab_detalhe)
         nav.grid(row=3, column=0, sticky="ew", padx=8, pady=(0,6))
@@ -704,6 +4202,18 @@ class TelaDados(tk.Tk):
         self.btn_next.pack(side="right", padx=(6,0))
         self.btn_prev.pack(side="right")
 
+        self.var_fila = tk.BooleanVar(value=False)
+        chk_fila = ttk.Checkbutton(nav, text="Fila priorizada", variable=self.var_fila, command=self._alternar_fila)
+        chk_fila.pack(side="left")
+        add_tooltip(chk_fila, "Próximo leva ao contrato de maior prioridade ainda não visto "
+                              "(Q/R, CPC recente, contato recente, valor do acordo)")
+        self.var_cliente = tk.BooleanVar(value=False)
+        chk_cli = ttk.Checkbutton(nav, text="Por cliente", variable=self.var_cliente, command=self._alternar_cliente)
+        chk_cli.pack(side="left", padx=(8,0))
+        add_tooltip(chk_cli, "Anterior/Próximo pulam de cliente (CPF/CNPJ) em cliente, na ordem da Lista")
+        self.lbl_fila = ttk.Label(nav, text="")
+        self.lbl_fila.pack(side="left", padx=(8,0))
+
         goto = ttk.Frame(self.tab_detalhe); goto.grid(row=4, column=0, sticky="ew", padx=8, pady=(0,6))
         ttk.Label(goto, text="Ir para #").pack(side="left")
         self.idx_var = tk.IntVar(value=1)
@@ -717,7 +4227,8 @@ class TelaDados(tk.Tk):
         self.tree = ttk.Treeview(
             self.tab_lista,
             columns=("contrato","nome","cpf","usuario","dt","aco_dt","aco_vlr","aco_qtd"),
-            show="headings", height=14
+            show="headings", height=14,
+            yscrollcommand=lambda *a: self._agendar_visiveis()
         )
         for c, w in [
             ("contrato",120),
@@ -729,12 +4240,80 @@ class TelaDados(tk.Tk):
             ("aco_vlr",120),
             ("aco_qtd",90),
         ]:
-            self.tree.heading(c, text=c.upper())
+            self.tree.heading(c, text=c.upper(), command=partial(self._ordenar_por, c))
             self.tree.column(c, width=w, anchor="w")
 
         self.tree.grid(row=0, column=0, sticky="nsew", padx=8, pady=8)
         self.tree.bind("<Double-1>", self._ir_para_detalhe_por_duplo_clique)
 
+        # páginas da Lista (só no modo paginado)
+        self.pag_bar = ttk.Frame(self.tab_lista)
+        self.pag_bar.grid(row=1, column=0, sticky="ew", padx=8, pady=(0,6))
+        self.btn_pag_next = ttk.Button(self.pag_bar, text="Página »", command=lambda: self._mudar_pagina(1))
+        self.btn_pag_prev = ttk.Button(self.pag_bar, text="« Página", command=lambda: self._mudar_pagina(-1))
+        self.btn_pag_next.pack(side="right", padx=(6,0))
+        self.btn_pag_prev.pack(side="right")
+        self.lbl_pag = ttk.Label(self.pag_bar, text="")
+        self.lbl_pag.pack(side="left")
+        self.pag_bar.grid_remove()
+
+        # ---- Resumo (operador x cor, com os filtros atuais) ----
+        self.tab_resumo.rowconfigure(1, weight=1)
+        self.tab_resumo.columnconfigure(0, weight=1)
+        self.lbl_resumo = ttk.Label(self.tab_resumo, text="", anchor="w")
+        self.lbl_resumo.grid(row=0, column=0, sticky="ew", padx=8, pady=(8,0))
+        self.tree_resumo = ttk.Treeview(
+            self.tab_resumo, columns=RESUMO_COLUNAS, show="tree headings", height=14)
+        self.tree_resumo.heading("#0", text="OPERADOR / COR")
+        self.tree_resumo.column("#0", width=240, anchor="w")
+        for c, txt, w in [("n","CONTRATOS",100), ("qr","Q/R",90), ("cpc","CPC",90), ("nao","NÃO ACION.",100),
+                          ("acordos","C/ ACORDO",100), ("vlr","VALOR ACORDOS",160)]:
+            self.tree_resumo.heading(c, text=txt)
+            self.tree_resumo.column(c, width=w, anchor="e")
+        self.tree_resumo.grid(row=1, column=0, sticky="nsew", padx=8, pady=8)
+        self._resumo = app.sessao.resumo(carteiras, operador)
+        self._resumo_token = None
+        self._resumo_acordos = False   # grupo "acordo" sendo carregado para os totais
+
+        # ---- Linha do tempo (hist_tb + acordos_tb do contrato atual) ----
+        self.tab_tempo.rowconfigure(1, weight=1)
+        self.tab_tempo.columnconfigure(0, weight=1)
+        self.lbl_tempo = ttk.Label(self.tab_tempo, text="", anchor="w")
+        self.lbl_tempo.grid(row=0, column=0, sticky="ew", padx=8, pady=(8,0))
+        tempo_wrap = ttk.Frame(self.tab_tempo)
+        tempo_wrap.grid(row=1, column=0, sticky="nsew", padx=8, pady=8)
+        tempo_wrap.rowconfigure(0, weight=1)
+        tempo_wrap.columnconfigure(0, weight=1)
+        self.tree_tempo = ttk.Treeview(tempo_wrap, columns=("data","tipo","desc","det"), show="headings", height=14)
+        for c, txt, w in [("data","DATA",130), ("tipo","TIPO",90), ("desc","OCORRÊNCIA",300), ("det","DETALHE",320)]:
+            self.tree_tempo.heading(c, text=txt)
+            self.tree_tempo.column(c, width=w, anchor="w")
+        vsb_tempo = ttk.Scrollbar(tempo_wrap, orient="vertical", command=self.tree_tempo.yview)
+        self.tree_tempo.configure(yscrollcommand=vsb_tempo.set)
+        self.tree_tempo.grid(row=0, column=0, sticky="nsew")
+        vsb_tempo.grid(row=0, column=1, sticky="ns")
+        self.btn_tempo_mais = ttk.Button(self.tab_tempo, text="Carregar mais antigos",
+                                         command=lambda: self._atualizar_tempo(mais=True))
+        self.btn_tempo_mais.grid(row=2, column=0, sticky="w", padx=8, pady=(0,8))
+        self._tempo = None          # LinhaDoTempo na tela
+        self._tempo_mostrados = 0   # eventos dela já na Treeview
+        self._tempo_token = None
+
+        # fila priorizada (None = Anterior/Próximo seguem a ordem da Lista)
+        self._fila = None
+        self._fila_token = None
+
+        # clientes da visão atual (IndiceClientes; None enquanto indexa)
+        self._clientes = None
+        self._clientes_de = None          # visão (self.df) de onde saíram as posições do índice
+        self._clientes_token = None
+        self._contratos_cliente = set()   # contratos do cliente no Detalhe
+        self._cliente_mostrado = None
+
+        # fotos diárias: a carga vinda do banco grava a do dia (ver gravar_foto)
+        self._foto_pendente = False
+        self._difs_token = None
+
         # configurar tags de cor para as linhas
         self._setup_tree_tags()
 
@@ -743,62 +4322,59 @@ class TelaDados(tk.Tk):
         self.status.grid(row=99, column=0, sticky="ew", padx=8, pady=(0,6))
 
         # Atalhos
-        self.bind("<Left>", lambda e: self.anterior())
-        self.bind("<Right>", lambda e: self.proximo())
-        self.bind("<Control-c>", lambda e: self._copy_current_cpf())
-        self.bind("<Control-Shift-C>", lambda e: self._copy_current_nome())
+        self._bind_app("<Left>", lambda e: self.anterior())
+        self._bind_app("<Right>", lambda e: self.proximo())
+        self._bind_app("<Control-c>", lambda e: self._copy_current_cpf())
+        self._bind_app("<Control-Shift-C>", lambda e: self._copy_current_nome())
+        self._bind_app("<F5>", lambda e: self.atualizar())
 
         # Carregar dados + conjuntos
         self._carregar_dados_e_conjuntos_async()
 
     # ---- Email: busca pontual + popup ----
-    def _fetch_emails_by_cod(self, cod_cad: str):
-        """Retorna lista de e-mails (deduplicada, case-insensitive) para um cod_cad."""
+    def _fetch_emails_by_cod(self, cod_cad: str, on_done):
+        """
+        Entrega a on_done a lista de e-mails (deduplicada, case-insensitive) de
+        um cod_cad. Fora do cache a busca roda no loop asyncio.
+        """
         if not cod_cad:
-            return []
+            on_done([])
+            return
         if cod_cad in self.email_map:
-            return self.email_map[cod_cad]
+            METRICAS.inc("regua_emails_consultas_total", resultado="hit", **self._mlabels)
+            on_done(self.email_map[cod_cad])
+            return
 
-        try:
-            conn = pymysql.connect(**DB)
-            cur = conn.cursor()
-            cur.execute(SQL_EMAILS_ONE, (cod_cad, cod_cad))
-            rows = cur.fetchall()
-            conn.close()
-
-            emails = []
-            for r in rows or []:
-                e = (r[0] or "").strip()
-                if e:
-                    e = fix_email_py(e)
-                    emails.append(e)
-
-            seen = set()
-            uniq = []
-            for e in emails:
-                k = e.lower()
-                if k not in seen:
-                    seen.add(k)
-                    uniq.append(e)
+        t0 = time.perf_counter()
 
+        def _fim(uniq, resultado):
+            self._email_token = None
             self.email_map[cod_cad] = uniq
-            return uniq
-        except Exception:
-            self.email_map[cod_cad] = []
-            return []
+            METRICAS.inc("regua_emails_consultas_total", resultado=resultado, **self._mlabels)
+            METRICAS.observar("regua_emails_ms", (time.perf_counter() - t0) * 1000, **self._mlabels)
+            on_done(uniq)
+
+        self._email_token = self.tasks.submit_async(
+            fetch_emails_async(cod_cad),
+            on_done=lambda uniq: _fim(uniq, "miss"),
+            on_error=lambda e: _fim([], "erro"),
+        )
 
     def _mostrar_emails_atual(self):
         if self.df.empty:
             messagebox.showinfo("E-mails", "Sem registro selecionado.")
             return
+        if self._email_token is not None:
+            return   # busca anterior ainda em andamento
 
         row = self.df.iloc[self.idx]
         cod = str(row.get("cod_cad", "")).strip()
-        emails = self._fetch_emails_by_cod(cod)
+        self._fetch_emails_by_cod(cod, self._popup_emails)
 
+    def _popup_emails(self, emails):
         win = tk.Toplevel(self)
         win.title("E-mails do cliente")
-        win.transient(self)
+        win.transient(self.app)
         win.grab_set()
         win.resizable(True, True)
 
@@ -881,37 +4457,24 @@ class TelaDados(tk.Tk):
         return "#ffffff" if self.dark_var.get() else "#111111"
 
     def _update_detail_bgs(self, bg):
-        for lbl in self._detail_value_labels + self._detail_title_labels:
-            try:
-                lbl.config(bg=bg)
-            except:
-                pass
+        self._painel.render({}, bg, self._current_fg())
 
     def _refresh_detail_colors(self):
-        fg_values = "#ffffff" if self.dark_var.get() else "#111111"
-        fg_titles = "#ffffff" if self.dark_var.get() else "#111111"
-        bg_now    = self.detail_bg.get()
-        for lbl in self._detail_value_labels:
-            try:
-                lbl.config(fg=fg_values, bg=bg_now)
-            except:
-                pass
-        for lbl in self._detail_title_labels:
-            try:
-                lbl.config(fg=fg_titles, bg=bg_now)
-            except:
-                pass
+        self._painel.invalidar()
+        self._painel.render({}, self.detail_bg.get(), self._current_fg())
 
     # ---- tags da Treeview (cores por linha) ----
     def _setup_tree_tags(self):
-        if self.dark_var.get():
-            self.tree.tag_configure("verde",    background="#13301a", foreground="#ffffff")
-            self.tree.tag_configure("amarelo",  background="#2d2615", foreground="#ffffff")
-            self.tree.tag_configure("vermelho", background="#2c1515", foreground="#ffffff")
-        else:
-            self.tree.tag_configure("verde",    background="#e6ffe6")
-            self.tree.tag_configure("amarelo",  background="#fff7e6")
-            self.tree.tag_configure("vermelho", background="#ffe6e6")
+        self.tree_tempo.tag_configure("acordo", font=self.font_strong)
+        for tree in (self.tree, self.tree_resumo, self.tree_cliente):
+            if self.dark_var.get():
+                tree.tag_configure("verde",    background="#13301a", foreground="#ffffff")
+                tree.tag_configure("amarelo",  background="#2d2615", foreground="#ffffff")
+                tree.tag_configure("vermelho", background="#2c1515", foreground="#ffffff")
+            else:
+                tree.tag_configure("verde",    background="#e6ffe6")
+                tree.tag_configure("amarelo",  background="#fff7e6")
+                tree.tag_configure("vermelho", background="#ffe6e6")
 
     # ---- construção de linhas ----
     def _mk_row(self, parent, titulo, key, row=0, bold=False, copy=False, copy_target=None):
@@ -937,6 +4500,7 @@ class TelaDados(tk.Tk):
 
         self._detail_title_labels.append(lab_title)
         self._detail_value_labels.append(lab_val)
+        self._painel.registrar(key, lab_title, lab_val)
 
         if copy:
             btn = ttk.Button(f, text="📋 Copiar", width=10)
@@ -951,145 +4515,114 @@ class TelaDados(tk.Tk):
 
     # ---- status/busy ----
     def set_busy(self, flag=True, msg=None):
-        self.config(cursor="watch" if flag else "")
+        self.app.config(cursor="watch" if flag else "")
         if msg is not None: self.status.config(text=msg)
         self.update_idletasks()
 
     # ---- carregar dados + conjuntos ----
     def _carregar_dados_e_conjuntos_async(self):
-        in_list = ",".join(str(c) for c in self.carteiras)
-        operador_where = ""
-
-        if LOCKED_USER:
-            op = LOCKED_USER.replace("'", "''").strip()
-            operador_where = f"AND TRIM(usu.nomeusu) = '{op}'"
-        elif self.operador:
-            op = self.operador.replace("'", "''").strip()
-            operador_where = f"AND TRIM(usu.nomeusu) = '{op}'"
-
-        sql_main = SQL_BASE.format(
-            in_list=in_list,
-            operador_where=(" " + operador_where if operador_where else ""),
-            extra_where=""
-        )
-
-        # QR / CPC / NAO
-        sql_qr     = SQL_NMCONT_QR.format(in_list=in_list,  operador_where=(" " + operador_where if operador_where else ""))
-        sql_cpc    = SQL_NMCONT_CPC.format(in_list=in_list, operador_where=(" " + operador_where if operador_where else ""))
-        sql_nao    = SQL_NMCONT_NAO.format(in_list=in_list, operador_where=(" " + operador_where if operador_where else ""))
-        # NOVO perfil
-        sql_perfil = SQL_NMCONT_PERFIL.format(in_list=in_list, operador_where=(" " + operador_where if operador_where else ""))
+        if self._load_token is not None:
+            self._load_token.cancel()
+        hit = self.app.sessao.get(self.carteiras, self.operador)
+        if hit is not None:
+            # já carregado nesta sessão (ida e volta pela tela inicial)
+            cancel_prefetch()
+            self._t_carga, self._origem_carga = time.perf_counter(), "sessao"
+            self._on_loaded_with_sets(*hit, preparado=True)
+            return
 
         self.set_busy(True, "Carregando dados e filtros...")
+        self._foto_pendente = FOTOS_ENABLED
+        recarregar = self._atualizando
+        pre = None if recarregar else take_prefetch(self.carteiras, self.operador)
+        self._t_carga = time.perf_counter()
+        self._origem_carga = "prefetch" if pre is not None else "banco"
+        if pre is not None:
+            # mesma seleção da pré-carga: só espera o que já está em andamento
+            self._load_token = self.tasks.submit_async(
+                aguardar_async(pre.future), token=pre.token,
+                on_done=lambda res: self._on_loaded_with_sets(*res),
+                on_error=self._on_error,
+            )
+            return
+        self._load_token = self.tasks.submit_async(
+            fetch_contratos_async(self.carteiras, self.operador, recarregar=recarregar,
+                                  paginado=PAGINADO_MODO != "0"),
+            on_done=lambda res: self._on_loaded_with_sets(*res),
+            on_error=self._on_error,
+        )
 
-        def job():
-            try:
-                conn = pymysql.connect(**DB)
-
-                # base principal
-                df_main = pd.read_sql_query(sql_main, conn)
-
-                # conjuntos auxiliares
-                try:
-                    df_qr  = pd.read_sql_query(sql_qr,  conn)
-                except Exception:
-                    df_qr = pd.DataFrame(columns=["nmcont","data_aco","vlr_aco","qtd_p_aco"])
-
-                try:
-                    df_cpc = pd.read_sql_query(sql_cpc, conn)
-                except Exception:
-                    df_cpc = pd.DataFrame(columns=["nmcont","dt_ultimo_cpc"])
-
-                try:
-                    df_nao = pd.read_sql_query(sql_nao, conn)
-                except Exception:
-                    df_nao = pd.DataFrame(columns=["nmcont"])
-
-                # perfil
-                try:
-                    df_perfil = pd.read_sql_query(sql_perfil, conn)
-                except Exception:
-                    df_perfil = pd.DataFrame(columns=[
-                        "nmcont","infoad","comprometimento_credito","flag_aposentado",
-                        "flag_bolsafamilia","flag_veiculo","flag_vinculo_empregaticio","flag_obito"
-                    ])
-
-                conn.close()
-
-                # --- MESCLA: acordo ---
-                if not df_qr.empty:
-                    df_qr_ren = df_qr.rename(columns={"nmcont": "contrato"})
-                    df_qr_ren["data_aco"] = pd.to_datetime(df_qr_ren["data_aco"], errors="coerce")
-
-                    for col in ("data_aco","vlr_aco","qtd_p_aco","qtdaco"):
-                        if col not in df_qr_ren.columns:
-                            df_qr_ren[col] = pd.NA
-
-                    df_main = df_main.merge(
-                        df_qr_ren[["contrato","data_aco","vlr_aco","qtd_p_aco","qtdaco"]],
-                        on="contrato", how="left"
-                    )
-                else:
-                    df_main["data_aco"] = pd.NaT
-                    df_main["vlr_aco"]  = pd.NA
-                    df_main["qtd_p_aco"]= pd.NA
-                    df_main["qtdaco"]   = pd.NA
-
-
-                # --- MESCLA: CPC ---
-                if not df_cpc.empty:
-                    df_cpc_ren = df_cpc.rename(columns={"nmcont": "contrato"})
-                    df_cpc_ren["dt_ultimo_cpc"] = pd.to_datetime(df_cpc_ren["dt_ultimo_cpc"], errors="coerce")
-                    df_main = df_main.merge(
-                        df_cpc_ren[["contrato", "dt_ultimo_cpc"]],
-                        on="contrato", how="left"
-                    )
-                else:
-                    df_main["dt_ultimo_cpc"] = pd.NaT
-
-                # --- MESCLA: PERFIL ---
-                if not df_perfil.empty:
-                    df_pf = df_perfil.rename(columns={"nmcont":"contrato"}).copy()
-                    # formatações amigáveis
-                    df_pf["comprom_txt"] = df_pf["comprometimento_credito"].apply(_fmt_comprometimento)
-                    df_pf["flag_apos_txt"]  = df_pf["flag_aposentado"].apply(_fmt_flag)
-                    df_pf["flag_bolsa_txt"] = df_pf["flag_bolsafamilia"].apply(_fmt_flag)
-                    df_pf["flag_veic_txt"]  = df_pf["flag_veiculo"].apply(_fmt_flag)
-                    df_pf["flag_vinc_txt"]  = df_pf["flag_vinculo_empregaticio"].apply(_fmt_flag)
-                    df_pf["flag_obito_txt"] = df_pf["flag_obito"].apply(_fmt_flag)
-
-                    df_main = df_main.merge(
-                        df_pf[["contrato","infoad","comprom_txt","flag_apos_txt","flag_bolsa_txt",
-                               "flag_veic_txt","flag_vinc_txt","flag_obito_txt"]],
-                        on="contrato", how="left"
-                    )
-                else:
-                    for col in ("infoad","comprom_txt","flag_apos_txt","flag_bolsa_txt","flag_veic_txt","flag_vinc_txt","flag_obito_txt"):
-                        df_main[col] = ""
-
-                # conjuntos para filtros por nmcont
-                set_qr  = set(df_qr["nmcont"].astype(str))  if not df_qr.empty  else set()
-                set_cpc = set(df_cpc["nmcont"].astype(str)) if not df_cpc.empty else set()
-                set_nao = set(df_nao["nmcont"].astype(str)) if not df_nao.empty else set()
-
-                self.after(0, lambda: self._on_loaded_with_sets(df_main, set_qr, set_cpc, set_nao))
-            except Exception as e:
-                self.after(0, lambda: self._on_error(e))
-
-        threading.Thread(target=job, daemon=True).start()
+    def atualizar(self):
+        """Recarrega a seleção do banco; a Lista recebe só as diferenças (ver _reconciliar_lista)."""
+        if self._atualizando or self.df_all.empty:
+            return
+        self._atualizando = True
+        self.app.sessao.descartar(self.carteiras, self.operador)
+        self.app.sessao.tempo.clear()
+        self._tempo = None
+        self._carregar_dados_e_conjuntos_async()
 
     def _on_error(self, e):
+        self._atualizando = self._resumo_acordos = False
         self.set_busy(False, "Erro")
         messagebox.showerror("Erro", f"Falha ao consultar o banco:\n{e}")
 
-    def _on_loaded_with_sets(self, df, set_qr, set_cpc, set_nao):
+    def _on_erro_visao(self, tarefa, e):
+        """Falha ao montar resumo, fila ou índice de clientes sobre a base já carregada (não é erro de banco)."""
+        setattr(self, f"_{tarefa}_token", None)
+        if tarefa == "fila":
+            # sem fila, Anterior/Próximo voltam a seguir a Lista
+            self._fila = None
+            self.var_fila.set(False)
+            self.lbl_fila.config(text="")
+            self._atualizar_botoes()
+        nome = {"resumo": "o resumo", "fila": "a fila priorizada", "clientes": "os clientes"}[tarefa]
+        self.set_busy(False, f"Falha ao montar {nome}")
+        messagebox.showwarning("Aviso", f"Não foi possível montar {nome}:\n{e}")
+
+    def _on_loaded_with_sets(self, df, set_qr, set_cpc, set_nao, preparado=False):
+        if self._t_carga is not None:
+            METRICAS.observar("regua_carga_ms", (time.perf_counter() - self._t_carga) * 1000,
+                              origem=self._origem_carga, **self._mlabels)
+            METRICAS.observar("regua_carga_linhas", len(df), **self._mlabels)
+            self._t_carga = None
         # guarda conjuntos
         self.set_qr, self.set_cpc, self.set_nao = set_qr, set_cpc, set_nao
         self._atualizar_contadores_conjuntos()
 
-        # guarda base completa
-        self.df_all = df.copy()
+        # guarda base completa (+ chaves de ordenação tipadas e faixa de cor)
+        if preparado:
+            self.df_all = df
+        elif isinstance(df, BaseMapeada):
+            # veio do cache do host já paginada (resultado_do_host)
+            self.df_all = df
+            self.app.sessao.put(self.carteiras, self.operador, (df, set_qr, set_cpc, set_nao))
+        elif usar_paginado(len(df)):
+            # base grande: chaves e despejo em disco fora do loop do Tk
+            self.set_busy(True, f"Preparando {len(df)} registros (modo paginado)...")
+
+            def _pronto(base):
+                self.app.sessao.put(self.carteiras, self.operador, (base, set_qr, set_cpc, set_nao))
+                self._on_loaded_with_sets(base, set_qr, set_cpc, set_nao, preparado=True)
+
+            self._load_token = self.tasks.submit(preparar_base, df, paginado=True,
+                                                 on_done=_pronto, on_error=self._on_error)
+            return
+        else:
+            self.df_all = preparar_base(df)
+            self.app.sessao.put(self.carteiras, self.operador,
+                                (self.df_all, set_qr, set_cpc, set_nao))
+
+        if self._foto_pendente:
+            # foto do dia fora do loop do Tk; falhar aqui não atrapalha o operador
+            self._foto_pendente = False
+            self.tasks.submit(gravar_foto, self.df_all, self.carteiras, self.operador)
+
+        # base sem perfil = carga no modo sob demanda
+        self._lazy = (self.app.sessao.colunas(self.carteiras, self.operador)
+                      if "infoad" not in self.df_all.columns else None)
 
+        manter, self._atualizando = self._atualizando, False
         if self.df_all.empty:
             labels = [label for (label, code) in CARTEIRAS if code in self.carteiras]
             alvo = " (operador selecionado)" if self.operador else ""
@@ -1097,8 +4630,8 @@ class TelaDados(tk.Tk):
             messagebox.showwarning("Aviso", f"Nenhum registro encontrado para {', '.join(labels)}{alvo}.")
             return
 
-        # aplica (inicialmente sem filtros marcados)
-        self._aplicar_filtros_nmcont(inicial=True)
+        # aplica (inicialmente sem filtros marcados; na atualização, os que estão marcados)
+        self._aplicar_filtros_nmcont(inicial=True, manter=manter)
 
         labels = [label for (label, code) in CARTEIRAS if code in self.carteiras]
         op_txt = "Todos" if not self.operador else self.operador
@@ -1110,10 +4643,13 @@ class TelaDados(tk.Tk):
         self.lbl_counts.config(text=txt)
 
     # ---- aplicar/limpar filtros nmcont + cor ----
-    def _aplicar_filtros_nmcont(self, inicial=False):
-        df_src = self.df_all.copy()
+    def _aplicar_filtros_nmcont(self, inicial=False, manter=False):
+        t0 = time.perf_counter()
+        df_src = self.df_all   # filtrar_contratos não altera a base: sem cópia
+        self._sort_cache = {}
         if df_src.empty:
-            self.df = df_src
+            self._df_base = self.df = df_src
+            self._indexar_clientes()
             self._render_lista()
             return
 
@@ -1122,32 +4658,29 @@ class TelaDados(tk.Tk):
         if self.var_cpc.get(): conjuntos.append(self.set_cpc)
         if self.var_nao.get(): conjuntos.append(self.set_nao)
 
-        if not conjuntos:
-            df_filtrado = df_src
-        else:
-            allow = set().union(*conjuntos) if conjuntos else set()
-            df_filtrado = df_src[df_src["contrato"].astype(str).isin(allow)]
-
         cor = (self.color_var.get() or "todos").lower()
-        if cor != "todos":
-            s = pd.to_datetime(df_filtrado["ultima_data"], errors="coerce")
-            dias = (pd.Timestamp.today().normalize() - s).dt.days
-
-            if cor == "verde":
-                mask = (dias >= 0) & (dias <= 7)
-            elif cor == "amarelo":
-                mask = (dias >= 8) & (dias <= 30)
-            elif cor == "vermelho":
-                mask = (dias > 30)
-            else:
-                mask = pd.Series([True]*len(df_filtrado), index=df_filtrado.index)
+        df_filtrado = filtrar_contratos(df_src, conjuntos, cor)
 
-            mask = mask & s.notna()
-            df_filtrado = df_filtrado[mask]
-
-        self.df = df_filtrado
+        idx_ant = self.idx
+        atual = str(self.df.iloc[idx_ant]["contrato"]) if manter and not self.df.empty else None
+        self._df_base = df_filtrado
+        self.df = self._df_ordenado()
         self.idx = 0
-        self._render_lista()
+        METRICAS.observar("regua_filtros_ms", (time.perf_counter() - t0) * 1000, **self._mlabels)
+        if not inicial:
+            marcados = "+".join(n for n, v in (("qr", self.var_qr), ("cpc", self.var_cpc),
+                                               ("nao", self.var_nao)) if v.get()) or "nenhum"
+            METRICAS.inc("regua_filtros_total", conjuntos=marcados, cor=cor, **self._mlabels)
+        self._indexar_clientes()
+        if manter:
+            # atualização: continua no mesmo contrato (ou na mesma posição, se ele saiu)
+            pos = posicao_contrato(self.df, atual) if atual is not None else None
+            self._render_lista(idx=pos if pos is not None else min(idx_ant, len(self.df) - 1),
+                               ir_detalhe=False, manter=True)
+        else:
+            self._render_lista()
+        self._atualizar_resumo()
+        self._sincronizar_fila()
         if not inicial:
             txt_cor = {"todos":"todos", "verde":"verdes", "amarelo":"amarelos", "vermelho":"vermelhos"}.get(cor, "todos")
             self.status.config(text=f"Filtros aplicados • {len(self.df)} registros • cor: {txt_cor}")
@@ -1160,18 +4693,117 @@ class TelaDados(tk.Tk):
         self._aplicar_filtros_nmcont()
         self.status.config(text=f"Filtros limpos • {len(self.df)} registros")
 
-    # ---- renderização ----
-    def _render_lista(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
+    # ---- ordenação por cabeçalho ----
+    def _df_ordenado(self):
+        base = self._df_base
+        if self._sort_col is None or base.empty:
+            return base
+        chave = (self._sort_col, self._sort_desc)
+        perm = self._sort_cache.get(chave)
+        if perm is None:
+            perm = sort_permutation(base[sort_key_col(self._sort_col)], desc=self._sort_desc)
+            self._sort_cache[chave] = perm
+        return base.iloc[perm]
+
+    def _ordenar_por(self, col):
+        if self._df_base.empty:
+            return
+        grupo = self._grupo_pendente(SORT_KEYS[col][0])
+        if grupo is not None:
+            # ordenar por coluna sob demanda exige o grupo inteiro
+            self._materializar(grupo, partial(self._ordenar_por, col))
+            return
+        if self._sort_col == col:
+            self._sort_desc = not self._sort_desc
+        else:
+            self._sort_col, self._sort_desc = col, False
 
+        atual = str(self.df.iloc[self.idx]["contrato"]) if not self.df.empty else None
+        self.df = self._df_ordenado()
+        self._indexar_clientes()
+        self._atualizar_cabecalhos()
+
+        novo_idx = posicao_contrato(self.df, atual) if atual is not None else None
+        self._render_lista(idx=novo_idx or 0, ir_detalhe=False)
+        seta = "▼" if self._sort_desc else "▲"
+        self.status.config(text=f"Ordenado por {col.upper()} {seta} • {len(self.df)} registros")
+
+    def _atualizar_cabecalhos(self):
+        for c in SORT_KEYS:
+            txt = c.upper()
+            if c == self._sort_col:
+                txt += " ▼" if self._sort_desc else " ▲"
+            self.tree.heading(c, text=txt)
+
+    # ---- renderização ----
+    def _paginado(self):
+        return isinstance(self.df, VisaoPaginada)
+
+    def _pagina_de(self, idx):
+        """(início, fim) das linhas do df mostradas na Lista para o índice idx."""
+        if not self._paginado():
+            return 0, len(self.df)
+        ini = (idx // LISTA_PAGINA) * LISTA_PAGINA
+        return ini, min(ini + LISTA_PAGINA, len(self.df))
+
+    def _mudar_pagina(self, passo):
+        alvo = self._pag_ini + passo * LISTA_PAGINA
+        if 0 <= alvo < len(self.df):
+            self._render_lista(idx=alvo, ir_detalhe=False)
+
+    def _sincronizar_pagina(self):
+        """Ao abrir a Lista: redesenha se a navegação no Detalhe saiu da página mostrada."""
+        if self._paginado() and not self._pag_ini <= self.idx < self._pag_fim \
+                and self.nb.select() == str(self.tab_lista):
+            self._render_lista(idx=self.idx, ir_detalhe=False)
+
+    def _render_lista(self, idx=0, ir_detalhe=True, manter=False):
+        """
+        Desenha a página atual da Lista reconciliando com o que já está na
+        Treeview; manter=True (atualização) não rola até o índice.
+        """
+        t0 = time.perf_counter()
         if self.df.empty:
+            self.tree.delete(*self.tree.get_children())
+            self._tree_items, self._tree_linhas, self._tree_hash = {}, {}, {}
+            self._pag_ini = self._pag_fim = 0
+            self.pag_bar.grid_remove()
             self._limpar_detalhe()
             return
 
-        hoje_norm = pd.Timestamp.today().normalize()
+        idx = idx if 0 <= idx < len(self.df) else 0
+        self._pag_ini, self._pag_fim = self._pagina_de(idx)
+        if self._paginado():
+            self.lbl_pag.config(text=f"Linhas {self._pag_ini + 1}–{self._pag_fim} de {len(self.df)}")
+            self.btn_pag_prev.config(state="normal" if self._pag_ini > 0 else "disabled")
+            self.btn_pag_next.config(state="normal" if self._pag_fim < len(self.df) else "disabled")
+            self.pag_bar.grid()
+        else:
+            self.pag_bar.grid_remove()
+
+        self._reconciliar_lista(self._linhas_lista())
 
-        for _, r in self.df.iterrows():
+        agora = time.perf_counter()
+        METRICAS.observar("regua_lista_render_ms", (agora - t0) * 1000, **self._mlabels)
+        if self._t_abertura is not None:
+            METRICAS.observar("regua_tela_dados_abertura_ms", (agora - self._t_abertura) * 1000,
+                              origem=self._origem_carga, **self._mlabels)
+            self._t_abertura = None
+
+        self.idx = idx
+        self._mostrar_atual()
+        self._atualizar_botoes()
+        if ir_detalhe:
+            self.nb.select(self.tab_detalhe)
+        elif not manter:
+            kids = self.tree.get_children()
+            if kids:
+                self.tree.see(kids[self.idx - self._pag_ini])
+
+    def _linhas_lista(self):
+        """(chave, valores, tags) das linhas da página; chave = (contrato, ocorrência)."""
+        vistos = {}
+        for _, r in self.df.iloc[self._pag_ini:self._pag_fim].iterrows():
             contrato = str(r["contrato"])
             nome     = str(r["nomecli"])
             cpf_fmt  = fmt_cpf_cnpj(r["cpfcnpj"])
@@ -1180,85 +4812,260 @@ class TelaDados(tk.Tk):
             s_data = pd.to_datetime(r["ultima_data"], errors="coerce")
             dt = str(s_data.date()) if pd.notna(s_data) else ""
 
-            tags = ()
-            if pd.notna(s_data):
-                try:
-                    dias = (hoje_norm - s_data.normalize()).days
-                    if dias <= 7:
-                        tags = ("verde",)
-                    elif dias <= 30:
-                        tags = ("amarelo",)
-                    else:
-                        tags = ("vermelho",)
-                except Exception:
-                    pass
-
-            s_aco = pd.to_datetime(r.get("data_aco"), errors="coerce")
-            aco_dt = str(s_aco.date()) if pd.notna(s_aco) else ""
+            tags = (r["_cor"],) if r["_cor"] else ()
 
-            val = r.get("vlr_aco")
-            if pd.isna(val):
-                aco_vlr = ""
+            if self._lazy is not None and not self._lazy.carregado("acordo", contrato):
+                aco_dt = aco_vlr = aco_qtd = "…"
             else:
-                try:
-                    aco_vlr = f"R$ {float(val):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-                except Exception:
-                    aco_vlr = str(val)
+                aco_dt, aco_vlr, aco_qtd = self._celulas_acordo(self._com_sob_demanda(r, contrato))
+
+            n = vistos[contrato] = vistos.get(contrato, -1) + 1
+            yield (contrato, n), (contrato, nome, cpf_fmt, usuario, dt, aco_dt, aco_vlr, aco_qtd), tags
+
+    def _reconciliar_lista(self, linhas):
+        """
+        Aplica na Treeview só o que mudou: itens de contratos que saíram são
+        apagados, os novos inseridos e os existentes reescritos apenas se o
+        hash dos valores/tags mudou; a ordem é acertada numa única chamada.
+        Itens que ficam mantêm seleção e rolagem.
+        """
+        antigos, antigos_hash = self._tree_linhas, self._tree_hash
+        self._tree_items, self._tree_linhas, self._tree_hash = {}, {}, {}
+        ordem = []
+        n_ins = n_upd = 0
+        for chave, valores, tags in linhas:
+            h = hash((valores, tags))
+            item = antigos.pop(chave, None)
+            if item is None:
+                item = self.tree.insert("", "end", values=valores, tags=tags)
+                n_ins += 1
+            elif antigos_hash.get(item) != h:
+                self.tree.item(item, values=valores, tags=tags)
+                n_upd += 1
+            self._tree_linhas[chave] = item
+            self._tree_hash[item] = h
+            self._tree_items.setdefault(chave[0], []).append(item)
+            ordem.append(item)
+
+        if antigos:
+            self.tree.delete(*antigos.values())
+        if self.tree.get_children() != tuple(ordem):
+            self.tree.set_children("", *ordem)
+        for op, n in (("inserida", n_ins), ("alterada", n_upd), ("removida", len(antigos))):
+            if n:
+                METRICAS.inc("regua_lista_linhas_total", n, op=op, **self._mlabels)
+
+    @staticmethod
+    def _celulas_acordo(r):
+        """(data, valor, parcelas) do acordo formatados para a Lista."""
+        s_aco = pd.to_datetime(r.get("data_aco"), errors="coerce")
+        aco_dt = str(s_aco.date()) if pd.notna(s_aco) else ""
+
+        val = r.get("vlr_aco")
+        if pd.isna(val):
+            aco_vlr = ""
+        else:
+            try:
+                aco_vlr = fmt_brl(val)
+            except Exception:
+                aco_vlr = str(val)
 
-            qtd = r.get("qtd_p_aco")
-            if pd.isna(qtd):
-                aco_qtd = ""
-            else:
-                try:
-                    aco_qtd = str(int(qtd))
-                except Exception:
-                    aco_qtd = str(qtd)
+        qtd = r.get("qtd_p_aco")
+        if pd.isna(qtd):
+            aco_qtd = ""
+        else:
+            try:
+                aco_qtd = str(int(qtd))
+            except Exception:
+                aco_qtd = str(qtd)
+        return aco_dt, aco_vlr, aco_qtd
+
+    # ---- colunas sob demanda ----
+    def _com_sob_demanda(self, row, contrato):
+        """Linha do df com as colunas de acordo/perfil já carregadas do cache."""
+        if self._lazy is None:
+            return row
+        extra = self._lazy.valores(contrato)
+        if not extra:
+            return row
+        row = row.copy()
+        for k, v in extra.items():
+            row[k] = v
+        return row
+
+    def _pedir_colunas(self, grupo, contratos):
+        """Dispara o lote do grupo para os contratos que ainda faltam."""
+        if self._lazy is None:
+            return
+        faltam = self._lazy.reservar(grupo, contratos)
+        if not faltam:
+            return
+        token = CancelToken()
+        self._lazy_tokens.add(token)
+        self.tasks.submit(self._lazy.buscar, grupo, faltam, token=token,
+                          on_done=lambda res: (self._lazy_tokens.discard(token), self._on_colunas(res)),
+                          on_error=lambda e: self._lazy_tokens.discard(token))
+
+    def _pedir_vizinhos(self):
+        """Atual primeiro, depois os vizinhos na ordem de navegação."""
+        if self._lazy is None or self.df.empty:
+            return
+        n = len(self.df)
+        ordem = [self.idx]
+        for d in range(1, LAZY_VIZINHOS + 1):
+            ordem += [i for i in (self.idx + d, self.idx - d) if 0 <= i < n]
+        contratos = self.df.iloc[ordem]["contrato"].astype(str).tolist()
+        for grupo in LAZY_GRUPOS:
+            self._pedir_colunas(grupo, contratos)
+
+    def _agendar_visiveis(self):
+        if self._lazy is None or self._lazy_job is not None:
+            return
+        self._lazy_job = self.after(150, self._pedir_visiveis)
 
-            self.tree.insert(
-                "", "end",
-                values=(contrato, nome, cpf_fmt, usuario, dt, aco_dt, aco_vlr, aco_qtd),
-                tags=tags
-            )
+    def _pedir_visiveis(self):
+        """Lista: acordo das linhas visíveis (mais uma página de cada lado)."""
+        self._lazy_job = None
+        if self._lazy is None or self.df.empty or self.nb.select() != str(self.tab_lista):
+            return
+        first, last = (float(x) for x in self.tree.yview())
+        n = self._pag_fim - self._pag_ini
+        i0, i1 = int(first * n), int(np.ceil(last * n))
+        pagina = max(i1 - i0, 1)
+        fatia = self.df.iloc[self._pag_ini + max(0, i0 - pagina):self._pag_ini + min(n, i1 + pagina)]
+        self._pedir_colunas("acordo", fatia["contrato"].astype(str).tolist())
+
+    def _on_colunas(self, res):
+        grupo, contratos = res
+        if grupo == "acordo":
+            for c in contratos:
+                itens = self._tree_items.get(c)
+                if not itens:
+                    continue
+                cells = self._celulas_acordo(self._lazy.valores(c))
+                for item in itens:
+                    self._tree_hash.pop(item, None)   # célula mudou fora da reconciliação
+                    try:
+                        for col, v in zip(("aco_dt", "aco_vlr", "aco_qtd"), cells):
+                            self.tree.set(item, col, v)
+                    except tk.TclError:
+                        pass
+        if not self.df.empty and (self._contratos_cliente & set(contratos)
+                                  or str(self.df.iloc[self.idx]["contrato"]) in contratos):
+            self._mostrar_atual()
 
-        self.idx = 0
-        self._mostrar_atual()
-        self._atualizar_botoes()
-        self.nb.select(self.tab_detalhe)
+    # ---- resumo ----
+    def _atualizar_resumo(self):
+        """Leva o cubo à base atual (em segundo plano, só as diferenças) e redesenha a aba, se aberta."""
+        if self.nb.select() != str(self.tab_resumo) or self.df_all.empty:
+            return
+        if self._grupo_pendente("vlr_aco") is not None:
+            # os totais de acordo precisam do grupo inteiro
+            if not self._resumo_acordos:
+                self._resumo_acordos = True
+                self._materializar("acordo", self._acordos_do_resumo)
+            return
+        if self._resumo_token is not None:
+            self._resumo_token.cancel()
+        self._resumo_token = self.tasks.submit(
+            self._resumo.atualizar, self.df_all, self.set_qr, self.set_cpc, self.set_nao,
+            on_done=lambda _n: self._desenhar_resumo(), on_error=partial(self._on_erro_visao, "resumo"))
+
+    def _acordos_do_resumo(self):
+        self._resumo_acordos = False
+        self._atualizar_resumo()
+
+    def _desenhar_resumo(self):
+        self._resumo_token = None
+        conjuntos = [k for k, v in (("qr", self.var_qr), ("cpc", self.var_cpc), ("nao", self.var_nao)) if v.get()]
+        cor = (self.color_var.get() or "todos").lower()
+        tab = self._resumo.visao(conjuntos, cor)
+
+        def valores(r):
+            return (*(str(int(r[c])) for c in ("n", "qr", "cpc", "nao", "acordos")), fmt_brl(r["vlr"]))
+
+        t = self.tree_resumo
+        abertos = {t.item(i, "text") for i in t.get_children() if t.item(i, "open")}
+        t.delete(*t.get_children())
+        for op, grupo in tab.groupby(level=0, sort=True):
+            nome = op or "(sem operador)"
+            pai = t.insert("", "end", text=nome, values=valores(grupo.sum()), open=nome in abertos)
+            for (_op, faixa), r in grupo.iterrows():
+                t.insert(pai, "end", text=faixa or "(sem data)", values=valores(r),
+                         tags=(faixa,) if faixa else ())
+        if not tab.empty:
+            t.insert("", "end", text="TOTAL", values=valores(tab.sum()))
+        self.lbl_resumo.config(text=f"Conjuntos: {' + '.join(c.upper() for c in conjuntos) or 'todos'}  |  "
+                                    f"Cor: {cor}  |  {tab.index.get_level_values(0).nunique()} operadores")
+
+    def _grupo_pendente(self, coluna):
+        """Grupo sob demanda da coluna se ainda não foi carregado por inteiro."""
+        if self._lazy is None:
+            return None
+        for grupo, cols in LAZY_GRUPOS.items():
+            if coluna in cols and grupo not in self._lazy.completos:
+                return grupo
+        return None
+
+    def _materializar(self, grupo, depois):
+        """Carrega o grupo para a seleção inteira e o incorpora à base."""
+        self.set_busy(True, f"Carregando {grupo} de todos os contratos...")
+        contratos = self.df_all["contrato"].astype(str).tolist()
+
+        def _incorporar(base):
+            self.df_all = base
+            self.app.sessao.put(self.carteiras, self.operador,
+                                (self.df_all, self.set_qr, self.set_cpc, self.set_nao))
+            if isinstance(base, BaseMapeada):
+                # mesmas linhas, na mesma ordem: as posições da visão continuam valendo
+                self._df_base = VisaoPaginada(base, self._df_base.pos)
+            else:
+                self._df_base = self._df_base.assign(**{c: self.df_all[c] for c in
+                                                        LAZY_GRUPOS[grupo] + [sort_key_col(k) for k in SORT_KEYS]})
+            self._sort_cache = {}
+            self.set_busy(False, "Pronto")
+            depois()
+
+        def _pronto(_res):
+            if isinstance(self.df_all, BaseMapeada):
+                # reescreve o arquivo com o grupo, em segundo plano
+                self._lazy_tokens.add(self.tasks.submit(
+                    self.df_all.completar, self._lazy, grupo,
+                    on_done=_incorporar, on_error=self._on_error))
+                return
+            _incorporar(build_sort_keys(self._lazy.completar(self.df_all, grupo)))
+
+        self._lazy_tokens.add(self.tasks.submit(
+            self._lazy.buscar, grupo, contratos, todos=True,
+            on_done=_pronto, on_error=self._on_error))
 
     def _limpar_detalhe(self):
-        bg = self.detail_bg.get()
-        try:
-            self.lbl_contrato.config(text="—", bg=bg)
-            self.lbl_usuario.config(text="—", bg=bg)
-            self.lbl_nome.config(text="—", bg=bg)
-            self.lbl_cpf.config(text="—", bg=bg)
-            self.lbl_data.config(text="—", bg=bg)
-            self.lbl_aco_data.config(text="—", bg=bg)
-            self.lbl_aco_valor.config(text="—", bg=bg)
-            self.lbl_aco_qtd.config(text="—", bg=bg)
-            self.lbl_cpc_data.config(text="—", bg=bg)
-            self.lbl_infoad.config(text="—", bg=bg)
-            self.lbl_comprom.config(text="—", bg=bg)
-            self.lbl_flag_apos.config(text="—", bg=bg)
-            self.lbl_flag_bolsa.config(text="—", bg=bg)
-            self.lbl_flag_veic.config(text="—", bg=bg)
-            self.lbl_flag_vinc.config(text="—", bg=bg)
-            self.lbl_flag_obito.config(text="—", bg=bg)
-            self.lbl_qtdaco.config(text="—", bg=bg)
-        except Exception:
-            pass
+        self._painel.cancelar()
+        bg = CORES_DETALHE[self.dark_var.get()][""]
+        if self.detail_bg.get() != bg:
+            self.detail_bg.set(bg)
+        self._painel.render({k: "—" for k in self._painel.values}, bg, self._current_fg())
 
         self.btn_prev.config(state="disabled")
         self.btn_next.config(state="disabled")
 
     def _mostrar_atual(self):
+        """Agenda o desenho do registro atual; vários pedidos seguidos viram um só."""
+        self._painel.agendar(self._produzir_detalhe)
+
+    def _produzir_detalhe(self):
+        if self.df.empty:
+            return None
+        self.idx = min(max(self.idx, 0), len(self.df) - 1)
         row = self.df.iloc[self.idx]
+        self._atualizar_botoes()
+        if self._lazy is not None:
+            self._pedir_vizinhos()
+            row = self._com_sob_demanda(row, str(row["contrato"]))
 
-        bg = cor_por_data(row["ultima_data"], dark=self.dark_var.get()) if pd.notna(row["ultima_data"]) else (
-            "#ffffff" if not self.dark_var.get() else "#0f1115"
-        )
-        self.detail_bg.set(bg)
-        self._update_detail_bgs(bg)
+        bg = CORES_DETALHE[self.dark_var.get()][row.get("_cor") or ""]
+        if self.detail_bg.get() != bg:
+            self.detail_bg.set(bg)
 
         contrato = str(row["contrato"])
         nome = str(row["nomecli"])
@@ -1299,25 +5106,6 @@ class TelaDados(tk.Tk):
         except Exception:
             cpc_dt = "" if pd.isna(row.get("dt_ultimo_cpc")) else str(row.get("dt_ultimo_cpc"))
 
-        # Perfil
-        infoad = str(row.get("infoad") or "").strip()
-        comprom = str(row.get("comprom_txt") or "")
-        f_apos  = str(row.get("flag_apos_txt") or "—")
-        f_bolsa = str(row.get("flag_bolsa_txt") or "—")
-        f_veic  = str(row.get("flag_veic_txt") or "—")
-        f_vinc  = str(row.get("flag_vinc_txt") or "—")
-        f_obito = str(row.get("flag_obito_txt") or "—")
-
-        self.lbl_contrato.config(text=contrato, bg=bg)
-        self.lbl_usuario.config(text=usuario, bg=bg)
-        self.lbl_nome.config(text=nome, bg=bg)
-        self.lbl_cpf.config(text=cpf_fmt, bg=bg)
-        self.lbl_data.config(text=dt, bg=bg)
-
-        self.lbl_aco_data.config(text=aco_dt, bg=bg)
-        self.lbl_aco_valor.config(text=aco_val, bg=bg)
-        self.lbl_aco_qtd.config(text=aco_qtd, bg=bg)
-        self.lbl_cpc_data.config(text=cpc_dt, bg=bg)
         # qtdaco (quantidade de propostas formalizadas)
         qtdaco_val = row.get("qtdaco")
         if pd.isna(qtdaco_val) or qtdaco_val is None or str(qtdaco_val).strip() == "":
@@ -1328,53 +5116,289 @@ class TelaDados(tk.Tk):
             except Exception:
                 qtdaco_txt = str(qtdaco_val)
 
-        self.lbl_qtdaco.config(text=qtdaco_txt, bg=bg)
+        # Perfil
+        infoad = str(row.get("infoad") or "").strip()
+        comprom = str(row.get("comprom_txt") or "")
+
+        textos = {
+            "contrato": contrato,
+            "usuario": usuario,
+            "nome": nome,
+            "cpf": cpf_fmt,
+            "data": dt,
+            "aco_data": aco_dt,
+            "aco_valor": aco_val,
+            "aco_qtd": aco_qtd,
+            "qtdaco": qtdaco_txt,
+            "cpc_data": cpc_dt,
+            "infoad": infoad or "—",
+            "comprom": comprom or "—",
+            "flag_apos": str(row.get("flag_apos_txt") or "—"),
+            "flag_bolsa": str(row.get("flag_bolsa_txt") or "—"),
+            "flag_veic": str(row.get("flag_veic_txt") or "—"),
+            "flag_vinc": str(row.get("flag_vinc_txt") or "—"),
+            "flag_obito": str(row.get("flag_obito_txt") or "—"),
+        }
+        if self._lazy is not None:
+            for grupo, campos in LAZY_CAMPOS.items():
+                if not self._lazy.carregado(grupo, contrato):
+                    textos.update(dict.fromkeys(campos, "…"))
+        textos["cliente"] = self._desenhar_cliente()
+        self._atualizar_tempo()
+        return textos, bg, self._current_fg()
+
+    # ---- linha do tempo ----
+    def _atualizar_tempo(self, mais=False):
+        """Linha do tempo do contrato atual (aba aberta): o que está no LRU aparece na hora, o resto vem em segundo plano."""
+        if self.nb.select() != str(self.tab_tempo) or self.df.empty:
+            return
+        row = self.df.iloc[self.idx]
+        tl = self.app.sessao.tempo.obter(row["cod_cad"], row["contrato"])
+        if tl is not self._tempo:
+            if self._tempo_token is not None:
+                self._tempo_token.cancel()
+                self._tempo_token = None
+            self._tempo, self._tempo_mostrados = tl, 0
+            self.tree_tempo.delete(*self.tree_tempo.get_children())
+        self._desenhar_tempo()
+        if tl.completa or self._tempo_token is not None or (tl.eventos and not mais):
+            return
+        t0 = time.perf_counter()
 
+        def _pronto(_n):
+            self._tempo_token = None
+            METRICAS.observar("regua_tempo_ms", (time.perf_counter() - t0) * 1000, **self._mlabels)
+            self._desenhar_tempo()
 
-        # perfil
-        self.lbl_infoad.config(text=infoad or "—", bg=bg)
-        self.lbl_comprom.config(text=comprom or "—", bg=bg)
-        self.lbl_flag_apos.config(text=f_apos, bg=bg)
-        self.lbl_flag_bolsa.config(text=f_bolsa, bg=bg)
-        self.lbl_flag_veic.config(text=f_veic, bg=bg)
-        self.lbl_flag_vinc.config(text=f_vinc, bg=bg)
-        self.lbl_flag_obito.config(text=f_obito, bg=bg)
+        def _falhou(e):
+            self._tempo_token = None
+            self.lbl_tempo.config(text=f"Falha ao carregar a linha do tempo: {e}")
 
-        self._refresh_detail_colors()
+        self._tempo_token = self.tasks.submit(tl.mais, fetch_tempo, on_done=_pronto, on_error=_falhou)
+        self._desenhar_tempo()
+
+    def _desenhar_tempo(self):
+        """Os eventos só crescem no fim: insere na Treeview apenas os que faltam."""
+        tl = self._tempo
+        if tl is None:
+            return
+        eventos = tl.eventos
+        for data, fonte, _id, desc, det in eventos[self._tempo_mostrados:]:
+            self.tree_tempo.insert("", "end", values=(
+                data.strftime("%d/%m/%Y %H:%M") if fonte == "hist" else data.strftime("%d/%m/%Y"),
+                "Histórico" if fonte == "hist" else "Acordo", desc, det),
+                tags=("acordo",) if fonte == "acordo" else ())
+        self._tempo_mostrados = len(eventos)
+        carregando = self._tempo_token is not None
+        txt = f"Contrato {tl.chaves['acordo']} • {len(eventos)} evento(s)"
+        if carregando:
+            txt += " • carregando…"
+        elif tl.completa:
+            txt += " • histórico completo"
+        self.lbl_tempo.config(text=txt)
+        self.btn_tempo_mais.config(state="disabled" if carregando or tl.completa else "normal")
+
+    # ---- cliente (todos os contratos do CPF/CNPJ) ----
+    def _indexar_clientes(self):
+        """A visão mudou (filtro/ordem/recarga): as posições antigas não valem mais; reindexa em segundo plano."""
+        self._clientes = self._clientes_de = None
+        if self._clientes_token is not None:
+            self._clientes_token.cancel()
+            self._clientes_token = None
+        if self.df.empty:
+            return
+        visao = self.df
+
+        def _pronto(indice):
+            if self.df is not visao:
+                return   # a visão mudou enquanto indexava: o pedido novo é que vale
+            self._clientes_token = None
+            self._clientes, self._clientes_de = indice, visao
+            self._mostrar_atual()
+
+        self._clientes_token = self.tasks.submit(IndiceClientes.da_visao, self.df,
+                                                 on_done=_pronto, on_error=partial(self._on_erro_visao, "clientes"))
+
+    def _indice_clientes(self):
+        """Índice de clientes, só se foi feito sobre a visão atual (posições de outra visão não valem)."""
+        return self._clientes if self._clientes is not None and self._clientes_de is self.df else None
+
+    def _desenhar_cliente(self):
+        """Preenche a tabela de contratos do cliente atual; devolve o texto agregado para o Detalhe."""
+        indice = self._indice_clientes()
+        if indice is None:
+            return "…"
+        linhas = self.df.iloc[indice.posicoes(indice.cliente(self.idx))]
+        contratos = linhas["contrato"].astype(str).tolist()
+        if self._lazy is not None:
+            self._pedir_colunas("acordo", contratos)
+            linhas = pd.DataFrame([self._com_sob_demanda(r, c) for (_, r), c in zip(linhas.iterrows(), contratos)])
+        self._contratos_cliente = set(contratos)
+
+        def data(v):
+            d = pd.to_datetime(v, errors="coerce")
+            return d.strftime("%d/%m/%Y") if pd.notna(d) else ""
+
+        itens = []
+        for (_, r), c in zip(linhas.iterrows(), contratos):
+            aco_dt, aco_vlr, _qtd = self._celulas_acordo(r)
+            itens.append(((c, str(r["nomeusu"]), data(r["ultima_data"]), data(r.get("dt_ultimo_cpc")),
+                           aco_dt, aco_vlr), (r["_cor"],) if r["_cor"] else ()))
+        if itens != self._cliente_mostrado:
+            self._cliente_mostrado = itens
+            self.tree_cliente.delete(*self.tree_cliente.get_children())
+            for valores, tags in itens:
+                self.tree_cliente.insert("", "end", values=valores, tags=tags)
+
+        r = resumo_cliente(linhas)
+        txt = f"{r['contratos']} contrato(s) • última ação {data(r['ultima_data']) or '—'}"
+        if pd.notna(r["dt_ultimo_cpc"]):
+            txt += f" • último CPC {data(r['dt_ultimo_cpc'])}"
+        if r["acordos"]:
+            txt += f" • {r['acordos']} c/ acordo ({fmt_brl(r['vlr_acordos'])})"
+        if len(r["operadores"]) > 1:
+            txt += f" • operadores: {', '.join(r['operadores'])}"
+        return txt
+
+    def _ir_para_contrato_do_cliente(self, event):
+        item = self.tree_cliente.focus()
+        if item:
+            self._ir_para_contrato(self.tree_cliente.item(item, "values")[0])
 
     # ---- navegação ----
+    def _cliente_atual(self):
+        """Índice do cliente atual no modo Por cliente (None fora dele ou enquanto indexa)."""
+        if not self.var_cliente.get() or self._indice_clientes() is None or self.df.empty:
+            return None
+        return self._clientes.cliente(self.idx)
+
     def _atualizar_botoes(self):
-        self.btn_prev.config(state=("normal" if self.idx > 0 else "disabled"))
-        self.btn_next.config(state=("normal" if self.idx < len(self.df) - 1 else "disabled"))
+        k = self._cliente_atual() if self._fila is None else None
+        if k is not None:
+            self.btn_prev.config(state=("normal" if k > 0 else "disabled"))
+            self.btn_next.config(state=("normal" if k < len(self._clientes) - 1 else "disabled"))
+            self.lbl_fila.config(text=f"Cliente {k + 1} de {len(self._clientes)}")
+        elif self._fila is not None:
+            self.btn_prev.config(state=("normal" if self._fila.tem_anterior() else "disabled"))
+            self.btn_next.config(state=("normal" if self._fila.tem_proximo() else "disabled"))
+            e = self._fila.escore(str(self.df.iloc[self.idx]["contrato"])) if not self.df.empty else None
+            self.lbl_fila.config(text=(f"Escore {e:.2f} • " if e is not None else "")
+                                      + f"{self._fila.restantes()} na fila")
+        else:
+            self.btn_prev.config(state=("normal" if self.idx > 0 else "disabled"))
+            self.btn_next.config(state=("normal" if self.idx < len(self.df) - 1 else "disabled"))
         self.idx_var.set(self.idx + 1)
 
     def anterior(self):
-        if self.idx > 0:
+        k = self._cliente_atual()
+        if self._fila is not None:
+            self._servir_fila(self._fila.anterior)
+        elif k is not None:
+            if k > 0:
+                self.idx = self._clientes.primeira(k - 1)
+                self._mostrar_atual()
+        elif self.idx > 0:
             self.idx -= 1
-            self._mostrar_atual(); self._atualizar_botoes()
+            self._mostrar_atual()
 
     def proximo(self):
-        if self.idx < len(self.df) - 1:
+        k = self._cliente_atual()
+        if self._fila is not None:
+            self._servir_fila(self._fila.proximo)
+        elif k is not None:
+            if k < len(self._clientes) - 1:
+                self.idx = self._clientes.primeira(k + 1)
+                self._mostrar_atual()
+        elif self.idx < len(self.df) - 1:
             self.idx += 1
-            self._mostrar_atual(); self._atualizar_botoes()
+            self._mostrar_atual()
+
+    def _servir_fila(self, andar):
+        """Anda na fila só até contratos que estão na visão atual (a sincronização pode estar a caminho)."""
+        achado = {}
+
+        def na_visao(c):
+            achado["pos"] = posicao_contrato(self.df, c)
+            return achado["pos"] is not None
+
+        if andar(na_visao) is not None:
+            self.idx = achado["pos"]
+            self._mostrar_atual()
+
+    def _ir_para_contrato(self, contrato):
+        pos = posicao_contrato(self.df, contrato) if contrato is not None else None
+        if pos is not None:
+            self.idx = pos
+            self._mostrar_atual()
+
+    def _alternar_cliente(self):
+        if self.var_cliente.get() and self.var_fila.get():
+            # um modo de navegação por vez
+            self.var_fila.set(False)
+            self._alternar_fila()
+        self.lbl_fila.config(text="")
+        self._atualizar_botoes()
+
+    # ---- fila priorizada ----
+    def _alternar_fila(self):
+        if self.var_fila.get():
+            self.var_cliente.set(False)
+        if self._fila_token is not None:
+            self._fila_token.cancel()
+            self._fila_token = None
+        if not self.var_fila.get() or self.df.empty:
+            self.var_fila.set(False)
+            self._fila = None
+            self.lbl_fila.config(text="")
+            self._atualizar_botoes()
+            return
+        if self._grupo_pendente("vlr_aco") is not None:
+            # o escore usa o valor do acordo
+            self._materializar("acordo", self._alternar_fila)
+            return
+        self.set_busy(True, "Montando fila priorizada...")
+
+        def _pronta(fila):
+            self._fila_token = None
+            self._fila = fila
+            self.set_busy(False, f"Fila priorizada • {fila.restantes()} contratos")
+            self.proximo()
+
+        self._fila_token = self.tasks.submit(montar_fila, self.df, self.set_qr, self.set_nao,
+                                             on_done=_pronta, on_error=partial(self._on_erro_visao, "fila"))
+
+    def _sincronizar_fila(self):
+        """Filtro ou recarga: recalcula os escores da visão e atualiza só os que mudaram no heap."""
+        if self._fila is None:
+            return
+        if self._grupo_pendente("vlr_aco") is not None:
+            self._materializar("acordo", self._sincronizar_fila)
+            return
+        if self._fila_token is not None:
+            self._fila_token.cancel()
+
+        fila = self._fila
+
+        def _pronto(res):
+            self._fila_token = None
+            if self._fila is fila:
+                fila.aplicar(*res)
+                self._atualizar_botoes()
+
+        self._fila_token = self.tasks.submit(diferencas_fila, fila, self.df, self.set_qr, self.set_nao,
+                                             on_done=_pronto, on_error=partial(self._on_erro_visao, "fila"))
 
     def _goto(self, i):
         if 0 <= i < len(self.df):
             self.idx = i
-            self._mostrar_atual(); self._atualizar_botoes()
+            self._mostrar_atual()
             self.nb.select(self.tab_detalhe)
 
     def _ir_para_detalhe_por_duplo_clique(self, event):
         item = self.tree.focus()
         if not item: return
-        vals = self.tree.item(item, "values")
-        if not vals: return
-        contrato = vals[0]
-        try:
-            pos = self.df.index[self.df["contrato"].astype(str) == str(contrato)][0]
-            self._goto(int(pos))
-        except Exception:
-            pass
+        # a Lista mostra as linhas [_pag_ini, _pag_fim) do df, na ordem atual
+        self._goto(self._pag_ini + self.tree.index(item))
 
     # ---- copiar ----
     def _copy_to_clipboard(self, texto, btn=None):
@@ -1404,18 +5428,52 @@ class TelaDados(tk.Tk):
 
     # ---- exportar ----
     def _df_export_base(self, df_src):
-        df_exp = df_src.copy()
-        df_exp["CPFCNPJ_Limpo"] = df_exp["cpfcnpj"].apply(only_digits)
-        df_exp["CPFCNPJ_Formatado"] = df_src["cpfcnpj"].apply(fmt_cpf_cnpj)
-        df_exp["ultima_data"] = pd.to_datetime(df_exp["ultima_data"]).dt.date.astype(str)
-        cols = ["contrato","nomecli","CPFCNPJ_Limpo","CPFCNPJ_Formatado","nomeusu","ultima_data"]
-        return df_exp[cols]
+        # só as colunas de saída: a base (ou o bloco) não é copiada inteira
+        cpf = df_src["cpfcnpj"]
+        return pd.DataFrame({
+            "contrato": df_src["contrato"],
+            "nomecli": df_src["nomecli"],
+            "CPFCNPJ_Limpo": cpf.apply(only_digits),
+            "CPFCNPJ_Formatado": cpf.apply(fmt_cpf_cnpj),
+            "nomeusu": df_src["nomeusu"],
+            "ultima_data": pd.to_datetime(df_src["ultima_data"]).dt.date.astype(str),
+        })
+
+    def _exportar_csv(self, tipo, df_src, path):
+        """
+        Grava o CSV no loop asyncio; o aviso de conclusão volta pelo TaskRunner.
+        As colunas de saída são montadas bloco a bloco (modo paginado sem materializar).
+        """
+        n = len(df_src)
+        self.set_busy(True, f"Exportando {n} registros...")
+
+        def _pronto(segundos):
+            self._export_token = None
+            self._metrica_exportacao(tipo, n, path, segundos)
+            self.set_busy(False, f"CSV salvo • {n} linhas em {segundos:.1f}s")
+            messagebox.showinfo("Exportar CSV", f"Arquivo salvo em:\n{path}")
+
+        def _falhou(e):
+            self._export_token = None
+            self.set_busy(False, "Erro")
+            messagebox.showerror("Exportar CSV", f"Falha ao salvar:\n{e}")
+
+        self._export_token = self.tasks.submit_async(
+            exportar_csv_async(df_src, path, preparar=self._df_export_base),
+            on_done=_pronto, on_error=_falhou)
+
+    def _exportacao_em_andamento(self, titulo):
+        if self._export_token is not None:
+            messagebox.showinfo(titulo, "Já existe uma exportação em andamento.")
+            return True
+        return False
 
     def exportar_csv_tudo(self):
         if self.df.empty:
             messagebox.showinfo("Exportar CSV", "Não há registros para exportar.")
             return
-        df_exp = self._df_export_base(self.df)
+        if self._exportacao_em_andamento("Exportar CSV"):
+            return
         path = filedialog.asksaveasfilename(
             title="Salvar CSV (Tudo)",
             defaultextension=".csv",
@@ -1423,24 +5481,21 @@ class TelaDados(tk.Tk):
             initialfile=f"lista_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         )
         if not path: return
-        try:
-            df_exp.to_csv(path, index=False, sep=";", encoding="utf-8-sig")
-            messagebox.showinfo("Exportar CSV", f"Arquivo salvo em:\n{path}")
-        except Exception as e:
-            messagebox.showerror("Exportar CSV", f"Falha ao salvar:\n{e}")
+        self._exportar_csv("tudo", self.df, path)
 
     def exportar_csv_selecao(self):
+        if self._exportacao_em_andamento("Exportar Seleção"):
+            return
         sel = self.tree.selection()
         if not sel:
             messagebox.showinfo("Exportar Seleção", "Selecione uma ou mais linhas na aba Lista.")
             self.nb.select(self.tab_lista)
             return
-        contratos = [self.tree.item(i, "values")[0] for i in sel]
-        df_sel = self.df[self.df["contrato"].astype(str).isin([str(c) for c in contratos])]
+        # a Lista mostra as linhas [_pag_ini, _pag_fim) do df: posição = início + índice na árvore
+        df_sel = self.df.iloc[sorted(self._pag_ini + self.tree.index(i) for i in sel)]
         if df_sel.empty:
             messagebox.showinfo("Exportar Seleção", "Seleção vazia.")
             return
-        df_exp = self._df_export_base(df_sel)
         path = filedialog.asksaveasfilename(
             title="Salvar CSV (Seleção)",
             defaultextension=".csv",
@@ -1448,11 +5503,150 @@ class TelaDados(tk.Tk):
             initialfile=f"selecao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         )
         if not path: return
+        self._exportar_csv("selecao", df_sel, path)
+
+    def _metrica_exportacao(self, tipo, linhas, path, segundos):
+        METRICAS.inc("regua_exportacoes_total", tipo=tipo, **self._mlabels)
+        METRICAS.observar("regua_exportacao_ms", segundos * 1000, tipo=tipo, **self._mlabels)
+        METRICAS.observar("regua_exportacao_linhas", linhas, tipo=tipo, **self._mlabels)
         try:
-            df_exp.to_csv(path, index=False, sep=";", encoding="utf-8-sig")
-            messagebox.showinfo("Exportar CSV", f"Arquivo salvo em:\n{path}")
-        except Exception as e:
-            messagebox.showerror("Exportar CSV", f"Falha ao salvar:\n{e}")
+            METRICAS.observar("regua_exportacao_bytes", os.path.getsize(path), tipo=tipo, **self._mlabels)
+        except OSError:
+            pass
+
+    def exportar_emails_lista(self):
+        if self.df.empty:
+            messagebox.showinfo("Exportar E-mails", "Não há registros para exportar.")
+            return
+        if self._exportacao_em_andamento("Exportar E-mails"):
+            return
+        path = filedialog.asksaveasfilename(
+            title="Salvar CSV (E-mails)",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv")],
+            initialfile=f"emails_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        if not path: return
+        self.set_busy(True, f"Exportando e-mails de {len(self.df)} registros...")
+
+        def _pronto(res):
+            linhas, segundos, mapa = res
+            self._export_token = None
+            self.email_map.update(mapa)
+            self._metrica_exportacao("emails", linhas, path, segundos)
+            self.set_busy(False, f"E-mails exportados • {linhas} linhas em {segundos:.1f}s")
+            messagebox.showinfo("Exportar E-mails", f"{linhas} e-mails salvos em:\n{path}")
+
+        def _falhou(e):
+            self._export_token = None
+            self.set_busy(False, "Erro")
+            messagebox.showerror("Exportar E-mails", f"Falha ao exportar:\n{e}")
+
+        self._export_token = self.tasks.submit_async(exportar_emails_async(self.df.copy(), path),
+                                                     on_done=_pronto, on_error=_falhou)
+
+    # ---- diferenças contra a foto anterior ----
+    def relatorio_diferencas(self):
+        if not FOTOS_ENABLED:
+            messagebox.showinfo("Diferenças", "Fotos diárias desligadas (REGUA_FOTOS=0 ou sem pyarrow).")
+            return
+        if self.df_all.empty or self._difs_token is not None:
+            return
+        self.set_busy(True, "Comparando com a foto anterior...")
+
+        def _pronto(res):
+            self._difs_token = None
+            dia, eventos = res
+            self.set_busy(False, "Pronto")
+            if dia is None:
+                messagebox.showinfo("Diferenças", "Ainda não há foto de um dia anterior para esta seleção.\n"
+                                                  "A de hoje foi gravada na carga; o relatório fica disponível amanhã.")
+                return
+            METRICAS.inc("regua_diferencas_total", **self._mlabels)
+            self._popup_diferencas(dia, eventos)
+
+        def _falhou(e):
+            self._difs_token = None
+            self.set_busy(False, "Erro")
+            messagebox.showerror("Diferenças", f"Falha ao comparar as fotos:\n{e}")
+
+        self._difs_token = self.tasks.submit(diferencas_do_dia, self.df_all, self.carteiras, self.operador,
+                                             on_done=_pronto, on_error=_falhou)
+
+    def _popup_diferencas(self, dia, eventos, limite=5000):
+        """Resumo por operador x evento em cima; eventos do operador selecionado embaixo."""
+        win = tk.Toplevel(self)
+        win.title(f"Diferenças desde {dia:%d/%m/%Y}")
+        win.transient(self.app)
+        win.geometry("900x600")
+
+        frm = ttk.Frame(win, padding=10)
+        frm.pack(fill="both", expand=True)
+        frm.columnconfigure(0, weight=1)
+        frm.rowconfigure(1, weight=1)
+        frm.rowconfigure(3, weight=2)
+
+        ttk.Label(frm, text=f"{len(eventos)} eventos entre {dia:%d/%m/%Y} e hoje",
+                  style="Strong.TLabel").grid(row=0, column=0, sticky="w", pady=(0,6))
+
+        resumo = resumo_diferencas(eventos)
+        cols = ["operador"] + EVENTOS_FOTO
+        tree_op = ttk.Treeview(frm, columns=cols, show="headings", height=8, selectmode="browse")
+        for c in cols:
+            tree_op.heading(c, text=c.upper())
+            tree_op.column(c, width=200 if c == "operador" else 90, anchor="w" if c == "operador" else "e")
+        ops = [None] + list(resumo.index)   # iid = posição aqui ("" é a raiz da Treeview)
+        tree_op.insert("", "end", iid="0", values=["(todos)"] + [int(v) for v in resumo.sum()])
+        for i, (op, linha) in enumerate(resumo.iterrows(), 1):
+            tree_op.insert("", "end", iid=str(i), values=[op or "(sem operador)"] + [int(v) for v in linha])
+        tree_op.grid(row=1, column=0, sticky="nsew")
+
+        lbl = ttk.Label(frm, text="")
+        lbl.grid(row=2, column=0, sticky="w", pady=(8,4))
+
+        wrap = ttk.Frame(frm)
+        wrap.grid(row=3, column=0, sticky="nsew")
+        wrap.columnconfigure(0, weight=1)
+        wrap.rowconfigure(0, weight=1)
+        cols_ev = ["contrato", "operador", "evento", "antes", "depois"]
+        tree_ev = ttk.Treeview(wrap, columns=cols_ev, show="headings")
+        for c, w in zip(cols_ev, (130, 180, 90, 180, 180)):
+            tree_ev.heading(c, text=c.upper())
+            tree_ev.column(c, width=w, anchor="w")
+        vsb = ttk.Scrollbar(wrap, orient="vertical", command=tree_ev.yview)
+        tree_ev.configure(yscrollcommand=vsb.set)
+        tree_ev.grid(row=0, column=0, sticky="nsew")
+        vsb.grid(row=0, column=1, sticky="ns")
+
+        def mostrar(*_):
+            sel = tree_op.selection()
+            op = ops[int(sel[0])] if sel else None
+            sub = eventos if op is None else eventos[eventos["operador"].to_numpy() == op]
+            tree_ev.delete(*tree_ev.get_children())
+            for linha in sub.head(limite).itertuples(index=False):
+                tree_ev.insert("", "end", values=[str(v) for v in linha])
+            extra = f" (mostrando {limite}; exporte para ver todos)" if len(sub) > limite else ""
+            nome = "Todos os operadores" if op is None else op or "(sem operador)"
+            lbl.config(text=f"{nome}: {len(sub)} eventos{extra}")
+
+        def exportar():
+            path = filedialog.asksaveasfilename(
+                parent=win, title="Salvar CSV (Diferenças)", defaultextension=".csv",
+                filetypes=[("CSV", "*.csv")],
+                initialfile=f"diferencas_{dia:%Y%m%d}_{datetime.now():%Y%m%d}.csv")
+            if not path:
+                return
+            self.tasks.submit_async(
+                exportar_csv_async(eventos, path),
+                on_done=lambda s: messagebox.showinfo("Diferenças", f"Arquivo salvo em:\n{path}", parent=win),
+                on_error=lambda e: messagebox.showerror("Diferenças", f"Falha ao salvar:\n{e}", parent=win))
+
+        tree_op.bind("<<TreeviewSelect>>", mostrar)
+        btn_bar = ttk.Frame(frm)
+        btn_bar.grid(row=4, column=0, sticky="ew", pady=(10,0))
+        ttk.Button(btn_bar, text="💾 Exportar CSV", command=exportar).pack(side="left")
+        ttk.Button(btn_bar, text="Fechar", command=win.destroy).pack(side="right")
+        tree_op.selection_set("0")
 
     def copiar_detalhe(self):
         if self.df.empty: return
@@ -1468,7 +5662,7 @@ class TelaDados(tk.Tk):
         self._copy_to_clipboard(linha)
 
     def _toggle_dark(self):
-        apply_palette(self, self.dark_var.get())
+        apply_palette(self.app, self.dark_var.get())
         bg_now = self.detail_bg.get()
         self._update_detail_bgs(bg_now)
         self._refresh_detail_colors()
@@ -1478,25 +5672,245 @@ class TelaDados(tk.Tk):
 
     # ---- voltar ----
     def voltar_inicio(self):
-        self._restart = True
-        self.destroy()
+        self.app.after_idle(self.app.mostrar_inicial)
+
+    # ---- troca de tela ----
+    def _bind_app(self, seq, fn):
+        self._binds.append((seq, self.app.bind(seq, fn)))
+
+    def sair(self):
+        """Chamado pelo App antes de destruir a tela: cancela carga e callbacks pendentes."""
+        if self._load_token is not None:
+            self._load_token.cancel()
+        for token in (self._export_token, self._email_token, self._resumo_token, self._fila_token,
+                      self._clientes_token, self._difs_token, self._tempo_token):
+            if token is not None:
+                token.cancel()
+        for token in self._lazy_tokens:
+            token.cancel()
+        self._lazy_tokens = set()
+        if self._lazy_job is not None:
+            self.after_cancel(self._lazy_job)
+            self._lazy_job = None
+        self._painel.cancelar()
+        for seq, fid in self._binds:
+            try: self.app.unbind(seq, fid)
+            except Exception: pass
+        self._binds = []
+        self.app.config(cursor="")
+
+
+# ---------------- Instrumentação (opcional) ----------------
+# Ativada com REGUA_PERF=1 ou com o argumento --perf na linha de comando.
+PERF_STALL_MS     = int(os.environ.get("REGUA_PERF_STALL_MS", "200"))   # limiar de log
+PERF_HEARTBEAT_MS = 100                                                  # batida do monitor
+PERF_DIR          = os.environ.get("REGUA_PERF_DIR", "perf")             # log + .prof
+# métodos envolvidos com cronômetro; os listados em REGUA_PERF_PROFILE rodam sob cProfile
+PERF_METHODS = (
+    "TelaInicial._buscar_operadores", "TelaInicial._atualizar_operadores",
+    "TelaDados._fetch_emails_by_cod", "TelaDados._mostrar_emails_atual", "TelaDados._popup_emails",
+    "TelaDados._on_loaded_with_sets", "TelaDados._aplicar_filtros_nmcont",
+    "TelaDados._render_lista", "TelaDados._produzir_detalhe", "TelaDados._ordenar_por",
+    "TelaDados._desenhar_resumo", "TelaDados._popup_diferencas",
+    "TelaDados.exportar_csv_tudo", "TelaDados.exportar_csv_selecao",
+)
 
-    @property
-    def restart(self):
-        return self._restart
+perf_log = logging.getLogger("regua.perf")
+
+
+def perf_enabled():
+    return os.environ.get("REGUA_PERF", "") not in ("", "0") or "--perf" in sys.argv
+
+
+def _callback_name(fn):
+    while isinstance(fn, partial):
+        fn = fn.func
+    name = getattr(fn, "__qualname__", None) or repr(fn)
+    code = getattr(fn, "__code__", None)
+    if code is not None and "<lambda>" in name:
+        name += f":{code.co_firstlineno}"
+    return name
+
+
+class PerfMonitor:
+    """
+    Monitor de travamentos do loop do Tk:
+      - batida a cada PERF_HEARTBEAT_MS que mede o atraso real do loop;
+      - todo callback Tk (command/bind/after) acima de PERF_STALL_MS vai pro log;
+      - métodos de PERF_METHODS são cronometrados (inclusive chamadas síncronas
+        de banco feitas dentro de callbacks) e os pedidos em REGUA_PERF_PROFILE
+        rodam sob cProfile, gravando <método>_<data>_<n>.prof em PERF_DIR.
+    """
+    def __init__(self, stall_ms=PERF_STALL_MS, out_dir=PERF_DIR, profile=None):
+        self.stall_ms = stall_ms
+        self.out_dir = out_dir
+        if profile is None:
+            profile = os.environ.get("REGUA_PERF_PROFILE", "")
+        self.profile = {p.strip() for p in profile.split(",") if p.strip()}
+        self.max_lag_ms = 0.0
+        self._prof_n = 0
+        self._profiling = threading.local()
+
+    def install(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        if not perf_log.handlers:
+            h = logging.FileHandler(os.path.join(self.out_dir, "regua_perf.log"), encoding="utf-8")
+            h.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+            perf_log.addHandler(h)
+            perf_log.addHandler(logging.StreamHandler())
+            perf_log.setLevel(logging.INFO)
+
+        mon = self
+        orig_call = tk.CallWrapper.__call__
+
+        def __call__(cw, *args):
+            t0 = time.perf_counter()
+            try:
+                return orig_call(cw, *args)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                if ms >= mon.stall_ms:
+                    perf_log.warning("callback lento: %s %.0f ms", _callback_name(cw.func), ms)
+
+        tk.CallWrapper.__call__ = __call__
+
+        g = globals()
+        for qual in PERF_METHODS:
+            cls_name, meth = qual.split(".")
+            cls = g[cls_name]
+            setattr(cls, meth, self._wrap(qual, getattr(cls, meth)))
+        perf_log.info("instrumentação ativa (limiar %d ms, profile: %s)",
+                      self.stall_ms, ", ".join(sorted(self.profile)) or "nenhum")
+        return self
+
+    def _wrap(self, qual, fn):
+        mon = self
+        short = qual.split(".")[-1]
+        use_prof = qual in self.profile or short in self.profile
+
+        def wrapper(*args, **kwargs):
+            prof = None
+            if use_prof and not getattr(mon._profiling, "on", False):
+                prof = cProfile.Profile()
+                mon._profiling.on = True
+                prof.enable()
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                if prof is not None:
+                    prof.disable()
+                    mon._profiling.on = False
+                    mon._dump(short, prof)
+                if ms >= mon.stall_ms:
+                    perf_log.warning("  método %s %.0f ms", qual, ms)
+
+        wrapper.__name__ = fn.__name__
+        wrapper.__qualname__ = fn.__qualname__
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    def _dump(self, name, prof):
+        self._prof_n += 1
+        path = os.path.join(
+            self.out_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self._prof_n}.prof")
+        try:
+            prof.dump_stats(path)
+        except Exception as e:
+            perf_log.warning("falha ao gravar %s: %s", path, e)
+
+    def attach(self, root):
+        """Inicia a batida no loop do `root` (uma vez por janela)."""
+        intervalo = PERF_HEARTBEAT_MS / 1000.0
+
+        def tick(esperado):
+            agora = time.perf_counter()
+            lag = (agora - esperado) * 1000
+            if lag > self.max_lag_ms:
+                self.max_lag_ms = lag
+            if lag >= self.stall_ms:
+                perf_log.warning("loop do Tk travado por %.0f ms (%s)", lag, type(root).__name__)
+            try:
+                root.after(PERF_HEARTBEAT_MS, tick, agora + intervalo)
+            except tk.TclError:
+                pass
+
+        root.after(PERF_HEARTBEAT_MS, tick, time.perf_counter() + intervalo)
+
+
+PERF = None   # PerfMonitor ativo (ver rodar_fluxo)
+
+
+# ---------------- Janela principal ----------------
+class App(tk.Tk):
+    """
+    Janela única do app. TelaInicial e TelaDados são frames trocados dentro
+    dela; fontes, tema, paleta, pool de tarefas e Sessao são criados uma vez.
+    """
+    def __init__(self):
+        super().__init__()
+        self.font_base  = tkfont.Font(family="Segoe UI", size=10)
+        self.font_title = tkfont.Font(family="Segoe UI", size=11, weight="bold")
+        self.font_strong= tkfont.Font(family="Segoe UI", size=10, weight="bold")
+
+        self.style = ttk.Style(self)
+        theme_apply(self, get_initial_theme(self.style))
+        self.option_add("*Font", self.font_base)
+        self.style.configure(".", padding=6)
+        self.style.configure("TButton", padding=(10,6))
+        self.style.configure("Title.TLabel", font=self.font_title)
+        self.style.configure("Strong.TLabel", font=self.font_strong)
+
+        self.dark_var = tk.BooleanVar(value=get_initial_dark())
+        apply_palette(self, self.dark_var.get())
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.sessao = Sessao()
+        self.tasks = TaskRunner(self)
+        self.view = None
+        self.protocol("WM_DELETE_WINDOW", self.fechar)
+
+    def _trocar(self, factory):
+        old, self.view = self.view, None
+        if old is not None:
+            old.sair()
+            old.destroy()
+        self.geometry("")   # deixa a janela se ajustar à nova tela
+        self.view = factory()
+        self.view.grid(row=0, column=0, sticky="nsew")
+
+    def mostrar_inicial(self):
+        self._trocar(lambda: TelaInicial(self))
+
+    def mostrar_dados(self, carteiras, operador):
+        self._trocar(lambda: TelaDados(self, carteiras, operador))
+
+    def fechar(self):
+        if self.view is not None:
+            self.view.sair()
+        self.tasks.shutdown()
+        cancel_prefetch()
+        fechar_aio()
+        METRICAS.parar()
+        if GRAVADOR is not None:
+            GRAVADOR.fechar()
+        self.destroy()
 
 
 def rodar_fluxo():
-    while True:
-        seletor = TelaInicial()
-        seletor.mainloop()
-        carteiras, operador = seletor.resultado
-        if not carteiras:
-            break
-        app = TelaDados(carteiras, operador)
-        app.mainloop()
-        if not app.restart:
-            break
+    global PERF
+    if PERF is None and perf_enabled():
+        PERF = PerfMonitor().install()
+    METRICAS.iniciar()
+    limpar_paginados()   # arquivos do modo paginado de sessões que não fecharam direito
+    app = App()
+    if PERF: PERF.attach(app)
+    app.mostrar_inicial()
+    app.mainloop()
+    cancel_prefetch()
 
 if __name__ == "__main__":
     rodar_fluxo()
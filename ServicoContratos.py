@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Serviço local de contratos (opcional).
+
+Roda uma vez por máquina (ex.: servidor de terminal) e atende as instâncias
+do ReguaTotal por HTTP em 127.0.0.1. Ele é dono do pool de conexões e da
+carga (fatiada + caches) e junta pedidos idênticos simultâneos numa única
+execução no banco (single-flight). Os clientes ligam com REGUA_SERVICE=1.
+
+Todo pedido precisa vir assinado com o segredo de rt.SERVICE_SEGREDO_PATH
+(X-Regua-Nonce + X-Regua-Auth, ver rt.ServiceBackend); sem assinatura válida
+a resposta é 401. As respostas saem assinadas (X-Regua-Assinatura) para o
+cliente saber que falou com o serviço e não com quem ocupou a porta. O
+arquivo do segredo deve ter o acesso do arquivo de credenciais.
+
+    python ServicoContratos.py [--porta 8765]
+
+Endpoints (GET, exceto onde indicado):
+  /health                              -> {"ok": true, ...estatísticas}
+  /operadores?carteiras=517,518        -> JSON com a lista de nomeusu
+  /contratos?carteiras=517&operador=X[&recarregar=1]
+                                       -> resultado em Arrow IPC (ver encode_result)
+  /colunas?grupo=acordo&carteiras=517&contratos=A,B[&todos=1]
+                                       -> colunas sob demanda em Arrow IPC (ver encode_frame)
+  /emails?cod_cad=123                  -> JSON com a lista de e-mails
+  /tempo?fonte=hist&chave=123&data=...&id=...&n=50
+                                       -> página da linha do tempo em Arrow IPC (ver db_tempo)
+
+POST /emails_lote (corpo: cod_cad separados por vírgula) -> e-mails crus em Arrow IPC
+"""
+import argparse, hmac, json, threading, time
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import ReguaTotal as rt
+
+DEFAULT_PORT = int(urlparse(rt.SERVICE_URL).port or 8765)
+
+
+class SingleFlight:
+    """Chamadas com a mesma chave em andamento compartilham uma execução."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"execucoes": 0, "coalescidas": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            fut = self._calls.get(key)
+            lider = fut is None
+            if lider:
+                fut = Future()
+                self._calls[key] = fut
+                self.stats["execucoes"] += 1
+            else:
+                self.stats["coalescidas"] += 1
+        if not lider:
+            return fut.result()
+        try:
+            fut.set_result(fn())
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return fut.result()
+
+
+flight = SingleFlight()
+inicio = time.time()
+
+
+def _carteiras(qs):
+    raw = (qs.get("carteiras") or [""])[0]
+    return sorted({int(c) for c in raw.split(",") if c.strip()})
+
+
+def _operador(qs):
+    return ((qs.get("operador") or [""])[0]).strip() or None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    segredo = None   # bytes; definido em main()
+    _nonce = ""
+
+    def _autorizado(self, body=b""):
+        """Confere a assinatura do pedido; guarda o nonce para assinar a resposta."""
+        self._nonce = ""
+        nonce = self.headers.get("X-Regua-Nonce") or ""
+        try:
+            instante = int(nonce.split(".", 1)[0])
+        except ValueError:
+            return False
+        if not self.segredo or abs(time.time() - instante) > rt.SERVICE_JANELA_S:
+            return False
+        esperado = rt.assinatura_servico(self.segredo, nonce, self.command, self.path, body)
+        if not hmac.compare_digest(self.headers.get("X-Regua-Auth") or "", esperado):
+            return False
+        self._nonce = nonce
+        return True
+
+    def _send(self, status, body, ctype):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        if self._nonce:
+            self.send_header("X-Regua-Assinatura", rt.assinatura_servico(self.segredo, self._nonce, body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, obj, status=200):
+        self._send(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"),
+                   "application/json; charset=utf-8")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        qs = parse_qs(url.query)
+        if not self._autorizado():
+            self._json({"erro": "não autorizado"}, 401); return
+        try:
+            if url.path == "/health":
+                self._json({"ok": True, "uptime_s": round(time.time() - inicio),
+                            "query_version": rt.QUERY_VERSION, **flight.stats})
+
+            elif url.path == "/operadores":
+                carts = _carteiras(qs)
+                ops = flight.do(("operadores", tuple(carts)), lambda: rt.db_operadores(carts))
+                self._json(ops)
+
+            elif url.path == "/contratos":
+                carts, op = _carteiras(qs), _operador(qs)
+                if not carts:
+                    self._json({"erro": "informe carteiras"}, 400); return
+                # a carga "Todos" é a parte cara: coalesce por carteiras e recorta o operador depois;
+                # recarregar (F5) não pega carona numa carga comum já em andamento
+                recarregar = (qs.get("recarregar") or [""])[0] == "1"
+                res = flight.do(("contratos", tuple(carts), recarregar),
+                                lambda: rt.load_dataset(carts, None, recarregar=recarregar))
+                body = flight.do(("contratos_bin", tuple(carts), op, recarregar),
+                                 lambda: rt.encode_result(rt.filter_operador(res, op)))
+                self._send(200, body, "application/vnd.apache.arrow.stream")
+
+            elif url.path == "/colunas":
+                grupo, carts, op = (qs.get("grupo") or [""])[0], _carteiras(qs), _operador(qs)
+                if grupo not in rt.LAZY_GRUPOS or not carts:
+                    self._json({"erro": "informe grupo e carteiras"}, 400); return
+                todos = (qs.get("todos") or [""])[0] == "1"
+                contratos = None if todos else [c for c in (qs.get("contratos") or [""])[0].split(",") if c]
+                key = ("colunas", grupo, tuple(carts), op, None if todos else tuple(contratos))
+                body = flight.do(key, lambda: rt.encode_frame(
+                    rt.load_grupo(grupo, carts, op, contratos)))
+                self._send(200, body, "application/vnd.apache.arrow.stream")
+
+            elif url.path == "/emails":
+                cod = ((qs.get("cod_cad") or [""])[0]).strip()
+                if not cod:
+                    self._json([]); return
+                self._json(flight.do(("emails", cod), lambda: rt.db_emails(cod)))
+
+            elif url.path == "/tempo":
+                fonte, chave = (qs.get("fonte") or [""])[0], ((qs.get("chave") or [""])[0]).strip()
+                if fonte not in rt.FONTES_TEMPO or not chave:
+                    self._json({"erro": "informe fonte e chave"}, 400); return
+                data, ident = (qs.get("data") or [""])[0], (qs.get("id") or [""])[0]
+                cursor = (datetime.fromisoformat(data), int(ident)) if data and ident else None
+                n = min(int((qs.get("n") or [rt.TEMPO_PAGINA])[0]), 1000)
+                self._send(200, rt.encode_frame(rt.db_tempo(fonte, chave, cursor, n)),
+                           "application/vnd.apache.arrow.stream")
+
+            else:
+                self._json({"erro": "não encontrado"}, 404)
+        except Exception as e:
+            self._json({"erro": str(e)}, 500)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        n = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(n) if n else b""
+        if not self._autorizado(body):
+            self._json({"erro": "não autorizado"}, 401); return
+        try:
+            if url.path == "/emails_lote":
+                raw = body.decode("ascii")
+                cods = [c for c in raw.split(",") if c.strip()]
+                self._send(200, rt.encode_frame(rt.db_emails_lote(cods)),
+                           "application/vnd.apache.arrow.stream")
+            else:
+                self._json({"erro": "não encontrado"}, 404)
+        except Exception as e:
+            self._json({"erro": str(e)}, 500)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serviço local de contratos do ReguaTotal")
+    ap.add_argument("--porta", type=int, default=DEFAULT_PORT)
+    args = ap.parse_args()
+    if rt.pa is None:
+        raise SystemExit("O serviço precisa do pyarrow (pip install pyarrow).")
+    Handler.segredo = rt.ler_segredo_servico()
+    if Handler.segredo is None:
+        raise SystemExit(f"Sem segredo do serviço (16+ caracteres) em {rt.SERVICE_SEGREDO_PATH} "
+                         "(ou REGUA_SERVICE_SEGREDO).")
+
+    srv = ThreadingHTTPServer(("127.0.0.1", args.porta), Handler)
+    srv.daemon_threads = True
+    print(f"Serviço de contratos em http://127.0.0.1:{args.porta} (Ctrl+C para sair)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        rt.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
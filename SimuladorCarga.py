@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Simulador de carga: N operadores virtuais executando ao mesmo tempo o fluxo
+real do ReguaTotal contra a base local (BaseLocal.py):
+
+  - lista de operadores da TelaInicial;
+  - carga completa da TelaDados (mesmo caminho do app: fetch_contratos);
+  - trocas de filtro (Q/R, CPC, não acionado, cor) sobre o df carregado;
+  - consultas de e-mail (SQL_EMAILS_ONE) ao abrir contratos;
+  - recargas ocasionais.
+
+Reporta vazão e p50/p95/p99 por tipo de operação e por consulta SQL, além do
+custo no servidor (linhas examinadas, tempo e CPU por digest do
+performance_schema, contadores globais do InnoDB), para comparar mudanças de
+consulta ou de cache de forma objetiva.
+
+    REGUA_CRED_FILE=local.txt python SimuladorCarga.py --operadores 30 --duracao 120
+
+Com REGUA_REPLAY=<pasta> (fixtures gravadas com REGUA_GRAVAR, ver ReguaTotal)
+roda sem banco nenhum: as latências medem o app sobre dados com a forma dos
+reais, e a parte do servidor fica de fora do relatório.
+"""
+import argparse, json, os, random, re, threading, time
+from collections import defaultdict
+
+import numpy as np
+
+# cada operador virtual é "um processo": nada de serviço local por padrão
+os.environ.setdefault("REGUA_SERVICE", "0")
+
+import ReguaTotal as rt
+from BaseLocal import checar_local, conectar
+
+STATUS_GLOBAIS = ("Questions", "Innodb_rows_read", "Handler_read_rnd_next", "Handler_read_key",
+                  "Handler_read_next", "Created_tmp_disk_tables", "Sort_rows", "Select_scan")
+
+
+def classificar_sql(sql):
+    """Nome da consulta do app a partir do texto (ou do DIGEST_TEXT)."""
+    s = " ".join(str(sql).replace("`", "").lower().split())
+    m = re.match(r"execute regua_([a-z_]+?)_\d+", s)
+    if m:
+        # prepared statement do app (ver rt.Preparadas): o nome diz a consulta
+        return {"qr_set": "qr"}.get(m.group(1), m.group(1))
+    for marca, nome in (("enderecos_tb", "emails"), ("acordos_ranked", "qr"),
+                        ("dt_ultimo_cpc", "cpc"), ("not in", "nao"), ("with perf as", "perfil"),
+                        ("with acion as", "main"), ("distinct trim", "operadores")):
+        if marca in s:
+            return nome
+    return "outras"
+
+
+class Latencias:
+    """Coleta thread-safe de durações (ms) por nome."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ms = defaultdict(list)
+        self.erros = defaultdict(int)
+
+    def medir(self, nome, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.erros[nome] += 1
+            raise
+        finally:
+            with self._lock:
+                self.ms[nome].append((time.perf_counter() - t0) * 1000)
+
+    def resumo(self, segundos):
+        out = {}
+        with self._lock:
+            for nome, v in sorted(self.ms.items()):
+                a = np.asarray(v)
+                out[nome] = {
+                    "n": int(a.size), "por_s": round(a.size / segundos, 2),
+                    "p50": round(float(np.percentile(a, 50)), 1),
+                    "p95": round(float(np.percentile(a, 95)), 1),
+                    "p99": round(float(np.percentile(a, 99)), 1),
+                    "max": round(float(a.max()), 1), "erros": self.erros.get(nome, 0),
+                }
+        return out
+
+
+def instrumentar_run_query(lat):
+    """Cronometra cada run_query pelo tipo de consulta (sql:main, sql:qr, ...)."""
+    orig = rt.run_query
+
+    def run_query(sql, conn, *args, **kwargs):
+        return lat.medir("sql:" + classificar_sql(sql), orig, sql, conn, *args, **kwargs)
+
+    rt.run_query = run_query
+
+
+class ServidorStats:
+    """Foto dos contadores do MySQL antes/depois da rodada."""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def foto(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SHOW GLOBAL STATUS")
+            status = {k: int(v) for k, v in cur.fetchall() if k in STATUS_GLOBAIS}
+            digests = {}
+            for cols in ("COUNT_STAR, SUM_ROWS_EXAMINED, SUM_TIMER_WAIT, SUM_CPU_TIME",
+                         "COUNT_STAR, SUM_ROWS_EXAMINED, SUM_TIMER_WAIT, 0"):
+                try:
+                    cur.execute(f"""SELECT DIGEST_TEXT, {cols}
+                                    FROM performance_schema.events_statements_summary_by_digest
+                                    WHERE SCHEMA_NAME = DATABASE()""")
+                    break
+                except Exception:
+                    continue
+            else:
+                return status, {}
+            for txt, n, rows, wait, cpu in cur.fetchall():
+                d = digests.setdefault(classificar_sql(txt), [0, 0, 0, 0])
+                d[0] += int(n or 0); d[1] += int(rows or 0); d[2] += int(wait or 0); d[3] += int(cpu or 0)
+        return status, digests
+
+    @staticmethod
+    def diff(antes, depois):
+        st = {k: depois[0].get(k, 0) - antes[0].get(k, 0) for k in STATUS_GLOBAIS}
+        dg = {}
+        for nome, (n, rows, wait, cpu) in depois[1].items():
+            a = antes[1].get(nome, [0, 0, 0, 0])
+            n, rows, wait, cpu = n - a[0], rows - a[1], wait - a[2], cpu - a[3]
+            if n:
+                # timers do performance_schema são em picossegundos
+                dg[nome] = {"execucoes": n, "linhas_examinadas": rows,
+                            "linhas_por_exec": rows // n, "tempo_s": round(wait / 1e12, 2),
+                            "cpu_s": round(cpu / 1e12, 2)}
+        return {"status": st, "por_consulta": dg}
+
+
+def operador_virtual(i, operador, carteiras, args, lat, parar):
+    rng = random.Random(args.seed + i)
+    # chegada espalhada, como no começo do expediente
+    time.sleep(rng.uniform(0, args.rampa))
+
+    def carregar():
+        res = lat.medir("op:carga", rt.fetch_contratos, carteiras, operador)
+        df = rt.build_sort_keys(res[0].copy())
+        df["_cor"] = rt.color_buckets(df["ultima_data"])
+        return df, res[1:]
+
+    lat.medir("op:operadores", rt.fetch_operadores, carteiras)
+    df, sets = carregar()
+    cods = df["cod_cad"].astype(str).tolist() if not df.empty else []
+
+    while not parar.is_set():
+        parar.wait(rng.expovariate(1.0 / args.pensar) / args.acelerar)
+        if parar.is_set():
+            break
+        r = rng.random()
+        try:
+            if r < args.p_email and cods:
+                lat.medir("op:emails", rt.fetch_emails, rng.choice(cods))
+            elif r < args.p_email + args.p_filtro:
+                marcados = [s for s in sets if rng.random() < 0.4]
+                cor = rng.choice(("todos", "todos", "verde", "amarelo", "vermelho"))
+                lat.medir("op:filtro", rt.filtrar_contratos, df, marcados, cor)
+            elif r < args.p_email + args.p_filtro + args.p_recarga:
+                df, sets = carregar()
+                cods = df["cod_cad"].astype(str).tolist() if not df.empty else []
+        except Exception:
+            pass   # já contado em lat.erros
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulador de operadores concorrentes do ReguaTotal")
+    ap.add_argument("--operadores", type=int, default=20, help="operadores virtuais simultâneos")
+    ap.add_argument("--duracao", type=float, default=60, help="segundos de simulação")
+    ap.add_argument("--rampa", type=float, default=10, help="janela de chegada dos operadores (s)")
+    ap.add_argument("--carteiras", default="517,518,519")
+    ap.add_argument("--pensar", type=float, default=20, help="tempo médio entre ações (s)")
+    ap.add_argument("--acelerar", type=float, default=10, help="divide o tempo de pensar")
+    ap.add_argument("--p-email", type=float, default=0.6)
+    ap.add_argument("--p-filtro", type=float, default=0.3)
+    ap.add_argument("--p-recarga", type=float, default=0.03)
+    ap.add_argument("--p-todos", type=float, default=0.1, help="fração que escolhe operador 'Todos'")
+    ap.add_argument("--cache-compartilhado", action="store_true",
+                    help="mantém os caches do processo entre operadores (padrão: um 'processo' por operador)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="grava o relatório neste arquivo")
+    ap.add_argument("--forcar", action="store_true", help="permite host não-local")
+    args = ap.parse_args()
+
+    replay = rt.REPLAY is not None
+    if not replay:
+        checar_local(rt.DB, args.forcar)
+    carteiras = [int(c) for c in args.carteiras.split(",") if c.strip()]
+    if not args.cache_compartilhado:
+        rt.SHARD_CACHE_TTL_S = 0
+        rt.HOST_CACHE_ENABLED = False
+    if not replay:
+        # cada operador real tem o próprio pool; aqui o pool é um só, então cabe todo mundo
+        rt._pool = rt.ConnectionPool(size=args.operadores * rt.POOL_SIZE, **rt.DB)
+
+    lat = Latencias()
+    instrumentar_run_query(lat)
+
+    rng = random.Random(args.seed)
+    nomes = rt.db_operadores(carteiras)
+    if not nomes:
+        raise SystemExit("Base sem operadores: rode BaseLocal.py antes.")
+    escolhas = [None if rng.random() < args.p_todos else rng.choice(nomes) for _ in range(args.operadores)]
+
+    stats_conn = None if replay else conectar()
+    stats = ServidorStats(stats_conn) if stats_conn else None
+    antes = stats.foto() if stats else None
+
+    parar = threading.Event()
+    threads = [threading.Thread(target=operador_virtual, daemon=True,
+                                args=(i, op, carteiras, args, lat, parar))
+               for i, op in enumerate(escolhas)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duracao)
+    parar.set()
+    for t in threads:
+        t.join(timeout=rt.QUERY_TIMEOUT_S)
+    segundos = time.perf_counter() - t0
+
+    relatorio = {
+        "parametros": {k: v for k, v in vars(args).items() if k != "json"},
+        "segundos": round(segundos, 1),
+        "latencias_ms": lat.resumo(segundos),
+        "servidor": stats.diff(antes, stats.foto()) if stats else {"status": {}, "por_consulta": {}},
+        "prepared": rt.PREPARADAS.resumo(),
+    }
+    if replay:
+        relatorio["replay"] = dict(rt.REPLAY.stats)
+    if stats_conn:
+        stats_conn.close()
+
+    print(f"\n{args.operadores} operadores, {segundos:.0f}s")
+    print(f"{'operação':<16}{'n':>7}{'por_s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'erros':>7}")
+    for nome, r in relatorio["latencias_ms"].items():
+        print(f"{nome:<16}{r['n']:>7}{r['por_s']:>8}{r['p50']:>9}{r['p95']:>9}{r['p99']:>9}{r['erros']:>7}")
+    print("\nservidor (por consulta):")
+    for nome, r in sorted(relatorio["servidor"]["por_consulta"].items()):
+        print(f"  {nome:<12} exec={r['execucoes']:<6} linhas/exec={r['linhas_por_exec']:<10} "
+              f"tempo={r['tempo_s']}s cpu={r['cpu_s']}s")
+    print("servidor (global):", ", ".join(f"{k}={v}" for k, v in relatorio["servidor"]["status"].items()))
+    print("\nprepared statements (parse/plano poupado menos os SET, estimativa):")
+    for nome, r in relatorio["prepared"].items():
+        print(f"  {nome:<12} preparos={r['preparos']:<5} reusos={r['reusos']:<7} "
+              f"prepare={r['preparo_ms']}ms set={r['set_ms']}ms poupado={r['poupado_ms']}ms")
+    if replay:
+        print("\nreplay:", ", ".join(f"{k}={v}" for k, v in relatorio["replay"].items()))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
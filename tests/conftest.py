@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+Ambiente dos testes: o ReguaTotal importa com credenciais de mentira (nenhum
+teste abre conexão), sem métricas, sem serviço local e sem cache do host.
+"""
+import os, sys, tempfile
+
+_CRED = os.path.join(tempfile.mkdtemp(prefix="regua_testes_"), "creds.txt")
+with open(_CRED, "w", encoding="utf-8") as f:
+    f.write("GECOBI_HOST=127.0.0.1\nGECOBI_USER=teste\nGECOBI_PASS=teste\n"
+            "GECOBI_DB=teste\nGECOBI_PORT=3306\n")
+
+os.environ["REGUA_CRED_FILE"] = _CRED
+for _var in ("REGUA_METRICS", "REGUA_SERVICE", "REGUA_HOST_CACHE", "REGUA_PREFETCH"):
+    os.environ[_var] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
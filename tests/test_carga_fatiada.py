@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Carga fatiada por carteira contra a consulta única, com o banco simulado em
+pandas (mesma semântica dos SQL_*): contratos com acordos e cadastros em
+mais de uma carteira escolhem o acordo/perfil de maior cod_aco/cod_cad.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ReguaTotal as rt
+
+CARTEIRAS = [517, 518, 519]
+
+
+def banco(seed=3, n_cad=600, n_aco=1500):
+    rng = np.random.default_rng(seed)
+    nmconts = [f"NM{i:05d}" for i in range(250)]   # poucos contratos: vários cadastros/carteiras por contrato
+    cad = pd.DataFrame({
+        "carteira": rng.choice(CARTEIRAS, n_cad),
+        "cod_cad": rng.permutation(n_cad) + 1000,
+        "nmcont": rng.choice(nmconts, n_cad),
+        "cpfcnpj": [f"{i:011d}" for i in range(n_cad)],
+        "nomecli": [f"CLIENTE {i:04d}" for i in range(n_cad)],
+        "nomeusu": rng.choice(["ANA", "BRUNO"], n_cad),
+        "ultima_data": pd.Timestamp("2026-09-01") + pd.to_timedelta(rng.integers(0, 40, n_cad), unit="D"),
+        "infoad": [f"info {i}" for i in range(n_cad)],
+        "comprometimento_credito": rng.random(n_cad),
+        "cpc": pd.Timestamp("2026-08-01") + pd.to_timedelta(rng.integers(0, 60, n_cad), unit="D"),
+        "al": rng.random(n_cad) < 0.6,
+    })
+    for f in ("flag_aposentado", "flag_bolsafamilia", "flag_veiculo", "flag_vinculo_empregaticio", "flag_obito"):
+        cad[f] = rng.integers(0, 2, n_cad)
+    aco = pd.DataFrame({
+        "carteira": rng.choice(CARTEIRAS, n_aco),
+        "nmcont": rng.choice(nmconts, n_aco),
+        "cod_aco": rng.permutation(n_aco) + 1,
+        "staco": rng.choice(["Q", "E", "C", "q ", "X"], n_aco),
+        "data_aco": pd.Timestamp("2026-07-01") + pd.to_timedelta(rng.integers(0, 90, n_aco), unit="D"),
+        "vlr_aco": rng.integers(100, 5000, n_aco).astype(float),
+        "qtd_p_aco": rng.integers(1, 12, n_aco),
+    })
+    return cad, aco
+
+
+def _topo(df, chave):
+    return df.sort_values(chave, ascending=False).drop_duplicates("nmcont")
+
+
+def simular(cad, aco):
+    """run_prepared falso: nome da consulta + carteiras dos parâmetros -> DataFrame."""
+    def executar(nome, sql, params, conn, token=None):
+        carts = [p for p in params if isinstance(p, int)]
+        c, a = cad[cad["carteira"].isin(carts)], aco[aco["carteira"].isin(carts)]
+        a = a.assign(qtdaco=a.groupby("nmcont")["cod_aco"].transform("size"))
+        if nome == "main":
+            out = c.rename(columns={"nmcont": "contrato"})
+            return out.sort_values(["ultima_data", "nomecli"])[
+                ["cod_cad", "contrato", "cpfcnpj", "nomecli", "nomeusu", "ultima_data"]]
+        if nome in ("qr", "qr_set"):
+            t = _topo(a, "cod_aco")
+            t = t[t["staco"].str.rstrip().str.upper().isin(["Q", "E"])]
+            return t[["nmcont"]] if nome == "qr_set" else t[["nmcont", "data_aco", "vlr_aco", "qtd_p_aco", "qtdaco"]]
+        if nome in ("qr_fatia", "qr_set_fatia"):
+            t = _topo(a, "cod_aco")
+            return t[rt.EMPTY_COLS[nome]]
+        if nome in ("perfil", "perfil_fatia"):
+            return _topo(c, "cod_cad")[rt.EMPTY_COLS[nome]]
+        if nome == "cpc":
+            return c.groupby("nmcont", as_index=False)["cpc"].max().rename(columns={"cpc": "dt_ultimo_cpc"})
+        if nome == "nao":
+            return c.loc[~c["al"], ["nmcont"]].drop_duplicates()
+        raise AssertionError(nome)
+    return executar
+
+
+class PoolFalso:
+    @contextmanager
+    def connection(self):
+        yield None
+
+
+@pytest.fixture
+def db(monkeypatch):
+    cad, aco = banco()
+    monkeypatch.setattr(rt, "run_prepared", simular(cad, aco))
+    monkeypatch.setattr(rt, "get_pool", lambda: PoolFalso())
+    rt.clear_shard_cache()
+    yield
+    rt.clear_shard_cache()
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_fatiada_igual_a_consulta_unica(db, monkeypatch, lazy):
+    monkeypatch.setattr(rt, "LAZY_COLUMNS", lazy)
+    unica = rt.load_contratos(CARTEIRAS, None)
+    fatiada = rt.load_contratos_sharded(CARTEIRAS, None)
+    for a, b in zip(unica[1:], fatiada[1:]):
+        assert a == b
+    pd.testing.assert_frame_equal(unica[0].reset_index(drop=True), fatiada[0].reset_index(drop=True),
+                                  check_dtype=False)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""montar_consulta (template -> sql, params) e o caminho dos prepared statements."""
+import pytest
+
+import ReguaTotal as rt
+
+
+def test_nm_list_aceita_nmcont_nao_numerico():
+    sql, params = rt.montar_consulta(rt.SQL_NMCONT_QR_LOTE, [517], None, lista=["ABC-123", "517000001"])
+    assert "{" not in sql
+    assert params == [517, "ABC-123", "517000001"]
+    assert sql.count("%s") == 3
+
+
+def test_cod_list_vira_int():
+    _sql, params = rt.montar_consulta(rt.SQL_EMAILS_LOTE, lista=["10", " 20 "])
+    assert params == [10, 20, 10, 20]   # {cod_list} aparece duas vezes
+
+
+def test_ordem_dos_parametros_e_operador():
+    tpl = "SELECT '5%' FROM t WHERE a IN ({in_list}) {operador_where} AND b IN ({in_list}){extra_where};"
+    sql, params = rt.montar_consulta(tpl, ["517", 518], " Ana ")
+    assert sql == ("SELECT '5%%' FROM t WHERE a IN (%s,%s)  AND TRIM(usu.nomeusu) = %s "
+                   "AND b IN (%s,%s);")
+    assert params == [517, 518, "Ana", 517, 518]
+    assert type(params[2]) is rt.ParamOperador
+
+
+def test_sem_operador_nao_filtra():
+    sql, params = rt.montar_consulta(rt.SQL_NMCONT_NAO, [517], None)
+    assert "nomeusu) = %s" not in sql
+    assert params == [517] * sql.count("%s")
+
+
+def test_locked_user_prevalece(monkeypatch):
+    monkeypatch.setattr(rt, "LOCKED_USER", "BRUNO")
+    _sql, params = rt.montar_consulta(rt.SQL_NMCONT_NAO, [517], "ANA")
+    assert params[-1] == "BRUNO"
+
+
+def test_prepare_e_set_passam_pelo_cancelamento(monkeypatch):
+    executados = []
+
+    class Cursor:
+        def __enter__(self): return self
+        def __exit__(self, *a): return False
+        def execute(self, sql, params=None): executados.append(sql.split()[0])
+
+    class Conn:
+        def thread_id(self): return 42
+        def cursor(self): return Cursor()
+
+    monkeypatch.setattr(rt, "PREPARED_ENABLED", True)
+    monkeypatch.setattr(rt, "run_query", lambda sql, conn, **kw: executados.append(sql.split()[0]))
+    prep, conn = rt.Preparadas(), Conn()
+    sql, params = rt.montar_consulta(rt.SQL_NMCONT_NAO, [517], "ANA")
+
+    prep.executar("nao", sql, params, conn, token=rt.CancelToken())
+    prep.executar("nao", sql, params, conn, token=rt.CancelToken())
+    assert executados == ["PREPARE", "SET", "EXECUTE", "SET", "EXECUTE"]
+    r = prep.resumo()["nao"]
+    assert (r["preparos"], r["reusos"]) == (1, 1)
+    _p, _r, prepare_ms, set_ms = prep.stats["nao"]
+    assert r["poupado_ms"] == round(prepare_ms - set_ms, 1)   # um reuso poupa um PREPARE, paga dois SET
+
+    token = rt.CancelToken()
+    token.cancel()
+    with pytest.raises(rt.TaskCancelled):
+        prep.executar("nao", sql, params, conn, token=token)
+    assert executados[-1] == "EXECUTE"   # nem o SET saiu
+
+
+def test_cancel_logo_depois_do_attach_solta_e_troca_a_sessao(monkeypatch):
+    """cancel() entre o _attach e a instrução: o KILL sai, o finally espera e reconecta."""
+    eventos = []
+    token = rt.CancelToken()
+    attach = token._attach
+
+    def attach_e_cancela(tid):
+        attach(tid)
+        token.cancel()   # cai na janela entre o _attach e o raise_if_cancelled
+
+    class Conn:
+        def thread_id(self): return 7
+        def close(self): eventos.append("close")
+        def connect(self): eventos.append("connect")
+
+    monkeypatch.setattr(token, "_attach", attach_e_cancela)
+    monkeypatch.setattr(rt, "kill_query", lambda tid: eventos.append(("kill", tid)))
+    with pytest.raises(rt.TaskCancelled):
+        with rt.vigiar_consulta(Conn(), token, timeout=None):
+            eventos.append("executou")
+    assert eventos == [("kill", 7), "close", "connect"]
+    assert not token._running
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Exportação de e-mails: fix_email_series/normalizar_emails contra a correção
+linha a linha (fix_email_py, como db_emails faz por cliente), e a exportação
+em lotes com a consulta substituída por um stub.
+"""
+import asyncio, csv
+
+import numpy as np
+import pandas as pd
+
+import ReguaTotal as rt
+
+BORDAS = [
+    "fulano@gmail.com", "  Fulano@Gmail.COM  ", "a@b.c", "a@b.com.", "a@b.com.b",
+    "a@b.com.r", "a@b.com.br", "a@b.com..", "a@b.com.br.", "a@b.c.", ".c", ".",
+    "...", "", "   ", None, np.nan, "A@B.COM.R", "x@y.org", "x@y.co", "x@y.com.brr",
+]
+
+
+def emails_sinteticos(n, seed=7):
+    rng = np.random.default_rng(seed)
+    nomes = [f"cliente{i}" for i in range(50)]
+    finais = [".com", ".com.br", ".c", ".com.", ".com.b", ".com.r", ".com..", ".org", ""]
+    vals = [f"{' ' * int(rng.integers(0, 2))}{rng.choice(nomes)}@{rng.choice(['gmail', 'UOL', 'bol'])}"
+            f"{rng.choice(finais)}" for _ in range(n)]
+    return [v.upper() if rng.random() < 0.2 else v for v in vals]
+
+
+def test_fix_email_series_igual_a_fix_email_py():
+    entradas = BORDAS + emails_sinteticos(2000)
+    esperado = [rt.fix_email_py(e if isinstance(e, str) else "") for e in entradas]
+    obtido = rt.fix_email_series(pd.Series(entradas, dtype=object)).tolist()
+    assert obtido == esperado
+
+
+def normalizar_ingenuo(df):
+    """Um cliente por vez, na ordem do cadastro e depois dos endereços."""
+    linhas = []
+    for cod, g in df.assign(cod_cad=df["cod_cad"].astype(str).str.strip()).groupby("cod_cad", sort=True):
+        vistos = set()
+        for e in g.sort_values("origem", kind="stable")["email"].tolist():
+            e = rt.fix_email_py(e if isinstance(e, str) else "")
+            if e and e not in vistos:
+                vistos.add(e)
+                linhas.append((cod, e))
+    return linhas
+
+
+def lote_sintetico(cods, seed=11):
+    rng = np.random.default_rng(seed)
+    emails = emails_sinteticos(len(cods) * 3, seed) + BORDAS
+    linhas = [(str(rng.choice(cods)), e, int(rng.integers(0, 2))) for e in emails]
+    return pd.DataFrame(linhas, columns=["cod_cad", "email", "origem"]).sample(frac=1, random_state=3)
+
+
+def test_normalizar_emails_igual_ao_ingenuo():
+    df = lote_sintetico([f" {i} " for i in range(200)])
+    obtido = rt.normalizar_emails(df)
+    assert list(zip(obtido["cod_cad"], obtido["email"])) == normalizar_ingenuo(df)
+
+
+def test_exportar_emails_com_consulta_stub(tmp_path, monkeypatch):
+    n = 1200
+    lista = pd.DataFrame({
+        "cod_cad": [str(i % 900) for i in range(n)],          # cod_cad repetido em vários contratos
+        "contrato": [f"517{i:09d}" for i in range(n)],
+        "nomecli": [f"CLIENTE {i}" for i in range(n)],
+        "cpfcnpj": [f"{i:03d}.456.789-{i % 100:02d}" for i in range(n)],
+    })
+    brutos = lote_sintetico([str(i) for i in range(900)])
+    lotes = []
+
+    def fetch_stub(cods, token=None):
+        lotes.append(list(cods))
+        return brutos[brutos["cod_cad"].isin(cods)]
+
+    monkeypatch.setattr(rt, "fetch_emails_lote", fetch_stub)
+    monkeypatch.setattr(rt, "EMAILS_LOTE", 250)
+    path = str(tmp_path / "emails.csv")
+    linhas, _s, mapa = asyncio.run(rt.exportar_emails_async(lista, path))
+
+    assert [len(l) for l in lotes] == [250, 250, 250, 150]
+    por_cliente = {}
+    for cod, e in normalizar_ingenuo(brutos):
+        por_cliente.setdefault(cod, []).append(e)
+    esperado = [[r.contrato, r.nomecli, "".join(ch for ch in r.cpfcnpj if ch.isdigit()), e]
+                for r in lista.itertuples() for e in por_cliente.get(r.cod_cad, [])]
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        linhas_csv = list(csv.reader(f, delimiter=";"))
+    assert linhas_csv[0] == ["contrato", "nomecli", "CPFCNPJ_Limpo", "email"]
+    assert sorted(linhas_csv[1:]) == sorted(esperado)
+    assert linhas == len(esperado)
+    assert mapa == {str(i): por_cliente.get(str(i), []) for i in range(900)}
+    assert not (tmp_path / "emails.csv.tmp").exists()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Filtro de cor e de conjuntos: a base em memória e a paginada devolvem as mesmas linhas."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import ReguaTotal as rt
+
+
+def base(n=3000, seed=5):
+    rng = np.random.default_rng(seed)
+    hoje = pd.Timestamp.today().normalize()
+    dias = rng.integers(-20, 90, n)   # inclui datas futuras
+    datas = (hoje - pd.to_timedelta(dias, unit="D")).where(rng.random(n) >= 0.1)
+    return pd.DataFrame({
+        "contrato": [f"517{i:09d}" for i in range(n)],
+        "nomecli": [f"CLIENTE {i}" for i in range(n)],
+        "nomeusu": rng.choice(["ANA", "BRUNO"], n),
+        "ultima_data": datas,
+    })
+
+
+def test_faixas_nas_bordas():
+    hoje = pd.Timestamp.today().normalize()
+    dias = [-1, 0, 7, 8, 30, 31, None]
+    s = pd.Series([hoje - pd.Timedelta(days=d) if d is not None else pd.NaT for d in dias])
+    assert list(rt.color_buckets(s)) == ["", "verde", "verde", "amarelo", "amarelo", "vermelho", ""]
+
+
+@pytest.mark.skipif(rt.pa is None, reason="o modo paginado precisa do pyarrow")
+@pytest.mark.parametrize("cor", ["todos", "verde", "amarelo", "vermelho"])
+@pytest.mark.parametrize("com_conjunto", [False, True])
+def test_paginado_igual_a_memoria(tmp_path, monkeypatch, cor, com_conjunto):
+    monkeypatch.setattr(rt, "PAGINADO_DIR", str(tmp_path))
+    df = base()
+    conjuntos = [set(df["contrato"].iloc[::3])] if com_conjunto else []
+    memoria = rt.filtrar_contratos(rt.preparar_base(df), conjuntos, cor)
+    mapeada = rt.preparar_base(df, paginado=True)
+    paginado = rt.filtrar_contratos(mapeada, conjuntos, cor)
+    assert len(paginado) == len(memoria)
+    assert mapeada.coluna("contrato", paginado.pos).tolist() == memoria["contrato"].tolist()
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Fotos diárias: comparar_fotos (hash join) contra a junção ingênua por merge."""
+import os, time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ReguaTotal as rt
+
+pytestmark = pytest.mark.skipif(rt.pa is None, reason="as fotos precisam do pyarrow")
+
+OPERADORES = ["ANA SILVA", "BRUNO LIMA", "CARLA COSTA", ""]
+
+
+def base_sintetica(n, seed, contratos=None):
+    rng = np.random.default_rng(seed)
+    hoje = pd.Timestamp("2026-10-01")
+
+    def datas(p_nula):
+        d = hoje - pd.to_timedelta(rng.integers(0, 90, n), unit="D")
+        return d.where(rng.random(n) >= p_nula)
+
+    return pd.DataFrame({
+        "contrato": contratos if contratos is not None else [f"517{i:09d}" for i in range(n)],
+        "nomeusu": rng.choice(OPERADORES, n),
+        "_cor": rng.choice(rt.FAIXAS_COR, n),
+        "ultima_data": datas(0.1),
+        "dt_ultimo_cpc": datas(0.5),
+        "data_aco": datas(0.6),
+        "vlr_aco": np.where(rng.random(n) < 0.6, np.nan, rng.uniform(100, 5000, n).round(2)),
+        "qtdaco": rng.integers(0, 4, n).astype("float64"),
+    })
+
+
+def evoluir(base, seed):
+    """Dia seguinte: sai parte, entra parte, muda operador/cor/acordo/CPC de alguns."""
+    rng = np.random.default_rng(seed)
+    n = len(base)
+    fica = base[rng.random(n) >= 0.1].reset_index(drop=True)
+    m = len(fica)
+    troca = rng.random(m)
+    fica.loc[troca < 0.1, "nomeusu"] = rng.choice(OPERADORES, int((troca < 0.1).sum()))
+    fica.loc[(troca >= 0.1) & (troca < 0.2), "_cor"] = "vermelho"
+    novo_aco = (troca >= 0.2) & (troca < 0.3)
+    fica.loc[novo_aco, "data_aco"] = pd.Timestamp("2026-10-02")
+    fica.loc[(troca >= 0.3) & (troca < 0.35), "qtdaco"] += 1
+    fica.loc[(troca >= 0.35) & (troca < 0.45), "dt_ultimo_cpc"] = pd.Timestamp("2026-10-02")
+    novos = base_sintetica(n // 10, seed + 1, [f"518{i:09d}" for i in range(n // 10)])
+    return pd.concat([fica, novos], ignore_index=True)
+
+
+def eventos_por_merge(antes, depois):
+    """Referência: merge completo por contrato e comparação linha a linha."""
+    def normal(df):
+        return pd.DataFrame({
+            "contrato": df["contrato"].astype(str),
+            "op": df["nomeusu"].astype(object).where(df["nomeusu"].notna(), "").astype(str),
+            "cor": df["cor"].fillna(0).astype(int),
+            "aco": pd.to_datetime(df["data_aco"], errors="coerce"),
+            "cpc": pd.to_datetime(df["dt_ultimo_cpc"], errors="coerce"),
+            "qtd": df["qtdaco"].fillna(0),
+        })
+
+    m = normal(antes).merge(normal(depois), on="contrato", how="outer",
+                            suffixes=("_a", "_d"), indicator="origem")
+
+    def novo(a, d):
+        return pd.notna(d) and (pd.isna(a) or d > a)
+
+    ev = set()
+    for r in m.itertuples(index=False):
+        if r.origem == "right_only":
+            ev.add((r.contrato, "entrou", r.op_d))
+            continue
+        if r.origem == "left_only":
+            ev.add((r.contrato, "saiu", r.op_a))
+            continue
+        if r.op_a != r.op_d:
+            ev.add((r.contrato, "operador", r.op_d))
+        if r.cor_a != r.cor_d:
+            ev.add((r.contrato, "cor", r.op_d))
+        if novo(r.aco_a, r.aco_d) or r.qtd_d > r.qtd_a:
+            ev.add((r.contrato, "acordo", r.op_d))
+        if novo(r.cpc_a, r.cpc_d):
+            ev.add((r.contrato, "cpc", r.op_d))
+    return ev
+
+
+def fotos(tmp_path, antes, depois):
+    """Grava e relê as duas fotos (mesmo caminho do app: dicionário, date32, int8)."""
+    pa_antes = rt.gravar_foto(antes, [517], None, dia=pd.Timestamp("2026-10-01").date(), pasta=str(tmp_path))
+    pa_depois = rt.gravar_foto(depois, [517], None, dia=pd.Timestamp("2026-10-02").date(), pasta=str(tmp_path))
+    assert pa_antes and pa_depois
+    return rt.ler_foto(pa_antes), rt.ler_foto(pa_depois)
+
+
+def test_comparar_fotos_igual_ao_merge(tmp_path):
+    antes = base_sintetica(5000, 7)
+    fa, fd = fotos(tmp_path, antes, evoluir(antes, 8))
+    eventos = rt.comparar_fotos(fa, fd)
+
+    obtidos = set(zip(eventos["contrato"], eventos["evento"], eventos["operador"]))
+    assert len(obtidos) == len(eventos)   # um evento de cada tipo por contrato
+    assert obtidos == eventos_por_merge(fa, fd)
+    assert set(eventos["evento"]) == set(rt.EVENTOS_FOTO)
+
+    cpc = eventos[eventos["evento"] == "cpc"]
+    dia = pd.to_datetime(fd.set_index("contrato")["dt_ultimo_cpc"]).dt.strftime("%d/%m/%Y")
+    assert (cpc["depois"].to_numpy() == dia.loc[cpc["contrato"]].to_numpy()).all()
+
+
+def test_fotos_iguais_sem_eventos(tmp_path):
+    antes = base_sintetica(1000, 3)
+    fa, fd = fotos(tmp_path, antes, antes)
+    assert rt.comparar_fotos(fa, fd).empty
+
+
+def test_gravar_foto_sem_temporarios(tmp_path):
+    base = base_sintetica(200, 1)
+    base = pd.concat([base, base.iloc[:10]], ignore_index=True)   # contrato repetido (vários acordos)
+    path = rt.gravar_foto(base, [517], "ANA SILVA", pasta=str(tmp_path))
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    assert len(rt.ler_foto(path)) == 200
+
+
+@pytest.mark.skipif(os.environ.get("REGUA_BENCH") != "1", reason="medição: REGUA_BENCH=1")
+def test_desempenho_900k(tmp_path):
+    antes = base_sintetica(900_000, 11)
+    depois = evoluir(antes, 12)
+    t0 = time.perf_counter()
+    fa, fd = fotos(tmp_path, antes, depois)
+    t1 = time.perf_counter()
+    eventos = rt.comparar_fotos(fa, fd)
+    t2 = time.perf_counter()
+    print(f"\n900k contratos: gravar+ler 2 fotos {t1 - t0:.2f}s, comparar {t2 - t1:.2f}s, "
+          f"{len(eventos)} eventos")
+    assert not eventos.empty
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Gravação de fixtures: o sal do manifesto e a gravação do manifesto em lote."""
+import json, os
+
+import pandas as pd
+import pytest
+
+import ReguaTotal as rt
+
+pytestmark = pytest.mark.skipif(rt.pa is None, reason="as fixtures precisam do pyarrow")
+
+DF = pd.DataFrame({"cpfcnpj": ["123.456.789-01"], "nomeusu": ["ANA SILVA"], "n": [1]})
+
+
+def manifesto(pasta):
+    with open(os.path.join(pasta, "manifesto.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_mesmo_sal_continua_a_pasta(tmp_path):
+    g = rt.Gravador(str(tmp_path), rt.Anonimizador("sal-a"))
+    g.gravar("main", [517, rt.ParamOperador("ANA SILVA")], DF, 1.0)
+    g.fechar()
+    g2 = rt.Gravador(str(tmp_path), rt.Anonimizador("sal-a"))
+    g2.gravar("main", [518], DF, 1.0)
+    g2.fechar()
+    m = manifesto(tmp_path)
+    assert len(m["consultas"]) == 2
+    assert m["sal"] == rt.Anonimizador("sal-a").impressao()
+    assert "sal-a" not in json.dumps(m)
+
+
+def test_outro_sal_e_recusado(tmp_path):
+    g = rt.Gravador(str(tmp_path), rt.Anonimizador("sal-a"))
+    g.gravar("main", [517], DF, 1.0)
+    g.fechar()
+    with pytest.raises(RuntimeError, match="REGUA_GRAVAR_SAL"):
+        rt.Gravador(str(tmp_path), rt.Anonimizador("sal-b"))
+    with pytest.raises(RuntimeError):
+        rt.Gravador(str(tmp_path), rt.Anonimizador())   # sal aleatório do processo
+
+
+def test_manifesto_gravado_em_lote(tmp_path, monkeypatch):
+    monkeypatch.setattr(rt, "GRAVAR_MANIFESTO_S", 3600)
+    g = rt.Gravador(str(tmp_path), rt.Anonimizador("sal-a"))
+    for i in range(5):
+        g.gravar("main", [517 + i], DF, 1.0)
+    assert len(manifesto(tmp_path)["consultas"]) == 1   # só a primeira gravação foi ao disco
+    g.fechar()
+    assert len(manifesto(tmp_path)["consultas"]) == 5
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Cache do host: chave por usuário travado e o .lock da carga entre processos."""
+import os, threading, time
+
+import pytest
+
+import ReguaTotal as rt
+
+
+def test_chave_separa_usuario_travado(monkeypatch):
+    livre = rt._host_key([518, 517])
+    monkeypatch.setattr(rt, "LOCKED_USER", "ANA SILVA")
+    ana = rt._host_key([517, 518])
+    monkeypatch.setattr(rt, "LOCKED_USER", "BRUNO LIMA")
+    assert len({livre, ana, rt._host_key([517, 518])}) == 3
+
+
+@pytest.fixture
+def pasta(tmp_path, monkeypatch):
+    monkeypatch.setattr(rt, "HOST_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(rt, "_host_tabelas", lambda carteiras, desde_ms=0: None)
+    return tmp_path
+
+
+def test_lock_renovado_nao_e_tomado(pasta, monkeypatch):
+    monkeypatch.setattr(rt, "HOST_CACHE_BEAT_S", 0.05)
+    monkeypatch.setattr(rt, "HOST_CACHE_LOCK_S", 0.5)
+    dono = rt._host_lock("k", [517])
+    token = rt.CancelToken()
+    pegou = []
+    t = threading.Thread(target=lambda: pegou.append(_tentar(token)))
+    t.start()
+    time.sleep(1.5)   # três vezes o limite de abandono: só a renovação segura o lock
+    assert not pegou
+    dono.soltar()
+    t.join(5)
+    assert isinstance(pegou[0], rt.TravaHost)
+    pegou[0].soltar()
+    assert not os.listdir(pasta)
+
+
+def _tentar(token):
+    try:
+        return rt._host_lock("k", [517], token=token)
+    except rt.TaskCancelled:
+        return None
+
+
+def test_lock_abandonado_e_tomado_e_o_antigo_dono_nao_apaga(pasta, monkeypatch):
+    monkeypatch.setattr(rt, "HOST_CACHE_BEAT_S", 3600)   # dono "travado": não renova
+    monkeypatch.setattr(rt, "HOST_CACHE_LOCK_S", 0.2)
+    velho = rt._host_lock("k", [517])
+    antigo = time.time() - 10
+    os.utime(velho.path, (antigo, antigo))
+    novo = rt._host_lock("k", [517])
+    assert novo.dono != velho.dono
+    velho.soltar()   # o finally do dono antigo não derruba o lock do novo
+    assert rt._ler_dono(novo.path) == novo.dono
+    novo.soltar()
+    assert not os.listdir(pasta)
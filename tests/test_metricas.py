@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Métricas: o .prom do processo some no parar() e os órfãos são podados no iniciar()."""
+import os, time
+
+import ReguaTotal as rt
+
+
+def test_parar_apaga_o_arquivo_do_processo(tmp_path):
+    m = rt.Metricas(enabled=True, out_dir=str(tmp_path))
+    m.inc("regua_filtros_total", operador="X", carteiras="517")
+    m.gravar()
+    assert os.path.exists(m._arquivo())
+    m.parar()
+    assert not os.listdir(tmp_path)
+    m.gravar()   # ciclo atrasado do timer não recria o arquivo
+    assert not os.listdir(tmp_path)
+
+
+def test_iniciar_poda_orfaos(tmp_path):
+    velho = tmp_path / "regua_HOST_999999.prom"
+    tmp_velho = tmp_path / "regua_HOST_999998.prom.tmp"
+    novo = tmp_path / "regua_OUTRO_123.prom"
+    for p in (velho, tmp_velho, novo):
+        p.write_text("x")
+    antigo = time.time() - 2 * rt.METRICS_TTL_S
+    os.utime(velho, (antigo, antigo))
+    os.utime(tmp_velho, (antigo, antigo))
+
+    m = rt.Metricas(enabled=True, out_dir=str(tmp_path))
+    m.iniciar()
+    try:
+        assert sorted(os.listdir(tmp_path)) == [novo.name]
+    finally:
+        m.parar()
+    assert sorted(os.listdir(tmp_path)) == [novo.name]
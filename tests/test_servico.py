@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Serviço local: pedidos e respostas assinados com o segredo compartilhado."""
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import ReguaTotal as rt
+import ServicoContratos as sc
+
+SEGREDO = b"segredo-de-teste-0123456789"
+
+
+@pytest.fixture
+def servico(monkeypatch):
+    monkeypatch.setattr(sc.Handler, "segredo", SEGREDO)
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), sc.Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_cliente_com_o_segredo(servico):
+    assert rt.ServiceBackend(servico, SEGREDO).alive()
+
+
+def test_pedido_sem_segredo_certo_e_recusado(servico):
+    assert not rt.ServiceBackend(servico, b"outro-segredo-0123456789").alive()
+    with pytest.raises(rt.ErroServico, match="401"):
+        rt.ServiceBackend(servico, b"outro-segredo-0123456789").operadores([517])
+
+
+def test_servico_impostor_e_ignorado(servico, monkeypatch):
+    # quem ocupou a porta não conhece o segredo do cliente: a resposta não confere
+    monkeypatch.setattr(sc.Handler, "segredo", b"segredo-do-impostor-0123")
+    monkeypatch.setattr(sc.Handler, "_autorizado", lambda self, body=b"": setattr(self, "_nonce", "x") or True)
+    cliente = rt.ServiceBackend(servico, SEGREDO)
+    assert not cliente.alive()
+    with pytest.raises(rt.ErroServico, match="assinatura"):
+        cliente._get("/health")
+
+
+def test_segredo_curto_ou_ausente(tmp_path):
+    assert rt.ler_segredo_servico(str(tmp_path / "nao_existe.txt")) is None
+    curto = tmp_path / "curto.txt"
+    curto.write_text("abc\n")
+    assert rt.ler_segredo_servico(str(curto)) is None
+    bom = tmp_path / "bom.txt"
+    bom.write_text(SEGREDO.decode() + "\n")
+    assert rt.ler_segredo_servico(str(bom)) == SEGREDO
+
+
+def test_cliente_desligado_por_padrao(monkeypatch):
+    monkeypatch.delenv("REGUA_SERVICE", raising=False)
+    assert rt.get_backend() is rt._direct